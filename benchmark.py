@@ -0,0 +1,176 @@
+"""
+Offline benchmark of the download pipeline.
+
+Every combination of --modes, --workers and --sizes runs in a fresh child
+process with its own temp and output directories, against the LocalFetcher
+stand-in for YouTube, so no network or proxy is needed. Each run prints one
+JSON line with clips/min, CPU seconds per clip, peak RSS and the temp-disk
+high-water mark; --output appends the same lines to a file.
+
+    python benchmark.py --sizes 20 100 --workers 1 4 --latency 0.2 --bandwidth 2e6
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class DiskHighWater:
+    """
+    Samples the size of a directory tree on a background thread and keeps the
+    largest value seen.
+    """
+
+    def __init__(self, path, interval=0.2):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, dir_size(self.path))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, dir_size(self.path))
+        return False
+
+
+def run_one(config):
+    """
+    Run one benchmark configuration in this process and return its results.
+    AUDIOSET_TMP_DIR must already point at config["tmp_dir"].
+    """
+    from main import build_parser
+    from utils.download import parallel_download
+    from utils.fetchers import LocalFetcher
+    from utils.splits import single_split
+    from utils.utils import Data
+
+    data = Data(config["manifest"], config["label_file"])
+    data.take(slice(0, config["size"]))
+    args = build_parser().parse_args([
+        "fetch",
+        "--mode", config["mode"],
+        "--destination_dir", config["out_dir"],
+        "--fetch_workers", str(config["workers"]),
+        "--process_workers", str(min(config["workers"], os.cpu_count() or 1)),
+        "--trace_file", os.path.join(config["tmp_dir"], "trace.jsonl"),
+    ])
+    args.verbose = False
+    fetcher = LocalFetcher(
+        config["media_dir"],
+        latency=config["latency"],
+        bandwidth=config["bandwidth"],
+        error_rate=config["error_rate"],
+        video_length=config["video_length"],
+    )
+    # Make the synthetic source before the clock starts
+    fetcher._ensure_sources()
+
+    start = time.perf_counter()
+    with DiskHighWater(config["tmp_dir"]) as disk:
+        parallel_download([single_split(data, args)], args, fetcher=fetcher)
+    wall = time.perf_counter() - start
+
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = sum(u.ru_utime + u.ru_stime for u in [usage_self, usage_children])
+    done = int(data.download_status.sum())
+    return {
+        "mode": config["mode"],
+        "workers": config["workers"],
+        "size": config["size"],
+        "manifest": os.path.basename(config["manifest"]),
+        "clips_done": done,
+        "wall_seconds": wall,
+        "clips_per_minute": done * 60.0 / wall if wall else 0.0,
+        "cpu_seconds_per_clip": cpu / done if done else None,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": max(usage_self.ru_maxrss, usage_children.ru_maxrss) / 1024,
+        "temp_disk_peak_mb": disk.peak / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+",
+                        default=["only_audio", "only_video", "both_separate", "video"])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[20])
+    parser.add_argument("--manifest", default="./Data_list/balanced_train_segments.csv")
+    parser.add_argument("--label_file", default="./Data_list/labels.csv")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per request")
+    parser.add_argument("--bandwidth", type=float, default=None, help="bytes per second")
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--video_length", type=float, default=60.0, help="seconds")
+    parser.add_argument("--output", help="append the JSON results to this file")
+    parser.add_argument("--run_one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return
+
+    work_dir = tempfile.mkdtemp(prefix="audioset_bench_")
+    media_dir = os.path.join(work_dir, "media")
+    for mode, workers, size in itertools.product(args.modes, args.workers, args.sizes):
+        run_dir = os.path.join(work_dir, f"{mode}_{workers}_{size}")
+        config = {
+            "mode": mode,
+            "workers": workers,
+            "size": size,
+            "manifest": args.manifest,
+            "label_file": args.label_file,
+            "latency": args.latency,
+            "bandwidth": args.bandwidth,
+            "error_rate": args.error_rate,
+            "video_length": args.video_length,
+            "media_dir": media_dir,
+            "tmp_dir": os.path.join(run_dir, "tmp"),
+            "out_dir": os.path.join(run_dir, "out"),
+        }
+        os.makedirs(config["tmp_dir"])
+        env = dict(os.environ, AUDIOSET_TMP_DIR=config["tmp_dir"])
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run_one", json.dumps(config)],
+            env=env,
+            stdout=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True,
+            text=True,
+        )
+        line = child.stdout.strip().splitlines()[-1]
+        print(line, flush=True)
+        if args.output:
+            with open(args.output, "a") as f:
+                f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
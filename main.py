@@ -1,98 +1,467 @@
-import os, shutil
-import argparse
-import time
-
-from utils.utils import read_csv, Data
-from utils.download import parallel_download
-
-from pathlib import Path
-
-
-if __name__ == "__main__":
-    # Clean up temporary files in the root directory at the start of the program
-    root_dir = Path(".")
-    for temp_file in root_dir.glob("*TEMP_MPY*"):
-        try:
-            os.remove(temp_file)
-        except Exception as e:
-            print(f"Failed to remove temp file {temp_file}: {e}")
-    remove_mkv_dir = Path("E:/sedDatasets/AudioSet/tmp")
-
-    for file in remove_mkv_dir.glob("*.mkv"):
-        try:
-            os.remove(file)
-        except Exception as e:
-            print(f"Failed to remove temp file {file}: {e}")
-
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--mode",
-        type=str,
-        choices=["only_audio", "only_video", "both_separate", "video"],
-        help="select the type of the data you are interested in.",
-    )
-    parser.add_argument(
-        "-c",
-        "--classes",
-        nargs="+",
-        type=str,
-        help="list of classes to find in a given directory of audioset files",
-    )
-    parser.add_argument(
-        "-b",
-        "--blacklist",
-        nargs="+",
-        type=str,
-        help="list of classes which will exclude a clip from being downloaded",
-    )
-    parser.add_argument(
-        "-d",
-        "--destination_dir",
-        type=str,
-        help="directory path to put downloaded files into",
-    )
-    parser.add_argument(
-        "-fs",
-        "--sample_rate",
-        type=int,
-        help="Sample rate of audio to download. Default 16kHz (only applicable in audio mode)",
-    )
-    parser.add_argument(
-        "--label_file",
-        type=str,
-        help="Path to CSV file containing AudioSet labels for each class",
-    )
-    parser.add_argument(
-        "--csv_dataset",
-        type=str,
-        help="Path to CSV file containing AudioSet in YouTube-id/timestamp form",
-    )
-    parser.add_argument(
-        "--verbose",
-        action="store_true",
-        help="Print out more information about the download process",
-    )
-
-    parser.set_defaults(
-        mode="both_separate",
-        classes=None,
-        blacklist=None,
-        destination_dir=Path("E:/sedDatasets/AudioSet/balance"),#"./AudioSet",
-        fs=16000,
-        label_file="./Data_list/labels.csv",
-        csv_dataset="./Data_list/balanced_train_segments.csv",
-        verbose=True,
-    )
-
-    args = parser.parse_args()
-
-    # Load data
-    AudioSet = Data(args.csv_dataset, args.label_file, args.classes, args.blacklist)
-
-    # Creat destination folders
-    if os.path.isdir(args.destination_dir) == False:
-        os.mkdir(args.destination_dir)
-        for folder in AudioSet.classes_name:
-            os.mkdir(os.path.join(args.destination_dir, folder))
-
-    parallel_download(AudioSet, args)
\ No newline at end of file
+import os
+import sys
+import argparse
+
+from utils.config import load_config, state_dir
+from utils.utils import DEFAULT_CLASSES, parse_shard
+from utils.resample import parse_variant
+from utils.quota import parse_quota
+from utils.store import LINK_MODES
+
+COMMANDS = ["plan", "status", "fetch", "verify"]
+
+DEFAULTS = dict(
+    mode="both_separate",
+    classes=DEFAULT_CLASSES,
+    blacklist=None,
+    class_quota=None,
+    destination_dir="./AudioSet",
+    tmp_dir=None,
+    proxy=None,
+    sample_rate=[(16000, 1)],
+    label_file="./Data_list/labels.csv",
+    csv_dataset=["./Data_list/balanced_train_segments.csv"],
+    video_codec="auto",
+    fetch_mode="segment",
+    max_height=360,
+    max_fps=30,
+    video_codecs=["avc1"],
+    max_abr=128,
+    max_rate=None,
+    max_gb=None,
+    estimate=0,
+    repair=False,
+    features=False,
+    n_fft=512,
+    hop_length=160,
+    n_mels=64,
+    link_mode="hardlink",
+    link_fallback=True,
+    recheck=False,
+    silence_db=-70.0,
+    fetch_workers=4,
+    process_workers=os.cpu_count(),
+    max_retries=3,
+    queue_size=8,
+    sink="files",
+    shard=None,
+    serve_queue=None,
+    coordinator=None,
+    queue_db=None,
+    lease_seconds=300.0,
+    scratch_dir=None,
+    trim_dir=None,
+    temp_quota_gb=None,
+    metadata_ttl=720.0,
+    prefetch=64,
+    trace_file=None,
+    metrics_port=None,
+    verbose=True,
+)
+
+
+def add_selection_args(parser):
+    parser.add_argument(
+        "--mode",
+        type=str,
+        choices=["only_audio", "only_video", "both_separate", "video"],
+        help="select the type of the data you are interested in.",
+    )
+    parser.add_argument(
+        "-c",
+        "--classes",
+        nargs="+",
+        type=str,
+        help="list of classes to find in a given directory of audioset files",
+    )
+    parser.add_argument(
+        "-b",
+        "--blacklist",
+        nargs="+",
+        type=str,
+        help="list of classes which will exclude a clip from being downloaded",
+    )
+    parser.add_argument(
+        "--class_quota",
+        nargs="+",
+        type=parse_quota,
+        help="download only enough clips to reach a target count per class, given as N for "
+             "every selected class and/or CLASS=N; clips filling the most classes go first",
+    )
+    parser.add_argument(
+        "-d",
+        "--destination_dir",
+        type=str,
+        help="directory path to put downloaded files into ($AUDIOSET_DATA_DIR)",
+    )
+    parser.add_argument(
+        "--tmp_dir",
+        type=str,
+        help="directory for the progress store, caches, logs and scratch space "
+             "($AUDIOSET_TMP_DIR). Default destination_dir/.tmp",
+    )
+    parser.add_argument(
+        "--label_file",
+        type=str,
+        help="Path to CSV file containing AudioSet labels for each class",
+    )
+    parser.add_argument(
+        "--csv_dataset",
+        nargs="+",
+        type=str,
+        help="Paths to CSV files containing AudioSet in YouTube-id/timestamp form ($AUDIOSET_CSV, "
+             "separated by the path separator). With several, each is written to "
+             "destination_dir/<file name> and a video in several of them is fetched once",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        help="only download shard i of N (given as i/N), split by a stable hash of the YouTube id",
+    )
+    parser.add_argument(
+        "--sink",
+        type=str,
+        choices=["files", "shards"],
+        help="write audio as one wav per clip and label (files) or into packed shards under destination_dir/shards",
+    )
+
+
+def add_format_args(parser):
+    parser.add_argument(
+        "--proxy",
+        type=str,
+        help="proxy URL for yt-dlp ($AUDIOSET_PROXY). Default is the HTTP(S)_PROXY environment",
+    )
+    parser.add_argument(
+        "--fetch_mode",
+        type=str,
+        choices=["segment", "full"],
+        help="download only the segment window (falls back to the full video) or always the full video",
+    )
+    parser.add_argument(
+        "--max_height",
+        type=int,
+        help="highest video resolution to download, e.g. 360; 0 for no cap",
+    )
+    parser.add_argument(
+        "--max_fps",
+        type=int,
+        help="highest video frame rate to download; 0 for no cap",
+    )
+    parser.add_argument(
+        "--video_codecs",
+        type=str,
+        nargs="*",
+        help="preferred video codecs in order, as yt-dlp vcodec prefixes (avc1, vp09, av01)",
+    )
+    parser.add_argument(
+        "--max_abr",
+        type=int,
+        help="highest audio bitrate to download in kbps; 0 for no cap",
+    )
+    parser.add_argument(
+        "--max_rate",
+        type=float,
+        help="average download rate limit in MB/s",
+    )
+    parser.add_argument(
+        "--max_gb",
+        type=float,
+        help="stop starting new downloads once this many GB were fetched",
+    )
+    parser.add_argument(
+        "--fetch_workers",
+        type=int,
+        help="Number of threads downloading clips from the network",
+    )
+    parser.add_argument(
+        "--metadata_ttl",
+        type=float,
+        help="hours for which cached video metadata (availability, duration) is trusted",
+    )
+
+
+def add_output_args(parser):
+    parser.add_argument(
+        "-fs",
+        "--sample_rate",
+        nargs="+",
+        type=parse_variant,
+        help="Sample rates of audio to write, as RATE or RATE:CHANNELS (1 or 2). The audio is "
+             "decoded once and resampled to each; the first goes to audio/, the others to "
+             "audio_<rate>hz[_stereo]/. Default 16kHz mono (only applicable in audio mode)",
+    )
+    parser.add_argument(
+        "--process_workers",
+        type=int,
+        help="Number of processes trimming and transcoding clips. Default is the core count",
+    )
+
+
+def add_fetch_args(parser):
+    parser.add_argument(
+        "--video_codec",
+        type=str,
+        choices=["auto", "copy", "libx264"],
+        help="copy the video stream when the cut is on a keyframe (auto), always copy, or always re-encode",
+    )
+    parser.add_argument(
+        "--link_mode",
+        type=str,
+        choices=LINK_MODES,
+        help="how each output, written once to destination_dir/store, is put into its label directories",
+    )
+    parser.add_argument(
+        "--no_link_fallback",
+        dest="link_fallback",
+        action="store_false",
+        help="fail instead of falling back to a symlink or a copy when the link cannot be made, e.g. across filesystems",
+    )
+    parser.add_argument(
+        "--features",
+        action="store_true",
+        help="also compute log-mel features of the first audio variant into memory-mapped arrays "
+             "under destination_dir/features, aligned with the selected clips",
+    )
+    parser.add_argument(
+        "--n_fft",
+        type=int,
+        help="FFT size of the log-mel features, in samples",
+    )
+    parser.add_argument(
+        "--hop_length",
+        type=int,
+        help="hop between log-mel frames, in samples",
+    )
+    parser.add_argument(
+        "--n_mels",
+        type=int,
+        help="number of mel bands of the log-mel features",
+    )
+    parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="download again the clips that verify put on the repair queue",
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        help="Number of retries, with exponential backoff, for transient and throttled failures",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        help="Maximum number of clips waiting between the download and processing stages",
+    )
+    parser.add_argument(
+        "--serve_queue",
+        type=str,
+        help="coordinator mode: serve the selected clips as a lease queue on HOST:PORT",
+    )
+    parser.add_argument(
+        "--coordinator",
+        type=str,
+        help="worker mode: take clips from the coordinator at this URL, e.g. http://host:8765",
+    )
+    parser.add_argument(
+        "--queue_db",
+        type=str,
+        help="SQLite file holding the coordinator's lease queue. Default tmp_dir/queue.sqlite",
+    )
+    parser.add_argument(
+        "--lease_seconds",
+        type=float,
+        help="seconds a worker may hold a clip without a heartbeat before it is handed out again",
+    )
+    parser.add_argument(
+        "--scratch_dir",
+        type=str,
+        help="root of the per-run scratch directories for downloads; runs left by crashes are cleaned up",
+    )
+    parser.add_argument(
+        "--trim_dir",
+        type=str,
+        help="separate scratch root for trimming and resampling, e.g. a tmpfs such as /dev/shm",
+    )
+    parser.add_argument(
+        "--temp_quota_gb",
+        type=float,
+        help="pause new downloads while the scratch directories of all runs hold more than 90%% of this many GB",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        help="number of clips ahead of the downloads whose metadata is requested in advance, 0 to disable",
+    )
+    parser.add_argument(
+        "--trace_file",
+        type=str,
+        help="JSON-lines file that gets one trace with per-stage timings per clip",
+    )
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics while downloading",
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Print out more information about the download process",
+    )
+
+
+def build_parser(config=None):
+    """
+    Build the command line parser. Option defaults come from DEFAULTS,
+    overridden by the config file and environment (see utils.config.load_config)
+    and then by the command line.
+    """
+    defaults = dict(DEFAULTS, **(load_config() if config is None else config))
+    # Values from the config file and environment arrive as plain strings and lists
+    if isinstance(defaults["shard"], str):
+        defaults["shard"] = parse_shard(defaults["shard"])
+    if isinstance(defaults["csv_dataset"], str):
+        defaults["csv_dataset"] = defaults["csv_dataset"].split(os.pathsep)
+    if defaults["class_quota"] is not None:
+        if isinstance(defaults["class_quota"], (str, int)):
+            defaults["class_quota"] = [defaults["class_quota"]]
+        defaults["class_quota"] = [
+            parse_quota(str(quota)) if isinstance(quota, (str, int)) else tuple(quota)
+            for quota in defaults["class_quota"]
+        ]
+    if isinstance(defaults["sample_rate"], (str, int)):
+        defaults["sample_rate"] = [defaults["sample_rate"]]
+    defaults["sample_rate"] = [
+        parse_variant(variant) if isinstance(variant, (str, int)) else tuple(variant)
+        for variant in defaults["sample_rate"]
+    ]
+
+    parser = argparse.ArgumentParser(
+        description="Download AudioSet clips. Without a command, fetch is run."
+    )
+    commands = parser.add_subparsers(dest="command", metavar="{" + ",".join(COMMANDS) + "}")
+
+    plan = commands.add_parser("plan", help="summarise the selected clips and their download state")
+    add_selection_args(plan)
+    add_format_args(plan)
+    plan.add_argument(
+        "--estimate",
+        type=int,
+        help="also estimate the download size and time from the metadata of this many sampled clips",
+    )
+
+    status = commands.add_parser("status", help="count the selected clips in each download state")
+    add_selection_args(status)
+
+    fetch = commands.add_parser("fetch", help="download and process the selected clips")
+    add_selection_args(fetch)
+    add_format_args(fetch)
+    add_output_args(fetch)
+    add_fetch_args(fetch)
+
+    verify = commands.add_parser("verify", help="check the outputs of downloaded clips and queue bad ones for repair")
+    add_selection_args(verify)
+    add_output_args(verify)
+    verify.add_argument(
+        "--recheck",
+        action="store_true",
+        help="check clips that passed an earlier verify again",
+    )
+    verify.add_argument(
+        "--silence_db",
+        type=float,
+        help="clips with a lower RMS level in dBFS fail as silent",
+    )
+
+    for subparser in [plan, status, fetch, verify]:
+        subparser.set_defaults(**defaults)
+    return parser
+
+
+def load_splits(args):
+    from utils.splits import load_splits
+
+    if args.class_quota and len(args.csv_dataset) > 1:
+        raise SystemExit("--class_quota works on a single manifest")
+    return load_splits(args)
+
+
+def plan(args):
+    from utils.report import group_summary, progress_summary, quota_summary, selection_summary
+
+    splits = load_splits(args)
+    for split in splits:
+        if len(splits) > 1:
+            print(f"[{split.name}]")
+        summary = selection_summary(split.data)
+        classes = summary.pop("classes")
+        summary.update(progress_summary(split.data, split.store_path))
+        if args.class_quota:
+            summary.update(quota_summary(split.data, args.class_quota, args.classes, split.store_path))
+        for key, value in summary.items():
+            print(f"{key}: {value}")
+        print("clips per class:")
+        for name, count in classes.items():
+            print(f"  {name}: {count}")
+        if args.estimate:
+            from utils.download import plan_download
+
+            for key, value in plan_download(split.data, args, sample=args.estimate).items():
+                print(f"{key}: {value}")
+    if len(splits) > 1:
+        print("[all]")
+        for key, value in group_summary(splits).items():
+            print(f"{key}: {value}")
+
+
+def status(args):
+    from utils.report import progress_summary
+
+    splits = load_splits(args)
+    for split in splits:
+        if len(splits) > 1:
+            print(f"[{split.name}]")
+        for state, count in sorted(progress_summary(split.data, split.store_path).items()):
+            print(f"{state}: {count}")
+
+
+def fetch(args):
+    from utils.download import parallel_download, serve_download_queue
+
+    splits = load_splits(args)
+
+    # Creat destination folders
+    for split in splits:
+        if os.path.isdir(split.data_dir) == False:
+            os.makedirs(split.data_dir)
+            for folder in split.data.classes_name:
+                os.mkdir(os.path.join(split.data_dir, folder))
+
+    if args.serve_queue:
+        serve_download_queue(splits, args)
+    else:
+        parallel_download(splits, args)
+
+
+def verify(args):
+    from utils.verify import verify_outputs
+
+    splits = load_splits(args)
+    for split in splits:
+        if len(splits) > 1:
+            print(f"[{split.name}]")
+        result = verify_outputs(split, args, state_dir(args), args.recheck, args.silence_db)
+        for key, value in result.items():
+            print(f"{key}: {value}")
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in COMMANDS + ["-h", "--help"]:
+        argv = ["fetch"] + argv
+    args = build_parser().parse_args(argv)
+    {"plan": plan, "status": status, "fetch": fetch, "verify": verify}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
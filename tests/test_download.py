@@ -0,0 +1,162 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import utils.download
+from utils.download import ProcessOptions, SharedFetches, fetch_clip, process_clip
+from utils.features import n_frames
+from utils.fetchers import Fetcher
+from utils.store import clip_paths
+
+
+class SectionFailingFetcher(Fetcher):
+    """
+    Fails every section download with error and records the downloads.
+    """
+
+    def __init__(self, error):
+        self.error = error
+        self.sections = []
+
+    def extract_info(self, url):
+        return {"id": url.split("=")[-1], "duration": 60.0}
+
+    def download(self, info, fmt, path, extract_audio=False, section=None):
+        self.sections.append(section)
+        if section is not None:
+            raise Exception(self.error)
+        open(path, "wb").close()
+        return path
+
+
+def _fetch(fetcher, scratch_dir):
+    return fetch_clip(
+        "0", "https://www.youtube.com/watch?v=abc", str(scratch_dir), 10.0, 20.0,
+        mode="only_audio", verbose=False, fetcher=fetcher,
+    )
+
+
+def test_unsupported_range_falls_back_to_full_download(tmp_path):
+    fetcher = SectionFailingFetcher("ERROR: HTTP Error 416: Requested Range Not Satisfiable")
+    _, audio_path, offset = _fetch(fetcher, tmp_path)
+    assert fetcher.sections == [(8.0, 22.0), None]
+    assert audio_path == str(tmp_path / "abc.m4a")
+    assert offset == 0.0
+
+
+@pytest.mark.parametrize("error", [
+    "ERROR: unable to download video data: HTTP Error 429: Too Many Requests",
+    "ERROR: [youtube] abc: Private video",
+    "ERROR: Read timed out.",
+])
+def test_other_segment_errors_are_raised(tmp_path, error):
+    fetcher = SectionFailingFetcher(error)
+    with pytest.raises(Exception, match=error.split(": ")[-1]):
+        _fetch(fetcher, tmp_path)
+    assert fetcher.sections == [(8.0, 22.0)]
+
+
+def test_shared_fetch_is_reused_in_audio_only_mode(tmp_path):
+    video_path, audio_path = str(tmp_path / "abc.mp4"), str(tmp_path / "abc.m4a")
+    downloads = []
+
+    def fetch():
+        downloads.append(1)
+        open(audio_path, "wb").close()
+        return video_path, audio_path, 0.0
+
+    shared = SharedFetches("only_audio")
+    jobs = [
+        {"ytid": "abc", "start": start, "end": start + 10.0, "window": (10.0, 60.0), "group_size": 3}
+        for start in (10.0, 30.0, 50.0)
+    ]
+    fresh = [shared.fetch(job, fetch)[1] for job in jobs]
+    assert len(downloads) == 1
+    assert fresh == [True, False, False]
+    for job in jobs:
+        shared.release(job)
+    assert not (tmp_path / "abc.m4a").exists()
+
+
+def test_full_download_outlives_other_groups_of_the_video(tmp_path):
+    audio_path = str(tmp_path / "abc.m4a")
+
+    def fetch():
+        open(audio_path, "wb").close()
+        return str(tmp_path / "abc.mp4"), audio_path, 0.0
+
+    shared = SharedFetches("only_audio")
+    near = {"ytid": "abc", "start": 10.0, "end": 20.0, "window": (10.0, 20.0), "group_size": 1}
+    far = {"ytid": "abc", "start": 500.0, "end": 510.0, "window": (500.0, 510.0), "group_size": 1}
+    shared.fetch(near, fetch)
+    shared.fetch(far, fetch)
+    shared.release(near)
+    assert (tmp_path / "abc.m4a").exists()
+    shared.release(far)
+    assert not (tmp_path / "abc.m4a").exists()
+
+
+def _fake_trim(video_path, audio_path, start_time, end_time, video_out=None, audio_channels=None,
+               video_codec="auto"):
+    # A 440 Hz tone standing in for the decoded segment
+    t = np.arange(int((end_time - start_time) * 32000)) / 32000
+    audio = np.repeat((0.5 * np.sin(2 * np.pi * 440 * t))[:, None], audio_channels, axis=1)
+    return start_time, audio.astype(np.float32), 32000
+
+
+def _source(tmp_path):
+    source = tmp_path / "scratch" / "abc.m4a"
+    source.parent.mkdir()
+    source.write_bytes(b"m4a")
+    return str(source)
+
+
+def test_process_options_are_picklable():
+    options = ProcessOptions(
+        "only_audio", "/tmp/scratch", audio_variants=[(16000, 1), (44100, 2)], audio_sink="shards",
+        features={"n_fft": 512, "hop": 160, "n_mels": 64},
+    )
+    assert vars(pickle.loads(pickle.dumps(options))) == vars(options)
+
+
+def test_process_clip_stores_each_variant_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.download, "trim_segment", _fake_trim)
+    source = _source(tmp_path)
+    options = ProcessOptions(
+        "only_audio", str(tmp_path / "scratch"), audio_variants=[(16000, 1), (8000, 2)],
+        features={"n_fft": 512, "hop": 160, "n_mels": 64}, verbose=False,
+    )
+    data_dir = str(tmp_path / "data")
+    result = process_clip(
+        data_dir, 7, ["Dog", "Bark"], source.replace(".m4a", ".mp4"), source, 30.0, 40.0, options,
+        source_duration=60.0, store_key="abc",
+    )
+    assert sorted(result["outputs"]) == ["audio", "audio_8000hz_stereo"]
+    assert result["wav"] is None and result["clamped"] is None
+    assert result["features"].shape == (n_frames(160000, 512, 160), 64)
+    assert set(result["timings"]) == {"trim", "resample", "features", "copy"}
+    for label in ["Dog", "Bark"]:
+        _, path = clip_paths(data_dir, 7, label, 30.0, 40.0, "audio_8000hz_stereo")
+        assert os.path.samefile(path, result["outputs"]["audio_8000hz_stereo"])
+        info = sf.info(path)
+        assert (info.samplerate, info.channels, info.frames) == (8000, 2, 80000)
+    # Both stored files are counted once, the label links are free
+    assert result["bytes_written"] == sum(os.path.getsize(path) for path in result["outputs"].values())
+    assert not os.path.exists(source)
+
+
+def test_process_clip_keeps_the_shard_wav_and_the_clamped_length(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils.download, "trim_segment", _fake_trim)
+    source = _source(tmp_path)
+    options = ProcessOptions(
+        "only_audio", str(tmp_path / "scratch"), audio_sink="shards", keep_sources=True, verbose=False,
+    )
+    result = process_clip(
+        str(tmp_path / "data"), 7, ["Dog"], None, source, 30.0, 40.0, options, source_duration=34.0,
+    )
+    assert result["clamped"] == 4.0 and result["outputs"] == {}
+    assert sf.info(result["wav"]).frames == 4 * 16000
+    assert os.path.exists(source)
@@ -0,0 +1,81 @@
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from utils.features import FeatureWriter, log_mel, mel_filterbank, n_frames
+
+RATE = 16000
+
+
+def _data(tmp_path, n=3):
+    return SimpleNamespace(
+        csv_path=str(tmp_path / "balanced_train_segments.csv"),
+        row=np.arange(10, 10 + n),
+        ytids=np.array([f"video{i:06d}" for i in range(n)]),
+        start=np.arange(n, dtype=np.float64) * 10,
+        end=np.arange(n, dtype=np.float64) * 10 + 10,
+    )
+
+
+@pytest.mark.parametrize("n_samples, expected", [(160000, 997), (512, 1), (511, 0), (672, 2)])
+def test_log_mel_frame_count(n_samples, expected):
+    samples = np.random.default_rng(0).standard_normal(n_samples).astype(np.float32)
+    features = log_mel(samples, RATE)
+    assert features.shape == (expected, 64) == (n_frames(n_samples, 512, 160), 64)
+    assert features.dtype == np.float32
+
+
+def test_batch_matches_single_clips():
+    batch = np.random.default_rng(0).standard_normal((3, 4000)).astype(np.float32)
+    features = log_mel(batch, RATE, n_fft=400, hop=100, n_mels=40)
+    assert features.shape == (3, n_frames(4000, 400, 100), 40)
+    for clip, clip_features in zip(batch, features):
+        np.testing.assert_allclose(log_mel(clip, RATE, n_fft=400, hop=100, n_mels=40), clip_features, rtol=1e-5)
+
+
+def test_tone_lands_in_its_mel_band():
+    t = np.arange(RATE) / RATE
+    features = log_mel(np.sin(2 * np.pi * 1000 * t), RATE)
+    filters = mel_filterbank(RATE, 512, 64)
+    assert filters.shape == (257, 64)
+    assert np.argmax(features.mean(axis=0)) == np.argmax(filters[round(1000 * 512 / RATE)])
+
+
+def test_feature_writer_layout(tmp_path):
+    data = _data(tmp_path)
+    with FeatureWriter(str(tmp_path), data, RATE, batch_size=2) as writer:
+        assert writer.max_frames == n_frames(10 * RATE, 512, 160)
+        writer.add(2, np.ones((100, 64), dtype=np.float16))
+        # Buffered until a batch is full
+        assert list(writer.index["frames"]) == [0, 0, 0]
+        writer.add(0, np.full((5000, 64), 2, dtype=np.float16))
+        assert list(writer.index["frames"]) == [writer.max_frames, 0, 100]
+        path = writer.path
+
+    features = np.load(os.path.join(path, "features.npy"), mmap_mode="r")
+    index = np.load(os.path.join(path, "index.npy"))
+    assert features.shape == (3, writer.max_frames, 64) and features.dtype == np.float16
+    assert np.all(features[0] == 2) and np.all(features[1] == 0)
+    assert np.all(features[2, :100] == 1) and np.all(features[2, 100:] == 0)
+    assert list(index["row"]) == [10, 11, 12]
+    assert list(index["ytid"].astype(str)) == list(data.ytids)
+    assert list(index["start"]) == [0.0, 10.0, 20.0]
+    with open(os.path.join(path, "meta.json")) as f:
+        assert json.load(f)["max_frames"] == writer.max_frames
+
+
+def test_same_selection_reopens_the_arrays(tmp_path):
+    data = _data(tmp_path)
+    with FeatureWriter(str(tmp_path), data, RATE) as writer:
+        writer.add(1, np.ones((10, 64), dtype=np.float16))
+        path = writer.path
+    with FeatureWriter(str(tmp_path), data, RATE) as writer:
+        assert writer.path == path and writer.index["frames"][1] == 10
+    with FeatureWriter(str(tmp_path), data, RATE, n_mels=128) as writer:
+        assert writer.path != path
+    data.row = data.row[::-1].copy()
+    with FeatureWriter(str(tmp_path), data, RATE) as writer:
+        assert writer.path != path
@@ -0,0 +1,88 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from utils.budget import BandwidthBudget
+from utils.download import plan_download
+from utils.formats import FormatPolicy, format_bytes
+
+
+def test_default_policy_keeps_the_uncapped_formats():
+    policy = FormatPolicy()
+    assert policy.requests("video") == [("best[ext=mp4]", False, "mp4")]
+    assert policy.requests("both_separate") == [
+        ("bestvideo[ext=mp4]", False, "mp4"),
+        ("bestaudio/best", True, "m4a"),
+    ]
+    assert policy.requests("only_audio") == [("bestaudio/best", True, "m4a")]
+
+
+def test_caps_fall_back_to_the_uncapped_stream():
+    policy = FormatPolicy(max_height=360, max_fps=30, video_codecs=["avc1", "vp09"], max_abr=64)
+    assert policy.video().split("/") == [
+        "bestvideo[ext=mp4][vcodec^=avc1][height<=?360][fps<=?30]",
+        "bestvideo[ext=mp4][vcodec^=vp09][height<=?360][fps<=?30]",
+        "bestvideo[ext=mp4][height<=?360][fps<=?30]",
+        "bestvideo[ext=mp4]",
+    ]
+    assert policy.audio() == "bestaudio[abr<=?64]/bestaudio/best"
+
+
+def test_format_bytes():
+    assert format_bytes({"tbr": 128}, 10.0) == 160000
+    assert format_bytes({"filesize": 1000}, 10.0, duration=100.0) == 100
+    assert format_bytes({"filesize_approx": 1000}, 10.0) == 1000
+    assert format_bytes({}, 10.0, duration=100.0) is None
+
+
+def test_budget_stops_handing_out_jobs_once_spent():
+    budget = BandwidthBudget(max_bytes=250)
+    seen = []
+    for job in budget.limit(range(10)):
+        seen.append(job)
+        budget.consume(100)
+    assert seen == [0, 1, 2] and budget.exhausted
+
+
+def test_budget_paces_fetches_to_the_rate():
+    budget = BandwidthBudget(max_rate=1000)
+    budget.consume(100)
+    started = time.monotonic()
+    budget.wait()
+    assert time.monotonic() - started == pytest.approx(0.1, abs=0.05)
+
+
+class FakeFetcher:
+    def extract_info(self, url):
+        if url.endswith("gone"):
+            raise Exception("ERROR: Video unavailable")
+        return {"duration": 100.0}
+
+    def select_formats(self, info, fmt):
+        return [{"format_id": fmt, "tbr": 800}]
+
+
+def test_plan_extrapolates_the_sampled_clips(tmp_path):
+    ytids = ["a", "b", "c", "gone"]
+    data = SimpleNamespace(
+        index=np.arange(4),
+        ytids=np.array(ytids),
+        url=[f"https://www.youtube.com/watch?v={ytid}" for ytid in ytids],
+        lables=[["Dog"]] * 4,
+        start=np.full(4, 30.0),
+        end=np.full(4, 40.0),
+    )
+    args = SimpleNamespace(
+        max_height=None, max_fps=None, video_codecs=[], max_abr=None, mode="only_audio",
+        tmp_dir=str(tmp_path), destination_dir=str(tmp_path), metadata_ttl=24, fetch_mode="segment",
+        fetch_workers=2, max_rate=1.0, max_gb=0.01,
+    )
+    plan = plan_download(data, args, fetcher=FakeFetcher())
+    # 14 s of a 100 kB/s stream for the three available clips
+    assert plan["unavailable_fraction"] == 0.25
+    assert plan["mean_clip_mb"] == pytest.approx(1.4)
+    assert plan["total_gb"] == pytest.approx(3 * 1.4e-3)
+    assert plan["hours_at_max_rate"] == pytest.approx(3 * 1.4 / 3600)
+    assert plan["clips_within_budget"] == 4
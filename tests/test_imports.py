@@ -0,0 +1,18 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_modules_creates_no_files(tmp_path):
+    # Modules must not create directories or files on import, only when run
+    env = dict(os.environ, PYTHONPATH=ROOT, AUDIOSET_TMP_DIR=str(tmp_path / "state"))
+    code = "import main, utils.download, utils.verify, utils.report"
+    subprocess.run([sys.executable, "-c", code], cwd=tmp_path, env=env, check=True)
+    assert os.listdir(tmp_path) == []
+
+
+def test_verify_does_not_import_the_downloader():
+    code = "import sys, utils.verify; assert 'utils.download' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
@@ -0,0 +1,75 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from utils.metacache import MetadataCache
+
+
+class FakeFetcher:
+    def __init__(self, error=None, delay=0.0):
+        self.error = error
+        self.delay = delay
+        self.calls = 0
+
+    def extract_info(self, url):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise Exception(self.error)
+        return {"id": url[-3:], "duration": 42.0, "formats": [{"format_id": "140", "tbr": 128}]}
+
+
+def _age(cache, seconds):
+    with sqlite3.connect(cache.path) as conn:
+        conn.execute("UPDATE videos SET updated = updated - ?", (seconds,))
+
+
+def test_lookup_is_cached_until_the_format_urls_expire(tmp_path):
+    cache = MetadataCache(tmp_path / "metadata.sqlite")
+    fetcher = FakeFetcher()
+    info = cache.lookup(fetcher, "abc", "https://www.youtube.com/watch?v=abc")
+    assert cache.lookup(fetcher, "abc", "https://www.youtube.com/watch?v=abc") == info
+    assert (fetcher.calls, cache.requests, cache.hits) == (1, 1, 1)
+    assert cache.entry("abc") == {"available": True, "duration": 42.0, "reason": None}
+
+    # The duration is still trusted, but the signed format URLs are not
+    _age(cache, 6 * 3600)
+    assert cache.entry("abc")["duration"] == 42.0
+    cache.lookup(fetcher, "abc", "https://www.youtube.com/watch?v=abc")
+    assert fetcher.calls == 2
+
+    _age(cache, 31 * 24 * 3600)
+    assert cache.entry("abc") is None
+
+
+def test_only_permanent_errors_are_cached(tmp_path):
+    cache = MetadataCache(tmp_path / "metadata.sqlite")
+    fetcher = FakeFetcher("ERROR: [youtube] abc: Private video")
+    for _ in range(2):
+        with pytest.raises(Exception, match="Private video"):
+            cache.lookup(fetcher, "abc", "https://www.youtube.com/watch?v=abc")
+    assert fetcher.calls == 1
+    assert cache.entry("abc")["available"] is False
+
+    fetcher = FakeFetcher("HTTP Error 503: Service Unavailable")
+    for _ in range(2):
+        with pytest.raises(Exception, match="503"):
+            cache.lookup(fetcher, "def", "https://www.youtube.com/watch?v=def")
+    assert fetcher.calls == 2
+    assert cache.entry("def") is None
+
+
+def test_concurrent_lookups_share_one_request(tmp_path):
+    cache = MetadataCache(tmp_path / "metadata.sqlite")
+    fetcher = FakeFetcher(delay=0.1)
+    threads = [
+        threading.Thread(target=cache.lookup, args=(fetcher, "abc", "https://www.youtube.com/watch?v=abc"))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert fetcher.calls == 1 and cache.hits == 3
@@ -0,0 +1,71 @@
+import pickle
+
+import ffmpy
+import pytest
+
+from utils.download import _picklable_error
+from utils.pipeline import run_pipeline
+
+
+class UnpicklableError(Exception):
+    def __init__(self, cmd, exit_code):
+        super().__init__(f"{cmd} exited with status {exit_code}")
+
+
+def _fetch(job):
+    return job
+
+
+def _process(job, fetched):
+    if job == 1:
+        raise ValueError("bad clip")
+    return job * 10
+
+
+def _process_unpicklable(job, fetched):
+    if job == 1:
+        raise UnpicklableError("ffmpeg", 1)
+    return job * 10
+
+
+def _run(jobs, process_fn):
+    return list(run_pipeline(jobs, _fetch, process_fn, fetch_workers=2, process_workers=2, queue_size=4))
+
+
+def test_process_error_fails_only_its_job():
+    results = {job: (result, error) for job, result, error in _run(range(20), _process)}
+    assert sorted(results) == list(range(20))
+    assert isinstance(results[1][1], ValueError)
+    assert all(results[job] == (job * 10, None) for job in results if job != 1)
+
+
+def test_broken_process_pool_does_not_stop_the_run():
+    results = _run(range(60), _process_unpicklable)
+    assert sorted(job for job, _, _ in results) == list(range(60))
+    assert any(error is not None for job, _, error in results if job == 1)
+    # The jobs after the broken pool go to a fresh one
+    assert any(result == 590 for job, result, _ in results if job == 59)
+
+
+def test_source_error_is_raised_after_the_jobs_read():
+    def jobs():
+        yield 0
+        yield 2
+        raise RuntimeError("manifest parse error")
+
+    seen = []
+    with pytest.raises(RuntimeError, match="manifest parse error"):
+        for job, result, error in run_pipeline(jobs(), _fetch, _process, fetch_workers=2, process_workers=1):
+            seen.append(result)
+    assert sorted(seen) == [0, 20]
+
+
+def test_unpicklable_error_is_sent_back_with_the_stderr_tail():
+    error = ffmpy.FFRuntimeError("ffmpeg -i x.mp4", 1, b"", b"header\nInvalid data found when processing input\n")
+    sent = pickle.loads(pickle.dumps(_picklable_error(error)))
+    assert isinstance(sent, RuntimeError)
+    assert "`ffmpeg -i x.mp4` exited with status 1" in str(sent)
+    assert str(sent).endswith("Invalid data found when processing input")
+
+    error = ValueError("picklable")
+    assert _picklable_error(error) is error
@@ -0,0 +1,41 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+
+from utils.download import _pending_rows
+from utils.progress import DONE, UNAVAILABLE, ProgressStore, isin_keys
+from utils.splits import Split
+
+
+def test_isin_keys_matches_a_set_lookup():
+    rng = np.random.default_rng(0)
+    ytids = np.array([f"{i:011d}"[-rng.integers(3, 12):] for i in range(5000)])
+    starts = rng.integers(0, 30, len(ytids)) * 10.0
+    picked = rng.choice(len(ytids), 2000, replace=False)
+    keys = {(str(ytids[i]), float(starts[i])) for i in picked}
+    # Keys that differ from a row in the YTID or the start only
+    keys |= {(str(ytids[i]) + "x", float(starts[i])) for i in range(10)}
+    keys |= {(str(ytids[i]), float(starts[i]) + 0.5) for i in range(10)}
+    key_ytids, key_starts = map(np.array, zip(*keys))
+
+    mask = isin_keys(ytids, starts, key_ytids, key_starts)
+    assert mask.tolist() == [(str(y), float(s)) in keys for y, s in zip(ytids, starts)]
+    assert isin_keys(["abc"], [0.0], ["abc"], [-0.0]).tolist() == [True]
+    assert isin_keys(["abc"], [0.0], np.array([], dtype=str), []).tolist() == [False]
+
+
+def test_pending_rows_skip_done_and_unavailable_clips(tmp_path):
+    data = SimpleNamespace(
+        index=np.arange(4),
+        ytids=np.array(["abc", "abc", "def", "ghi"]),
+        start=np.array([0.0, 30.0, 0.0, 0.0]),
+    )
+    split = Split("train", data, tmp_path / "data", tmp_path / "state")
+    os.makedirs(split.state_dir)
+    split.store = ProgressStore(split.store_path)
+    split.store.done("abc", 30.0)
+    split.store.failed("def", 0.0, "Private video", permanent=True)
+    split.store.failed("ghi", 0.0, "Read timed out.")
+    assert _pending_rows(split).tolist() == [0, 3]
+    assert split.store.key_arrays(DONE, UNAVAILABLE)[0].tolist() == ["abc", "def"]
@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from utils.quota import ClassQuota
+
+CLASSES = ["Dog", "Cat"]
+
+
+def _data(labels):
+    bits = np.zeros((len(labels), 8), dtype=bool)
+    for row, names in enumerate(labels):
+        for name in names:
+            bits[row, CLASSES.index(name)] = True
+    ytids = [f"video{i:04d}" for i in range(len(labels))]
+    return SimpleNamespace(
+        classes_name=CLASSES,
+        name_to_idx={name: i for i, name in enumerate(CLASSES)},
+        label_bits=np.packbits(bits, axis=1),
+        index=np.arange(len(labels)),
+        ytids=np.array(ytids),
+        url=[f"https://www.youtube.com/watch?v={ytid}" for ytid in ytids],
+        lables=labels,
+        start=np.zeros(len(labels)),
+        end=np.full(len(labels), 10.0),
+    )
+
+
+def test_failed_clip_reopens_its_class():
+    data = _data([["Dog"], ["Dog"], ["Dog"]])
+    quota = ClassQuota(data, {"Dog": 1}, [0, 1, 2])
+    jobs = quota.jobs()
+
+    first = next(jobs)
+    # Asking for more parks the other clips and waits on the one in flight
+    waiter = ThreadPoolExecutor(1)
+    pending = waiter.submit(next, jobs)
+    with pytest.raises(TimeoutError):
+        pending.result(timeout=0.2)
+    assert len(quota._parked) == 2
+
+    quota.finish(first, False)
+    second = pending.result(timeout=5)
+    waiter.shutdown()
+    assert second["row"] != first["row"]
+    quota.finish(second, True)
+
+    assert list(jobs) == []
+    assert quota.summary() == {"Dog": (1, 1)}
+
+
+def test_done_clip_fills_its_class():
+    data = _data([["Dog", "Cat"], ["Dog"], ["Cat"]])
+    quota = ClassQuota(data, {"Dog": 1, "Cat": 1}, [0, 1, 2])
+    assert quota.plan() == [0]
+    assert quota.summary() == {"Dog": (1, 1), "Cat": (1, 1)}
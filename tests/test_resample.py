@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from utils.resample import parse_variant, remix, resample, variant_dir, write_variants
+
+
+def _tone(seconds, rate, frequency=440.0, channels=1):
+    t = np.arange(int(seconds * rate)) / rate
+    samples = (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+    return np.repeat(samples[:, None], channels, axis=1)
+
+
+def test_parse_variant_and_variant_dir():
+    assert parse_variant("16000") == (16000, 1)
+    assert parse_variant("44100:2") == (44100, 2)
+    with pytest.raises(ValueError):
+        parse_variant("16000:6")
+    assert variant_dir(16000, 1, primary=True) == "audio"
+    assert variant_dir(8000, 1) == "audio_8000hz"
+    assert variant_dir(44100, 2) == "audio_44100hz_stereo"
+
+
+@pytest.mark.parametrize("rate_out", [8000, 16000, 22050, 48000])
+def test_resample_keeps_the_length_and_the_tone(rate_out):
+    samples = _tone(2.0, 44100, channels=2)
+    out = resample(samples, 44100, rate_out)
+    assert out.shape == (2 * rate_out, 2) and out.dtype == np.float32
+    peak = np.argmax(np.abs(np.fft.rfft(out[:, 0])))
+    assert peak * rate_out / len(out) == pytest.approx(440.0, abs=1.0)
+    # A tone below both Nyquist rates survives unchanged in level
+    assert np.sqrt(np.mean(out ** 2)) == pytest.approx(0.5 / np.sqrt(2), rel=0.02)
+
+
+def test_remix():
+    stereo = np.array([[1.0, 0.0], [0.5, 0.5]], dtype=np.float32)
+    assert remix(stereo, 1).tolist() == [[0.5], [0.5]]
+    assert remix(stereo[:, :1], 2).tolist() == [[1.0, 1.0], [0.5, 0.5]]
+    assert remix(stereo, 2) is stereo
+
+
+def test_write_variants_writes_every_rate_from_one_buffer(tmp_path):
+    samples = _tone(1.5, 44100, channels=2)
+    variants = [(16000, 1), (44100, 2), (16000, 2)]
+    paths = [str(tmp_path / f"{i}.wav") for i in range(len(variants))]
+    resampled = write_variants(samples, 44100, variants, paths)
+    # 16 kHz is resampled once for both of its variants
+    assert sorted(resampled) == [16000, 44100]
+    assert resampled[44100] is samples
+
+    for (rate, channels), path in zip(variants, paths):
+        info = sf.info(path)
+        assert (info.samplerate, info.channels, info.subtype) == (rate, channels, "PCM_16")
+        assert info.frames == int(1.5 * rate)
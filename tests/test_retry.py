@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+import utils.retry
+from utils.retry import (
+    PERMANENT, THROTTLED, TRANSIENT, AIMDController, DownloadFailure, backoff_delay, call_with_retry,
+    classify_error, range_unsupported,
+)
+
+
+@pytest.mark.parametrize("message, category", [
+    ("ERROR: unable to download video data: HTTP Error 429: Too Many Requests", THROTTLED),
+    ("ERROR: [youtube] abc: Sign in to confirm you're not a bot. This helps protect our community.", THROTTLED),
+    ("ERROR: [youtube] abc: Private video. Sign in if you've been granted access to this video", PERMANENT),
+    ("ERROR: [youtube] abc: Video unavailable. This video has been removed by the uploader", PERMANENT),
+    ("ERROR: [youtube] abc: Video unavailable. This video is no longer available because the YouTube "
+     "account associated with this video has been terminated.", PERMANENT),
+    ("ERROR: [youtube] abc: The uploader has not made this video available in your country", PERMANENT),
+    ("ERROR: [youtube] abc: Join this channel to get access to members-only content like this video", PERMANENT),
+    ("ERROR: [youtube] abc: Sign in to confirm your age. This video may be inappropriate for some users.",
+     PERMANENT),
+    ("ERROR: [youtube] abc: Requested format is not available. Use --list-formats", PERMANENT),
+    ("Start time (40.0s) exceeds video duration (30.0s)", PERMANENT),
+    ("ERROR: unable to download video data: HTTP Error 503: Service Unavailable", TRANSIENT),
+    ("ERROR: [youtube] abc: Read timed out.", TRANSIENT),
+    ("ERROR: [Errno 104] Connection reset by peer", TRANSIENT),
+    ("ERROR: IncompleteRead(1024 bytes read, 2048 more expected)", TRANSIENT),
+    ("something nobody has seen before", TRANSIENT),
+])
+def test_classify_error(message, category):
+    assert classify_error(Exception(message)) == category
+    assert classify_error(DownloadFailure(category, message)) == category
+
+
+def test_range_unsupported():
+    assert range_unsupported(Exception("ERROR: HTTP Error 416: Requested Range Not Satisfiable"))
+    assert range_unsupported(Exception("ERROR: ffmpeg not found. Please install or provide the path"))
+    # A throttled or permanent error is never a reason for a full download
+    assert not range_unsupported(Exception("HTTP Error 429: Too Many Requests for download_ranges"))
+    assert not range_unsupported(Exception("ERROR: [youtube] abc: Private video"))
+    assert not range_unsupported(Exception("ERROR: Read timed out."))
+
+
+def test_backoff_delay_is_capped_and_jittered():
+    delays = [backoff_delay(3) for _ in range(200)]
+    assert all(0 <= delay <= 16 for delay in delays) and len(set(delays)) > 1
+    assert all(backoff_delay(30, cap=60) <= 60 for _ in range(200))
+
+
+def test_aimd_increases_by_about_one_per_round():
+    controller = AIMDController(8)
+    controller.limit = 2.0
+    for _ in range(2):
+        controller.success()
+    assert 2.8 < controller.limit < 3.0
+    for _ in range(100):
+        controller.success()
+    # Never above the configured number of fetch workers
+    assert controller.limit == 8
+
+
+def test_aimd_decreases_once_per_burst_down_to_the_floor():
+    controller = AIMDController(8, min_limit=2)
+    controller.throttled()
+    assert controller.limit == 4
+    # 429s of fetches that were already in flight count once
+    for _ in range(5):
+        controller.throttled()
+    assert controller.limit == 4
+    for _ in range(4):
+        controller.success()
+    controller.throttled()
+    assert controller.limit == pytest.approx(2.4, abs=0.1)
+    for _ in range(3):
+        controller.success()
+    controller.throttled()
+    assert controller.limit == 2
+
+
+def test_aimd_gates_concurrent_calls():
+    controller = AIMDController(4)
+    controller.limit = 2.0
+    active, peak, lock = [0], [0], threading.Lock()
+
+    def fetch():
+        with controller:
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=fetch) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 2
+
+
+def test_call_with_retry(monkeypatch):
+    monkeypatch.setattr(utils.retry, "sleep", lambda seconds: None)
+    controller = AIMDController(4)
+    errors = ["HTTP Error 429: Too Many Requests", "Read timed out."]
+
+    def flaky():
+        if errors:
+            raise Exception(errors.pop(0))
+        return "ok"
+
+    assert call_with_retry(flaky, 2, controller) == "ok"
+    assert controller.limit == pytest.approx(2.5)
+
+    calls = []
+
+    def private():
+        calls.append(1)
+        raise Exception("ERROR: [youtube] abc: Private video")
+
+    with pytest.raises(DownloadFailure) as failure:
+        call_with_retry(private, 5)
+    assert failure.value.category == PERMANENT and len(calls) == 1
+
+    with pytest.raises(DownloadFailure) as failure:
+        call_with_retry(lambda: 1 / 0, 2)
+    assert failure.value.category == TRANSIENT
@@ -0,0 +1,77 @@
+import os
+import threading
+import time
+
+from utils.scratch import ScratchDir, TempQuota, scratch_usage
+
+
+def _write(path, n_bytes):
+    with open(path, "wb") as f:
+        f.write(b"\0" * n_bytes)
+
+
+def test_scratch_dir_is_private_and_removed_on_close(tmp_path):
+    with ScratchDir(tmp_path) as a, ScratchDir(tmp_path) as b:
+        assert a.path != b.path
+        assert os.path.isdir(a.path) and os.path.isdir(b.path)
+        # A live run is never swept
+        assert b.swept == 0
+    assert not os.path.exists(a.path) and not os.path.exists(b.path)
+
+
+def test_sweep_removes_only_the_directories_of_crashed_runs(tmp_path):
+    crashed = tmp_path / "scratch-host-1-dead"
+    crashed.mkdir()
+    _write(crashed / ".owner", 0)
+    _write(crashed / "video.mp4", 10)
+    # Created a moment ago, its owner may not have locked it yet
+    starting = tmp_path / "scratch-host-2-new"
+    starting.mkdir()
+    other = tmp_path / "other"
+    other.mkdir()
+
+    with ScratchDir(tmp_path) as live:
+        assert live.swept == 1
+        with ScratchDir(tmp_path) as scratch:
+            assert scratch.swept == 0
+            assert os.path.isdir(live.path)
+    assert not crashed.exists() and starting.exists() and other.exists()
+
+
+def test_usage_counts_every_run_under_the_root(tmp_path):
+    _write(tmp_path / "unrelated.bin", 1000)
+    with ScratchDir(tmp_path) as a, ScratchDir(tmp_path) as b:
+        _write(os.path.join(a.path, "x"), 300)
+        _write(os.path.join(b.path, "y"), 200)
+        assert scratch_usage(str(tmp_path)) == 500
+
+
+def test_quota_pauses_until_usage_drops_below_the_low_water(tmp_path):
+    with ScratchDir(tmp_path) as own, ScratchDir(tmp_path) as other:
+        # Another run's files count against the same limit
+        _write(os.path.join(other.path, "big"), 950)
+        quota = TempQuota([tmp_path, tmp_path], limit=1000, interval=0.01)
+        try:
+            time.sleep(0.1)
+            assert quota.paused and quota.usage == 950
+
+            waiter = threading.Thread(target=quota.wait)
+            waiter.start()
+            time.sleep(0.1)
+            assert waiter.is_alive()
+            # Between the marks the quota stays paused
+            _write(os.path.join(other.path, "big"), 800)
+            time.sleep(0.1)
+            assert waiter.is_alive()
+            os.remove(os.path.join(other.path, "big"))
+            waiter.join(2)
+            assert not waiter.is_alive() and not quota.paused
+        finally:
+            quota.close()
+        assert os.path.isdir(own.path)
+
+
+def test_quota_without_a_limit_never_blocks(tmp_path):
+    quota = TempQuota([tmp_path])
+    quota.wait()
+    quota.close()
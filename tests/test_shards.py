@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+
+from utils.shards import ShardReader, ShardWriter, index_dtype
+
+RATE = 16000
+
+
+def _clip(n, value):
+    return np.full(n, value, dtype=np.int16)
+
+
+def test_round_trip_returns_memmap_views(tmp_path):
+    root = str(tmp_path / "shards")
+    with ShardWriter(root, RATE, 1, max_samples=250) as writer:
+        writer.add("abc", 0.0, 10.0, [0b10000000], _clip(100, 1))
+        writer.add("def", 5.0, 15.0, [0b00100000], _clip(100, 2))
+        # Does not fit in the first shard any more
+        writer.add("ghi", 1.0, 11.0, [0b10100000], _clip(100, 3))
+
+    reader = ShardReader(root)
+    assert len(reader) == 3
+    assert list(reader.index["ytid"].astype(str)) == ["abc", "def", "ghi"]
+    assert list(reader.index["shard"]) == [0, 0, 1]
+    assert list(reader.index["offset"]) == [0, 100, 0]
+    for i, value in enumerate([1, 2, 3]):
+        samples = reader[i]
+        assert isinstance(samples, np.memmap) and samples.shape == (100,)
+        assert np.all(samples == value)
+    assert not reader[0].flags.owndata and not reader[0].flags.writeable
+    assert list(reader.with_label(0)) == [0, 2]
+    assert list(reader.with_label(2)) == [1, 2]
+
+
+def test_new_session_appends_a_shard_with_the_same_layout(tmp_path):
+    root = str(tmp_path / "shards")
+    with ShardWriter(root, RATE, 1, channels=2) as writer:
+        writer.add("abc", 0.0, 10.0, [0], np.zeros((50, 2), dtype=np.int16))
+    with ShardWriter(root, RATE, 1, channels=2) as writer:
+        writer.add("def", 0.0, 10.0, [0], np.ones((30, 2), dtype=np.int16))
+    with pytest.raises(ValueError, match="were written with"):
+        ShardWriter(root, 8000, 1, channels=2)
+
+    reader = ShardReader(root)
+    assert list(reader.index["shard"]) == [0, 1]
+    assert reader[0].shape == (50, 2) and reader[1].shape == (30, 2)
+
+
+def test_torn_index_record_is_ignored(tmp_path):
+    root = str(tmp_path / "shards")
+    with ShardWriter(root, RATE, 1) as writer:
+        writer.add("abc", 0.0, 10.0, [0], _clip(100, 1))
+        writer.add("def", 0.0, 10.0, [0], _clip(100, 2))
+    index_path = os.path.join(root, "shard_00000.idx")
+    with open(index_path, "r+b") as f:
+        f.truncate(index_dtype(1).itemsize + 7)
+
+    reader = ShardReader(root)
+    assert len(reader) == 1 and np.all(reader[0] == 1)
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from utils.splits import Split, group_jobs
+
+
+def _split(name, cuts):
+    ytids, starts = zip(*cuts)
+    data = SimpleNamespace(
+        index=np.arange(len(cuts)),
+        ytids=np.array(ytids),
+        url=[f"https://www.youtube.com/watch?v={ytid}" for ytid in ytids],
+        lables=[["Speech"]] * len(cuts),
+        start=np.array(starts, dtype=float),
+        end=np.array(starts, dtype=float) + 10.0,
+    )
+    return Split(name, data, name, name)
+
+
+def test_group_windows_cover_only_nearby_cuts():
+    train = _split("train", [("a", 30.0), ("b", 0.0), ("a", 500.0)])
+    test = _split("test", [("a", 45.0), ("a", 520.0)])
+    jobs = list(group_jobs([train, test], {"train": [0, 1, 2], "test": [0, 1]}))
+
+    assert [(job["ytid"], job["start"]) for job in jobs] == [
+        ("a", 30.0), ("a", 500.0), ("a", 45.0), ("a", 520.0), ("b", 0.0),
+    ]
+    groups = {(job["split"], job["start"]): (job["window"], job["group_size"]) for job in jobs}
+    assert groups[("train", 30.0)] == ((30.0, 55.0), 2)
+    assert groups[("test", 45.0)] == ((30.0, 55.0), 2)
+    assert groups[("train", 500.0)] == ((500.0, 530.0), 2)
+    assert groups[("test", 520.0)] == ((500.0, 530.0), 2)
+    assert groups[("train", 0.0)] == ((0.0, 10.0), 1)
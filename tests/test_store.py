@@ -0,0 +1,90 @@
+import errno
+import os
+
+import pytest
+
+import utils.store
+from utils.store import LabelIndex, link_output, stored_path
+
+
+def _stored(tmp_path):
+    src = stored_path(str(tmp_path), "audio", "abc", 30.0, 40.0, "wav")
+    os.makedirs(os.path.dirname(src))
+    with open(src, "wb") as f:
+        f.write(b"samples")
+    dst = tmp_path / "audio" / "Dog" / "audio_0_start_30_end_40.wav"
+    dst.parent.mkdir(parents=True)
+    return src, str(dst)
+
+
+def _unsupported(*args):
+    raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+
+def test_link_modes(tmp_path):
+    src, dst = _stored(tmp_path)
+    assert src.endswith(os.path.join("store", "audio", "abc_start_30_end_40.wav"))
+    assert link_output(src, dst) == "hardlink"
+    assert os.path.samefile(src, dst) and os.stat(src).st_nlink == 2
+
+    # An existing output is replaced
+    assert link_output(src, dst, "symlink") == "symlink"
+    assert os.readlink(dst) == os.path.join("..", "..", "store", "audio", "abc_start_30_end_40.wav")
+
+    assert link_output(src, dst, "copy") == "copy"
+    assert not os.path.islink(dst) and not os.path.samefile(src, dst)
+    with open(dst, "rb") as f:
+        assert f.read() == b"samples"
+
+    with pytest.raises(ValueError, match="Unknown link mode"):
+        link_output(src, dst, "move")
+
+
+def test_hardlink_falls_back_to_symlink_then_copy(tmp_path, monkeypatch):
+    src, dst = _stored(tmp_path)
+    monkeypatch.setattr(utils.store.os, "link", _unsupported)
+    assert link_output(src, dst) == "symlink"
+    assert os.path.islink(dst)
+
+    monkeypatch.setattr(utils.store.os, "symlink", _unsupported)
+    assert link_output(src, dst) == "copy"
+    assert not os.path.islink(dst) and os.path.getsize(dst) == os.path.getsize(src)
+
+    with pytest.raises(OSError):
+        link_output(src, dst, fallback=False)
+    assert not os.path.exists(dst)
+
+
+def test_reflink_falls_back_to_copy(tmp_path, monkeypatch):
+    src, dst = _stored(tmp_path)
+    monkeypatch.setattr(utils.store, "_reflink", _unsupported)
+    assert link_output(src, dst, "reflink") == "copy"
+    with pytest.raises(OSError):
+        link_output(src, dst, "reflink", fallback=False)
+
+
+def test_label_index_lists_the_clips_of_a_label(tmp_path):
+    index = LabelIndex(tmp_path / "index.sqlite")
+    audio = stored_path(str(tmp_path), "audio", "abc", 30.0, 40.0, "wav")
+    video = stored_path(str(tmp_path), "video", "abc", 30.0, 40.0, "mp4")
+    index.add("abc", 30.0, 40.0, ["Dog", "Bark"], {"audio": audio, "video": video})
+    index.add("def", 0.0, 10.0, ["Dog"], {"audio": stored_path(str(tmp_path), "audio", "def", 0.0, 10.0, "wav")})
+    assert index.labels() == {"Dog": 2, "Bark": 1}
+    assert index.clips("Bark", "audio") == [("abc", 30.0, 40.0, "audio", audio)]
+    assert [clip[:2] for clip in index.clips("Dog", "audio")] == [("abc", 30.0), ("def", 0.0)]
+    assert len(index.clips("Dog")) == 3
+
+    # Re-adding a clip replaces its labels and outputs
+    index.add("abc", 30.0, 40.0, ["Bark"], {"audio": audio})
+    assert index.labels() == {"Dog": 1, "Bark": 1}
+    assert index.clips("Bark") == [("abc", 30.0, 40.0, "audio", audio)]
+
+    index.remove("abc", 30.0)
+    assert index.labels() == {"Dog": 1}
+    index.close()
+    # Paths are stored relative to the data directory
+    moved = tmp_path.parent / (tmp_path.name + "_moved")
+    os.rename(tmp_path, moved)
+    index = LabelIndex(moved / "index.sqlite")
+    assert index.clips("Dog")[0][4] == stored_path(str(moved), "audio", "def", 0.0, 10.0, "wav")
+    index.close()
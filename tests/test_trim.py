@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+
+import utils.trim
+from utils.trim import trim_segment
+
+
+class FakeFFmpeg:
+    """
+    Records the ffmpeg commands trim_segment builds and answers with silence.
+    """
+    runs = []
+
+    def __init__(self, inputs, outputs, global_options):
+        self.inputs, self.outputs = inputs, outputs
+
+    def run(self, stdout=None, stderr=None):
+        FakeFFmpeg.runs.append(self)
+        audio = np.zeros((160, 2), dtype="<f4") if "pipe:1" in self.outputs else np.zeros(0, "<f4")
+        return audio.tobytes(), b""
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    FakeFFmpeg.runs = []
+    monkeypatch.setattr(utils.trim.ffmpy, "FFmpeg", FakeFFmpeg)
+    monkeypatch.setattr(utils.trim, "probe_audio_rate", lambda path: 44100)
+    return FakeFFmpeg.runs
+
+
+def _keyframe(monkeypatch, time):
+    monkeypatch.setattr(utils.trim, "keyframe_before", lambda path, start: time)
+
+
+def test_keyframe_on_the_cut_copies_the_video(ffmpeg, monkeypatch):
+    _keyframe(monkeypatch, 29.98)
+    video_start, audio, rate = trim_segment("v.mp4", None, 30.0, 40.0, video_out="out.mp4")
+    assert video_start == 29.98 and audio is None and rate is None
+    [run] = ffmpeg
+    assert run.inputs == {"v.mp4": "-ss 29.98"}
+    assert "-c:v copy" in run.outputs["out.mp4"]
+    assert "-map 0:v:0 -map 0:a:0?" in run.outputs["out.mp4"]
+
+
+def test_keyframe_far_from_the_cut_reencodes(ffmpeg, monkeypatch):
+    _keyframe(monkeypatch, 28.0)
+    video_start, _, _ = trim_segment("v.mp4", None, 30.0, 40.0, video_out="out.mp4")
+    assert video_start == 30.0
+    assert "-c:v libx264" in ffmpeg[0].outputs["out.mp4"]
+
+    # "copy" starts on the earlier keyframe and keeps the end of the segment
+    video_start, _, _ = trim_segment("v.mp4", None, 30.0, 40.0, video_out="out.mp4", video_codec="copy")
+    assert video_start == 28.0
+    assert ffmpeg[1].outputs["out.mp4"].startswith("-map 0:v:0 -map 0:a:0? -t 12.0 -c:v copy")
+
+    _keyframe(monkeypatch, None)
+    trim_segment("v.mp4", None, 30.0, 40.0, video_out="out.mp4", video_codec="copy")
+    assert "-c:v libx264" in ffmpeg[2].outputs["out.mp4"]
+
+
+def test_video_and_audio_are_cut_in_one_pass(ffmpeg, monkeypatch):
+    _keyframe(monkeypatch, 28.0)
+    video_start, audio, rate = trim_segment(
+        "v.mp4", "a.m4a", 30.0, 40.0, video_out="out.mp4", audio_channels=2, video_codec="copy"
+    )
+    [run] = ffmpeg
+    assert run.inputs == {"v.mp4": "-ss 28.0", "a.m4a": "-ss 30.0"}
+    assert run.outputs["out.mp4"].startswith("-map 0:v:0 -t 12.0")
+    assert run.outputs["pipe:1"] == "-map 1:a:0 -t 10.0 -f f32le -acodec pcm_f32le -ac 2"
+    assert audio.shape == (160, 2) and rate == 44100
+
+
+def test_muxed_audio_skips_to_the_cut_after_the_keyframe(ffmpeg, monkeypatch):
+    _keyframe(monkeypatch, 28.0)
+    trim_segment("v.mp4", None, 30.0, 40.0, video_out="out.mp4", audio_channels=2, video_codec="copy")
+    [run] = ffmpeg
+    assert run.inputs == {"v.mp4": "-ss 28.0"}
+    assert run.outputs["pipe:1"].startswith("-map 0:a:0 -ss 2.0 -t 10.0")
+
+    # Audio only opens the source at the cut
+    trim_segment("v.mp4", None, 30.0, 40.0, audio_channels=2)
+    assert ffmpeg[1].inputs == {"v.mp4": "-ss 30.0"}
+    assert ffmpeg[1].outputs == {"pipe:1": "-map 0:a:0 -t 10.0 -f f32le -acodec pcm_f32le -ac 2"}
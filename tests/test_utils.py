@@ -0,0 +1,51 @@
+import numpy as np
+
+from utils.utils import Data, stable_hash
+
+LABELS = """index,mid,display_name
+0,/m/09x0r,"Speech"
+1,/m/0bt9lr,"Dog"
+2,/m/01yrx,"Cat"
+"""
+
+SEGMENTS = """# Segments csv
+# YTID, start_seconds, end_seconds, positive_labels
+{rows}
+"""
+
+
+def _data(tmp_path, shard=None):
+    ytids = [f"video{i:06d}" for i in range(40)]
+    rows = [
+        f'{ytid}, {i}.000, {i + 10}.000, "{["/m/09x0r", "/m/0bt9lr", "/m/01yrx"][i % 3]}"'
+        for i, ytid in enumerate(ytids)
+    ]
+    (tmp_path / "labels.csv").write_text(LABELS)
+    (tmp_path / "segments.csv").write_text(SEGMENTS.format(rows="\n".join(rows)))
+    data = Data(
+        str(tmp_path / "segments.csv"), str(tmp_path / "labels.csv"), ["Dog", "Cat"],
+        cache_dir=str(tmp_path / "cache"), shard=shard,
+    )
+    return data, ytids
+
+
+def test_selection_keeps_rows_of_the_cached_columns(tmp_path):
+    data, ytids = _data(tmp_path, shard=(1, 2))
+    expected = [
+        i for i, ytid in enumerate(ytids) if i % 3 != 0 and stable_hash(ytid) % 2 == 1
+    ]
+    assert list(data.row) == expected
+    assert [str(ytid) for ytid in data.ytids] == [ytids[i] for i in expected]
+    assert np.array_equal(np.asarray(data.end) - np.asarray(data.start), np.full(len(expected), 10.0))
+    assert data.labels_of(0) == [["Speech", "Dog", "Cat"][expected[0] % 3]]
+    # The columns are read through the selection, not copied
+    assert isinstance(data._columns["start"], np.memmap)
+
+
+def test_take_narrows_the_selection(tmp_path):
+    data, ytids = _data(tmp_path)
+    data.take([2, 0])
+    assert list(data.row) == [4, 1]
+    assert str(data.ytids[0]) == ytids[4]
+    assert float(data.start[1]) == 1.0
+    assert data.label_bits.shape == (2, 1)
@@ -0,0 +1,145 @@
+import os
+import shutil
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from utils.progress import DONE, FAILED, ProgressStore
+from utils.shards import ShardWriter
+from utils.splits import Split
+from utils.store import clip_paths
+from utils.verify import check_duration, check_wav, verify_outputs, wav_data_chunk
+from utils.workqueue import LeaseQueue
+
+RATE = 16000
+
+
+def _tone(seconds, rate=RATE, channels=1, amplitude=0.5):
+    t = np.arange(int(seconds * rate)) / rate
+    samples = amplitude * np.sin(2 * np.pi * 440 * t)
+    return np.repeat(samples[:, None], channels, axis=1)
+
+
+def _split(tmp_path, clamped=None):
+    data = SimpleNamespace(
+        row=np.arange(1),
+        index=np.arange(1),
+        ytids=np.array(["abc"]),
+        url=["https://www.youtube.com/watch?v=abc"],
+        lables=[["Dog"]],
+        start=np.array([0.0]),
+        end=np.array([10.0]),
+    )
+    split = Split("train", data, tmp_path / "data", tmp_path / "state")
+    os.makedirs(split.state_dir)
+    store = ProgressStore(split.store_path)
+    store.done("abc", 0.0, 1, clamped=clamped)
+    store.close()
+    return split
+
+
+def _args(mode):
+    return SimpleNamespace(mode=mode, sink="files", sample_rate=[(RATE, 1)], process_workers=1)
+
+
+def _write_audio(split, seconds):
+    _, path = clip_paths(split.data_dir, 0, "Dog", 0.0, 10.0)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    sf.write(path, _tone(seconds), RATE, subtype="PCM_16")
+    return path
+
+
+def test_check_wav_reads_the_header_and_level(tmp_path):
+    path = str(tmp_path / "clip.wav")
+    sf.write(path, _tone(2.0, channels=2), RATE, subtype="PCM_16")
+    assert check_wav(path, RATE, 2) == (None, 2.0)
+    assert "expected 16000 Hz x 1" in check_wav(path, RATE, 1)[0]
+
+    sf.write(path, _tone(1.0, amplitude=0.0), RATE, subtype="PCM_16")
+    assert check_wav(path, RATE, 1)[0].startswith("silent")
+
+    sf.write(path, _tone(1.0), RATE, subtype="FLOAT")
+    assert "expected PCM_16" in check_wav(path, RATE, 1)[0]
+
+    sf.write(path, _tone(1.0), RATE, subtype="PCM_16")
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 100)
+    assert check_wav(path, RATE, 1)[0].startswith("truncated")
+
+    with open(path, "wb") as f:
+        f.write(b"not a wav file")
+    assert check_wav(path, RATE, 1)[0].startswith("unreadable")
+
+
+def test_data_chunk_is_found_after_other_chunks(tmp_path):
+    samples = (_tone(1.5, channels=2) * 32767).astype("<i2").tobytes()
+    fmt = struct.pack("<HHIIHH", 1, 2, RATE, RATE * 4, 4, 16)
+    # An odd-sized chunk is padded to an even length
+    chunks = b"fmt " + struct.pack("<I", len(fmt)) + fmt + b"LIST" + struct.pack("<I", 3) + b"abc\0"
+    chunks += b"data" + struct.pack("<I", len(samples)) + samples
+    path = str(tmp_path / "clip.wav")
+    with open(path, "wb") as f:
+        f.write(b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks)
+    assert wav_data_chunk(path) == (12 + 8 + len(fmt) + 12 + 8, len(samples))
+    assert check_wav(path, RATE, 2) == (None, 1.5)
+
+
+def test_check_duration_accepts_the_clamped_length():
+    assert check_duration(10.05, 10.0, None, 0.1) == (None, None)
+    assert check_duration(4.0, 10.0, 4.0, 0.1) == (None, "clamped to 4.00s")
+    assert check_duration(4.0, 10.0, None, 0.1)[0] == "duration 4.00s, expected 10.00s"
+
+
+def test_failed_clip_is_queued_for_repair_and_kept(tmp_path):
+    split = _split(tmp_path)
+    path = _write_audio(split, 3.0)
+
+    summary = verify_outputs(split, _args("only_audio"), str(tmp_path))
+    assert summary["failed"] == 1
+    assert os.path.exists(path)
+    store = ProgressStore(split.store_path)
+    assert store.get("abc", 0.0)["state"] == FAILED
+    queue = LeaseQueue(tmp_path / "repair.sqlite")
+    [job] = queue.acquire("worker")
+    assert job["repair"] and job["ytid"] == "abc"
+
+
+def test_clamped_length_comes_from_the_progress_store(tmp_path):
+    # No metadata cache, so the clamped length can only come from the store
+    split = _split(tmp_path, clamped=4.0)
+    _write_audio(split, 4.0)
+    summary = verify_outputs(split, _args("only_audio"), str(tmp_path))
+    assert summary == {"checked": 1, "ok": 1, "clamped": 1, "failed": 0}
+    assert ProgressStore(split.store_path).get("abc", 0.0)["state"] == DONE
+
+
+@pytest.mark.skipif(shutil.which("ffprobe") is not None, reason="needs a host without ffprobe")
+def test_missing_ffprobe_aborts_without_touching_outputs(tmp_path):
+    split = _split(tmp_path)
+    path, _ = clip_paths(split.data_dir, 0, "Dog", 0.0, 10.0)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as f:
+        f.write(b"video")
+    with pytest.raises(Exception, match="ffprobe"):
+        verify_outputs(split, _args("only_video"), str(tmp_path))
+    assert os.path.exists(path)
+    assert ProgressStore(split.store_path).get("abc", 0.0)["state"] == DONE
+
+
+def test_shard_sink_checks_the_other_variants_as_files(tmp_path):
+    split = _split(tmp_path)
+    with ShardWriter(os.path.join(split.data_dir, "shards"), RATE, 1) as writer:
+        writer.add("abc", 0.0, 10.0, [0], (_tone(10.0)[:, 0] * 32767).astype(np.int16))
+    args = SimpleNamespace(
+        mode="only_audio", sink="shards", sample_rate=[(RATE, 1), (8000, 1)], process_workers=1
+    )
+    _, path = clip_paths(split.data_dir, 0, "Dog", 0.0, 10.0, "audio_8000hz")
+    os.makedirs(os.path.dirname(path))
+    sf.write(path, _tone(10.0, rate=8000), 8000, subtype="PCM_16")
+    assert verify_outputs(split, args, str(tmp_path))["ok"] == 1
+
+    sf.write(path, _tone(10.0, rate=8000, amplitude=0.0), 8000, subtype="PCM_16")
+    assert verify_outputs(split, args, str(tmp_path), recheck=True)["failed"] == 1
@@ -0,0 +1,150 @@
+import logging
+import multiprocessing
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import utils.workqueue
+from utils.workqueue import (
+    DONE, FAILED, LEASED, PENDING, LeaseHeartbeat, LeaseQueue, RemoteLeaseQueue, leased_jobs, serve_queue,
+)
+
+
+def _jobs(n):
+    return [{"ytid": f"video{i:04d}", "start": float(i)} for i in range(n)]
+
+
+def _expire(queue):
+    # Let every lease run out without waiting for lease_seconds
+    with sqlite3.connect(queue.path) as conn:
+        conn.execute("UPDATE jobs SET lease_expires = 0 WHERE state = ?", (LEASED,))
+
+
+def test_expired_lease_goes_back_to_another_worker(tmp_path):
+    queue = LeaseQueue(tmp_path / "queue.sqlite")
+    queue.load(_jobs(1))
+    [job] = queue.acquire("a")
+    assert queue.acquire("b") == []
+
+    _expire(queue)
+    assert queue.acquire("b") == [job]
+    assert queue.counts() == {LEASED: 1}
+    # The worker that lost the lease can no longer report the job
+    assert not queue.complete("a", job["ytid"], job["start"], result=1)
+    assert queue.complete("b", job["ytid"], job["start"], result=2)
+    assert queue.counts() == {DONE: 1}
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    queue = LeaseQueue(tmp_path / "queue.sqlite", lease_seconds=0.2)
+    queue.load(_jobs(1))
+    [job] = queue.acquire("a")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.heartbeat("a", [(job["ytid"], job["start"])]) == 1
+    assert queue.acquire("b") == []
+
+
+def test_job_fails_after_max_attempts(tmp_path):
+    queue = LeaseQueue(tmp_path / "queue.sqlite", max_attempts=2)
+    queue.load(_jobs(1))
+    for worker in ["a", "b"]:
+        assert len(queue.acquire(worker)) == 1
+        _expire(queue)
+    assert queue.acquire("c") == []
+    assert queue.counts() == {FAILED: 1}
+    with sqlite3.connect(queue.path) as conn:
+        assert conn.execute("SELECT attempts, error FROM jobs").fetchone() == (2, "lease expired")
+
+
+def test_reported_error_fails_the_job_and_requeue_resets_it(tmp_path):
+    queue = LeaseQueue(tmp_path / "queue.sqlite")
+    queue.load(_jobs(1))
+    [job] = queue.acquire("a")
+    queue.complete("a", job["ytid"], job["start"], error="Private video")
+    assert queue.counts() == {FAILED: 1}
+    assert queue.load(_jobs(1)) == 0
+    assert queue.load(_jobs(1), requeue=True) == 1
+    assert queue.counts() == {PENDING: 1}
+
+
+def _drain(path, worker_id):
+    queue = LeaseQueue(path, lease_seconds=5.0)
+    with LeaseHeartbeat(queue, worker_id, interval=1.0) as heartbeat:
+        for job in leased_jobs(queue, worker_id, heartbeat, batch_size=3, poll_interval=0.05):
+            time.sleep(0.001)
+            queue.complete(worker_id, job["ytid"], job["start"], result=worker_id)
+            heartbeat.release(job["ytid"], job["start"])
+    queue.close()
+
+
+def test_two_workers_drain_one_queue(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    queue = LeaseQueue(path)
+    queue.load(_jobs(200))
+
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_drain, args=(path, f"worker{i}")) for i in range(2)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    assert queue.counts() == {DONE: 200}
+    with sqlite3.connect(path) as conn:
+        # Every job was leased once and reported by one of the workers
+        assert conn.execute("SELECT MAX(attempts) FROM jobs").fetchone() == (1,)
+        results = {result for (result,) in conn.execute("SELECT DISTINCT result FROM jobs")}
+    assert results <= {'"worker0"', '"worker1"'}
+
+
+def test_remote_queue_retries_dropped_connections(tmp_path, monkeypatch):
+    queue = LeaseQueue(tmp_path / "queue.sqlite")
+    queue.load(_jobs(1))
+    server = serve_queue(queue, host="127.0.0.1", port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(utils.workqueue, "backoff_delay", lambda attempt: 0.0)
+    urlopen, calls, failures = urllib.request.urlopen, [], [2]
+
+    def flaky_urlopen(request, timeout):
+        calls.append(request.full_url)
+        if failures[0]:
+            failures[0] -= 1
+            raise urllib.error.URLError(ConnectionRefusedError("coordinator restarting"))
+        return urlopen(request, timeout=timeout)
+
+    monkeypatch.setattr(urllib.request, "urlopen", flaky_urlopen)
+    try:
+        remote = RemoteLeaseQueue(f"http://127.0.0.1:{server.server_port}", max_retries=2)
+        [job] = remote.acquire("a")
+        assert job["ytid"] == "video0000" and len(calls) == 3
+
+        failures[0] = 3
+        with pytest.raises(urllib.error.URLError):
+            remote.counts()
+
+        # A client error is not retried
+        calls.clear()
+        with pytest.raises(urllib.error.HTTPError):
+            remote._call("missing")
+        assert len(calls) == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_heartbeat_failure_is_logged(caplog):
+    class Unreachable:
+        def heartbeat(self, worker_id, keys):
+            raise urllib.error.URLError("coordinator down")
+
+    with caplog.at_level(logging.WARNING, logger="utils.workqueue"):
+        with LeaseHeartbeat(Unreachable(), "a", interval=0.01) as heartbeat:
+            heartbeat.hold("abc", 0.0)
+            time.sleep(0.1)
+    assert "Lease heartbeat of 1 jobs failed" in caplog.text
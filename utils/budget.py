@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+class BandwidthBudget:
+    """
+    Global limit on the download volume of a run.
+
+    max_rate (bytes/s) spreads fetches out so the average rate stays below it:
+    every fetched byte pushes the earliest start of the next fetch back by
+    1 / max_rate seconds, and wait() blocks until then. max_bytes stops the
+    run: limit() stops handing out jobs once that many bytes were fetched, so
+    only the clips already in flight finish. Either can be None.
+    """
+
+    def __init__(self, max_rate=None, max_bytes=None):
+        self.max_rate = max_rate
+        self.max_bytes = max_bytes
+        self.spent = 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self):
+        return self.max_bytes is not None and self.spent >= self.max_bytes
+
+    def wait(self):
+        if not self.max_rate:
+            return
+        with self._lock:
+            delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def consume(self, n_bytes):
+        with self._lock:
+            self.spent += n_bytes
+            if self.max_rate:
+                self._next = max(self._next, time.monotonic()) + n_bytes / self.max_rate
+
+    def limit(self, jobs):
+        """
+        Yield jobs until the byte budget is spent.
+        """
+        for job in jobs:
+            if self.exhausted:
+                return
+            yield job
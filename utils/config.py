@@ -0,0 +1,44 @@
+import json
+import os
+
+# Environment variables that override the config file, by option name
+ENV_SETTINGS = {
+    "tmp_dir": "AUDIOSET_TMP_DIR",
+    "destination_dir": "AUDIOSET_DATA_DIR",
+    "proxy": "AUDIOSET_PROXY",
+    "csv_dataset": "AUDIOSET_CSV",
+    "label_file": "AUDIOSET_LABELS",
+}
+CONFIG_ENV = "AUDIOSET_CONFIG"
+CONFIG_FILE = "audioset.json"
+
+
+def load_config(path=None):
+    """
+    This function returns the option defaults set by the user: the JSON
+    object in path (default $AUDIOSET_CONFIG, else ./audioset.json when it
+    exists), keyed by option name, overridden by the AUDIOSET_* environment
+    variables in ENV_SETTINGS. Command line flags override both.
+    """
+    path = path or os.environ.get(CONFIG_ENV)
+    if path is None and os.path.isfile(CONFIG_FILE):
+        path = CONFIG_FILE
+    config = {}
+    if path is not None:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        if not isinstance(config, dict):
+            raise ValueError(f"Config file {path} must hold a JSON object of option names and values")
+    for name, variable in ENV_SETTINGS.items():
+        if os.environ.get(variable):
+            config[name] = os.environ[variable]
+    return config
+
+
+def state_dir(args):
+    """
+    This function returns the directory holding the progress store, caches,
+    logs and scratch space of a run: --tmp_dir, or .tmp inside the
+    destination directory, so each dataset keeps its own state.
+    """
+    return str(args.tmp_dir or os.path.join(args.destination_dir, ".tmp"))
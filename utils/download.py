@@ -1,333 +1,827 @@
-import os
-import shutil
-from yt_dlp import YoutubeDL
-import soundfile as sf
-from moviepy.video.io.VideoFileClip import VideoFileClip
-from moviepy.editor import AudioFileClip
-from moviepy.config import change_settings
-from tqdm import tqdm
-from joblib import delayed, Parallel
-import numpy as np
-import tempfile
-import json
-from time import sleep
-import logging
-from datetime import datetime
-import subprocess as sp
-import ffmpy
-
-from pathlib import Path
-
-TMP_DIR = Path("E:/sedDatasets/AudioSet/tmp")
-os.makedirs(TMP_DIR, exist_ok=True)
-
-log_file = os.path.join(TMP_DIR, f'download_errors_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(log_file, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
-
-def cleanup_temp_files(verbose=False):
-    patterns = ["*TEMP_MPY*", "temp_*", "*_.mp4", "*.m4a", "*.wav"]
-    for pattern in patterns:
-        for temp_file in TMP_DIR.glob(pattern):
-            try:
-                os.remove(temp_file)
-            except Exception as e:
-                if verbose:
-                    print(f"Failed to remove temp file {temp_file}: {e}")
-
-def convert_audio_to_wav(input_path, output_path, start_time=None, end_time=None, sample_rate=16000):
-    
-    if not os.path.exists(input_path):
-        print(f"[{input_path}] File not found")
-        return False
-    
-    ff = ffmpy.FFmpeg(
-        inputs={
-            input_path: f'-ss {start_time} -t {end_time - start_time}'
-            },
-        outputs={
-            output_path: f'-acodec pcm_s16le -ar {sample_rate} -ac 1 -y'
-            },
-        global_options={"-loglevel quiet"},
-    )
-    ff.run()
-    
-    # Remove temp audio
-    if os.path.exists(input_path):
-        os.remove(input_path)
-
-    print(f"Successfully converted {input_path} to {output_path}")
-    return True
-
-def download_a_video_audio(
-    faulty_files,
-    data_dir,
-    audio_id,
-    url,
-    labels,
-    start_time=None,
-    end_time=None,
-    mode="video",
-    timeout=1,
-    verbose=True,
-):
-    download_status = False
-    video_id = url.split("=")[-1]
-
-    try:
-        end_time_save = end_time
-        all_files_exist = True
-        for label in labels:
-            if mode in ["only_audio", "both_separate"]:
-                label_dir_audio = os.path.join(data_dir,"audio",label)
-                os.makedirs(label_dir_audio, exist_ok=True)
-            label_dir_video = os.path.join(data_dir,"video",label)
-            os.makedirs(label_dir_video, exist_ok=True)
-
-            if mode in ["video", "only_video", "both_separate"]:
-                video_path = os.path.join(
-                    label_dir_video,
-                    f'video_{audio_id}_start_{int(start_time)}_end_{int(end_time)}.mp4'
-                )
-                if not os.path.exists(video_path):
-                    all_files_exist = False
-                    break
-
-            if mode in ["only_audio", "both_separate"]:
-                audio_path = os.path.join(
-                    label_dir_audio,
-                    f'audio_{audio_id}_start_{int(start_time)}_end_{int(end_time)}.wav'
-                )
-                if not os.path.exists(audio_path):
-                    all_files_exist = False
-                    break
-
-        if all_files_exist:
-            if verbose:
-                logger.info(f"[{audio_id}] Files already exist for {url}, skipping...")
-            return True
-
-        existing_video = None
-        for file in os.listdir(TMP_DIR):
-            if video_id in file and file.endswith('.mp4'):
-                existing_video = os.path.join(TMP_DIR, file)
-                if verbose:
-                    logger.info(f"[{audio_id}] Found existing video file: {existing_video}")
-                break
-
-        if not existing_video:
-            if verbose:
-                logger.info(f"[{audio_id}] Start downloading {url}")
-            if mode in ["both_separate"]:
-                video_opts = {
-                    'quiet': not verbose,
-                    'no_warnings': not verbose,
-                    'proxy': 'http://127.0.0.1:7890',
-                    'outtmpl': os.path.join(TMP_DIR, f'%(id)s.%(ext)s'),
-                    'skip_unavailable_fragments': True,
-                    'ignoreerrors': True,
-                    'age_limit': None,
-                    'format': 'bestvideo[ext=mp4]',
-                    # 'cookiefile': './need_cookies.txt',
-                }
-                audio_opts = {
-                    'quiet': not verbose,
-                    'no_warnings': not verbose,
-                    'proxy': 'http://127.0.0.1:7890',
-                    'outtmpl': os.path.join(TMP_DIR, f'%(id)s.%(ext)s'),
-                    'skip_unavailable_fragments': True,
-                    'ignoreerrors': True,
-                    'age_limit': None,
-                    'format': 'bestaudio/best', 
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'm4a',
-                    }],
-                    # 'cookiefile': './need_cookies.txt',
-                }
-            elif mode in ["video"]:
-                video_opts = audio_opts = {
-                    'quiet': not verbose,
-                    'no_warnings': not verbose,
-                    'proxy': 'http://127.0.0.1:7890',
-                    'outtmpl': os.path.join(TMP_DIR, f'%(id)s.%(ext)s'),
-                    'skip_unavailable_fragments': True,
-                    'ignoreerrors': True,
-                    'age_limit': None,
-                    'format': 'best[ext=mp4]',
-                }
-            with YoutubeDL(video_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                if info is None:
-                    logger.error(f"[{audio_id}] Failed to download file for {url}")
-                    raise Exception(f"Failed to download file for {url}")
-                video_path = os.path.join(TMP_DIR, f'{video_id}.mp4')
-                ydl.download([url])
-                if not os.path.exists(video_path):
-                    logger.error(f"[{audio_id}] Downloaded file not found at {video_path}")
-                    raise Exception(f"Downloaded file not found at {video_path}")
-                if verbose:
-                    print(f"[{audio_id}] Successfully downloaded: {video_path}")
-                    logger.info(f"[{audio_id}] Successfully downloaded: {video_path}")
-            with YoutubeDL(audio_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                if info is None:
-                    logger.error(f"[{audio_id}] Failed to download file for {url}")
-                    raise Exception(f"Failed to download file for {url}")
-                audio_path = os.path.join(TMP_DIR, f'{video_id}.m4a')
-                ydl.download([url])
-                if not os.path.exists(audio_path):
-                    logger.error(f"[{audio_id}] Downloaded file not found at {audio_path}")
-                    raise Exception(f"Downloaded file not found at {audio_path}")
-                if verbose:
-                    print(f"[{audio_id}] Successfully downloaded: {audio_path}")
-                    logger.info(f"[{audio_id}] Successfully downloaded: {audio_path}")
-            print(f"[{audio_id}] Successfully downloaded video and audio")
-        print(f"[{audio_id}] video_path: {video_path}")
-        print(f"[{audio_id}] audio_path: {audio_path}")
-
-        if mode in ["video", "only_video", "both_separate"] and start_time != None:
-            print(f"[{audio_id}] Start processing video")
-            original_id = audio_id
-            # safe_video_id = video_id.replace('-', '_') if video_id.startswith('-') else video_id
-            video_path_tmp = os.path.join(TMP_DIR, f'{video_id}_processed.mp4')
-            print(f"[{audio_id}] video_path_tmp: {video_path_tmp}")
-            audio_path_tmp_wav = os.path.join(TMP_DIR, f'{video_id}_processed.wav')
-            print(f"[{audio_id}] audio_path_tmp_wav: {audio_path_tmp_wav}")
-            with VideoFileClip(video_path) as video:
-                # get real video duration
-                actual_duration = video.duration
-                # check video duration
-                if actual_duration <= end_time:
-                    print(f"Video duration ({actual_duration}s) is shorter than requested end time ({end_time}s)")   
-                    end_time = actual_duration
-                    print("---------------------------end time is changed: ----------------------------------------", end_time)
-                if start_time >= actual_duration:
-                    raise Exception(f"Start time ({start_time}s) exceeds video duration ({actual_duration}s)")
-                if end_time <= start_time:
-                    raise Exception(f"End time ({end_time}s) must be greater than start time ({start_time}s)")
-                new_video = video.subclip(start_time, end_time)
-                convert_audio_to_wav(audio_path, 
-                                     audio_path_tmp_wav, 
-                                     start_time, 
-                                     end_time)
-                new_video.write_videofile(video_path_tmp, 
-                                          audio_codec='aac', 
-                                          logger=None)
-                print("Successfully processed video to: ", video_path_tmp)
-                print("Successfully processed audio to: ", audio_path_tmp_wav)
-                if not os.path.exists(video_path_tmp) or os.path.getsize(video_path_tmp) == 0:
-                    print(f"Processed video file not found at {video_path_tmp}")
-                    raise Exception(f"Processed video file not found at {video_path_tmp}")
-            if os.path.exists(video_path_tmp) and os.path.isfile(video_path_tmp) and os.path.getsize(video_path_tmp) > 0:
-                os.remove(video_path)
-                print("Successfully removed original video file: ", video_path)
-        for label in labels:
-            video_save_path = os.path.join(
-                data_dir,
-                "video",
-                label,
-                f"video_{original_id}_start_{int(start_time)}_end_{int(end_time_save)}.mp4"
-            )
-            audio_save_path = os.path.join(
-                data_dir,
-                "audio",
-                label,
-                f"audio_{original_id}_start_{int(start_time)}_end_{int(end_time_save)}.wav"
-            )
-            os.makedirs(os.path.dirname(video_save_path), exist_ok=True)
-            os.makedirs(os.path.dirname(audio_save_path), exist_ok=True)
-            if mode in ["only_audio", "both_separate"]:
-                shutil.copy(audio_path_tmp_wav, audio_save_path)
-                print(f"Successfully copied audio to: {audio_save_path}")
-            if mode in ["both_separate", "video", "only_video"]:
-                shutil.copy(video_path_tmp, video_save_path)
-                print(f"Successfully copied video to: {video_save_path}")
-
-        # make sure that the temp files are removed
-
-        while os.path.isfile(video_path_tmp):
-            os.remove(video_path_tmp)
-        while os.path.isfile(audio_path_tmp_wav):
-            os.remove(audio_path_tmp_wav)
-        print("Successfully removed temporary video file: ", video_path_tmp)
-        print("Successfully removed temporary audio file: ", audio_path_tmp_wav)
-
-        download_status = True
-
-    except Exception as e:
-        if verbose:
-            print(f"Error: {e}")
-        faulty_files.append(f"{audio_id + 4} {start_time} {end_time_save} {labels} {url}")
-        faulty_files.append(e)
-        download_status = False
-
-    return download_status
-
-def parallel_download(data, args):
-    steps = 2
-    faulty_files = []
-    progress_file = os.path.join(TMP_DIR, "download_progress.json")
-
-    logger.info("Starting parallel download process")
-    logger.info(f"Total files to process: {len(data.index)}")
-    completed_ids = set()
-    if os.path.exists(progress_file):
-        try:
-            with open(progress_file, 'r') as f:
-                completed_ids = set(json.load(f))
-            print(f"Found {len(completed_ids)} completed downloads")
-        except:
-            completed_ids = set()
-
-    if not os.path.isdir(TMP_DIR):
-        os.makedirs(TMP_DIR, exist_ok=True)
-    pending_indices = [i for i in range(len(data.index)) if str(data.index[i]) not in completed_ids]
-    print(f"Remaining tasks: {len(pending_indices)}")
-    batch_size = steps
-    for i in range(0, len(pending_indices), batch_size):
-        batch_indices = pending_indices[i:i + batch_size]
-        try:
-            batch_results = Parallel(n_jobs=steps)(
-                delayed(download_a_video_audio)(
-                    faulty_files,
-                    args.destination_dir,
-                    data.index[idx],
-                    data.url[idx],
-                    data.lables[idx],
-                    data.start[idx],
-                    data.end[idx],
-                    args.mode,
-                    args.verbose,
-                )
-                for idx in tqdm(batch_indices, desc="Downloading")
-            )
-            for idx, success in zip(batch_indices, batch_results):
-                if success:
-                    completed_ids.add(str(data.index[idx]))
-                    data.download_status[idx] = True
-                    with open(progress_file, 'w') as f:
-                        json.dump(list(completed_ids), f)
-                else:
-                    faulty_files.append(
-                        f"{data.index[idx]} {data.start[idx]} {data.end[idx]} {data.lables[idx]} {data.url[idx]}"
-                    )
-
-        except Exception as e:
-            logger.error(f"Batch processing error: {str(e)}")
-            continue
-
-        print(f"Completed batch {i//batch_size + 1}/{(len(pending_indices) + batch_size - 1)//batch_size}, resting...")
-        sleep(5)
-    if faulty_files:
-        error_filename = f"download_errors_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        np.savetxt(error_filename, faulty_files, fmt="%s")
-        logger.info(f"Saved error log to {error_filename}")
-
+import os
+import pickle
+import shutil
+import soundfile as sf
+from tqdm import tqdm
+import numpy as np
+import time
+import logging
+from datetime import datetime
+from functools import partial
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import threading
+
+from utils.pipeline import prefetch, run_pipeline
+from utils.progress import ProgressStore, DONE, UNAVAILABLE, isin_keys
+from utils.retry import AIMDController, PERMANENT, call_with_retry, classify_error, range_unsupported
+from utils.fsindex import FileIndex
+from utils.shards import ShardWriter
+from utils.metrics import Metrics, timed
+from utils.fetchers import YoutubeDLFetcher
+from utils.metacache import MetadataCache
+from utils.formats import AUDIO_MODES, VIDEO_MODES, FormatPolicy, format_bytes
+from utils.budget import BandwidthBudget
+from utils.scratch import ScratchDir, TempQuota
+from utils.config import state_dir
+from utils.utils import manifest_jobs
+from utils.quota import build_quota
+from utils.splits import group_jobs
+from utils.workqueue import LeaseHeartbeat, LeaseQueue, RemoteLeaseQueue, leased_jobs, serve_queue
+from utils.trim import probe_duration, trim_segment
+from utils.resample import remix, variant_dir, write_variants
+from utils.features import FeatureWriter, log_mel
+from utils.store import LabelIndex, clip_paths, link_output, stored_path
+
+logger = logging.getLogger(__name__)
+
+# Label directories already created by this worker process
+_worker_dirs = FileIndex()
+
+# Seconds fetched on each side of a segment, so the cut can start on a keyframe
+SEGMENT_MARGIN = 2.0
+
+def setup_logging(tmp_dir):
+    """
+    Log to the console and to a timestamped file in tmp_dir.
+    """
+    log_file = os.path.join(tmp_dir, f'download_errors_{datetime.now().strftime("%Y%m%d_%H%M%S")}.log')
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(log_file, encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+
+def _total_size(paths):
+    return sum(os.path.getsize(path) for path in paths if path and os.path.isfile(path))
+
+def _source_paths(fetched, mode):
+    """
+    This function returns the downloaded files of fetch_clip's result that the
+    mode actually produces; the other path it returns does not exist.
+    """
+    video_path, audio_path = fetched[:2]
+    return ([video_path] if mode in VIDEO_MODES else []) + ([audio_path] if mode in AUDIO_MODES else [])
+
+def _find_fetched(video_id, start_time, mode, scratch_dir, index=None):
+    """
+    This function looks for files of a clip that were already fetched into
+    scratch_dir, in the file index when one is given and on disk otherwise.
+    A full download is preferred over a segment download.
+    """
+    exists = os.path.exists if index is None else (lambda path: index.has_temp(os.path.basename(path)))
+    candidates = [(video_id, 0.0)]
+    if start_time is not None:
+        offset = max(0.0, start_time - SEGMENT_MARGIN)
+        candidates.append((f"{video_id}_seg{int(start_time)}", offset))
+    for name, offset in candidates:
+        fetched = (os.path.join(scratch_dir, f'{name}.mp4'), os.path.join(scratch_dir, f'{name}.m4a'), offset)
+        if all(exists(path) for path in _source_paths(fetched, mode)):
+            return fetched
+    return None
+
+def fetch_clip(audio_id, url, scratch_dir, start_time=None, end_time=None, mode="video",
+               segment_only=True, verbose=True, index=None, timings=None, fetcher=None,
+               metadata=None, policy=None):
+    """
+    Network stage: download the source video and audio of a clip into scratch_dir.
+
+    With segment_only, only start_time..end_time plus SEGMENT_MARGIN seconds on
+    each side is fetched, which lets ffmpeg seek to the covering keyframes with
+    HTTP range requests instead of pulling the whole video. The whole video is
+    only downloaded instead when the range fetch fails because the source does
+    not support it; other errors, such as throttling, are raised.
+    Returns the downloaded paths and the time in the source video at which the
+    downloaded files start. index is an optional FileIndex of scratch_dir that is
+    used for the lookup of earlier downloads and updated with new ones.
+    The time spent on "metadata" and "fetch" is added to timings. fetcher
+    defaults to downloading from YouTube with yt-dlp. metadata is an optional
+    MetadataCache; with it a video known to be unavailable or shorter than
+    start_time is rejected before anything is downloaded. policy is the
+    FormatPolicy that picks the streams, uncapped by default.
+    """
+    video_id = url.split("=")[-1]
+    timings = {} if timings is None else timings
+    fetcher = fetcher or YoutubeDLFetcher(verbose=verbose)
+
+    fetched = _find_fetched(video_id, start_time, mode, scratch_dir, index)
+    if fetched is not None:
+        if verbose:
+            logger.info(f"[{audio_id}] Found existing video file: {fetched[0]}")
+        return fetched
+
+    if verbose:
+        logger.info(f"[{audio_id}] Start downloading {url}")
+    with timed(timings, "metadata"):
+        if metadata is None:
+            info = fetcher.extract_info(url)
+        else:
+            info = metadata.lookup(fetcher, video_id, url)
+    duration = info.get("duration")
+    if duration and start_time is not None:
+        if start_time >= duration:
+            raise Exception(f"Start time ({start_time}s) exceeds video duration ({duration}s)")
+        if end_time is not None:
+            end_time = min(end_time, duration)
+
+    requests = (policy or FormatPolicy()).requests(mode)
+
+    attempts = []
+    if segment_only and start_time is not None and end_time is not None:
+        offset = max(0.0, start_time - SEGMENT_MARGIN)
+        attempts.append((f"{video_id}_seg{int(start_time)}", offset, end_time + SEGMENT_MARGIN))
+    attempts.append((video_id, 0.0, None))
+
+    for name, offset, range_end in attempts:
+        video_path = os.path.join(scratch_dir, f'{name}.mp4')
+        audio_path = os.path.join(scratch_dir, f'{name}.m4a')
+        try:
+            for fmt, extract_audio, ext in requests:
+                path = os.path.join(scratch_dir, f'{name}.{ext}')
+                section = None if range_end is None else (offset, range_end)
+                with timed(timings, "fetch"):
+                    fetcher.download(info, fmt, path, extract_audio, section)
+                if index is not None:
+                    index.add_temp(os.path.basename(path))
+                if verbose:
+                    logger.info(f"[{audio_id}] Successfully downloaded: {path}")
+        except Exception as e:
+            if range_end is None:
+                logger.error(f"[{audio_id}] {e}")
+                raise
+            for path in [video_path, audio_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+                if index is not None:
+                    index.discard_temp(os.path.basename(path))
+            if not range_unsupported(e):
+                logger.error(f"[{audio_id}] {e}")
+                raise
+            logger.info(f"[{audio_id}] Segment download failed ({e}), falling back to full download")
+            continue
+        if verbose:
+            logger.info(f"[{audio_id}] Successfully downloaded video and audio")
+        return video_path, audio_path, offset
+
+class ProcessOptions:
+    """
+    Settings of process_clip that are the same for every clip of a run.
+
+    scratch_dir holds a private work directory per worker process.
+    audio_variants lists the (rate, channels) wavs to write, the first going
+    to the "audio" directories. With audio_sink="shards" that first wav is
+    kept for the caller to pack instead. Downloaded sources are removed
+    unless keep_sources is set. Stored outputs are linked into the label
+    directories with link_mode, falling back as link_output does when
+    link_fallback is set. features holds the log_mel parameters (n_fft, hop, n_mels), or None.
+    """
+
+    def __init__(self, mode, scratch_dir, audio_variants=((16000, 1),), video_codec="auto",
+                 audio_sink="files", keep_sources=False, link_mode="hardlink", link_fallback=True,
+                 features=None, verbose=True):
+        self.mode = mode
+        self.scratch_dir = scratch_dir
+        self.audio_variants = audio_variants
+        self.video_codec = video_codec
+        self.audio_sink = audio_sink
+        self.keep_sources = keep_sources
+        self.link_mode = link_mode
+        self.link_fallback = link_fallback
+        self.features = features
+        self.verbose = verbose
+
+def process_clip(data_dir, audio_id, labels, video_path, audio_path, start_time, end_time, options,
+                 offset=0.0, source_duration=None, store_key=None):
+    """
+    This function trims the downloaded files of a clip, starting offset
+    seconds into the source video, to the segment and stores each output
+    once in data_dir, keyed by store_key (the YTID, default audio_id), with
+    a link in every label directory. source_duration is probed when None.
+    Returns the bytes written, the kept wav, the stored outputs, the
+    features, the clamped length when the video ends early and the timings.
+    """
+    mode = options.mode
+    audio_variants = options.audio_variants
+    verbose = options.verbose
+    timings = {}
+    keep_wav = options.audio_sink == "shards"
+    kept_wav = None
+    clip_features = None
+    end_time_save = end_time
+    has_video = mode in ["video", "only_video", "both_separate"]
+    has_audio = mode in ["only_audio", "both_separate"]
+    source_path = video_path if has_video else audio_path
+    video_id = os.path.splitext(os.path.basename(source_path))[0]
+    work_dir = os.path.join(options.scratch_dir, f"worker-{os.getpid()}")
+    _worker_dirs.makedirs(work_dir)
+    video_path_tmp = os.path.join(work_dir, f'{video_id}_processed.mp4')
+    audio_dirs = [
+        variant_dir(rate, channels, primary=i == 0)
+        for i, (rate, channels) in enumerate(audio_variants)
+    ]
+    audio_paths_tmp = [
+        os.path.join(work_dir, f'{video_id}_processed_{audio_dir}.wav') for audio_dir in audio_dirs
+    ]
+
+    try:
+        if verbose:
+            print(f"[{audio_id}] Start processing video")
+        with timed(timings, "trim"):
+            # get real duration from the metadata or the container, in source video time
+            if source_duration:
+                actual_duration = source_duration
+            else:
+                actual_duration = probe_duration(source_path) + offset
+            # check video duration
+            if actual_duration <= end_time:
+                print(f"Video duration ({actual_duration}s) is shorter than requested end time ({end_time}s)")
+                end_time = actual_duration
+            if start_time >= actual_duration:
+                raise Exception(f"Start time ({start_time}s) exceeds video duration ({actual_duration}s)")
+            if end_time <= start_time:
+                raise Exception(f"End time ({end_time}s) must be greater than start time ({start_time}s)")
+            _, audio, audio_rate = trim_segment(
+                video_path if has_video else None,
+                audio_path if has_audio else None,
+                start_time - offset,
+                end_time - offset,
+                video_out=video_path_tmp if has_video else None,
+                audio_channels=max(channels for _, channels in audio_variants) if has_audio else None,
+                video_codec=options.video_codec,
+            )
+        if has_video and (not os.path.exists(video_path_tmp) or os.path.getsize(video_path_tmp) == 0):
+            raise Exception(f"Processed video file not found at {video_path_tmp}")
+        if has_audio:
+            with timed(timings, "resample"):
+                resampled = write_variants(audio, audio_rate, audio_variants, audio_paths_tmp)
+            if options.features:
+                with timed(timings, "features"):
+                    rate = audio_variants[0][0]
+                    mono = remix(np.clip(resampled[rate], -1.0, 1.0), 1)[:, 0]
+                    clip_features = log_mel(mono, rate, **options.features).astype(np.float16)
+        # Remove the downloaded sources
+        for path in [] if options.keep_sources else [video_path, audio_path]:
+            if os.path.exists(path):
+                os.remove(path)
+
+        if keep_wav and has_audio:
+            kept_wav = audio_paths_tmp[0]
+        bytes_written = _total_size([kept_wav])
+        key = store_key or str(audio_id)
+        # Output kind (directory name) -> (processed file, stored path)
+        outputs = {}
+        if has_audio:
+            for audio_dir, audio_path_tmp in zip(audio_dirs, audio_paths_tmp):
+                if audio_path_tmp != kept_wav:
+                    outputs[audio_dir] = (
+                        audio_path_tmp, stored_path(data_dir, audio_dir, key, start_time, end_time_save, "wav")
+                    )
+        if has_video:
+            outputs["video"] = (
+                video_path_tmp, stored_path(data_dir, "video", key, start_time, end_time_save, "mp4")
+            )
+        with timed(timings, "copy"):
+            for kind, (path_tmp, path_stored) in outputs.items():
+                _worker_dirs.makedirs(os.path.dirname(path_stored))
+                if os.path.exists(path_stored):
+                    # Reprocessed clip; its label links are replaced below
+                    os.remove(path_stored)
+                shutil.move(path_tmp, path_stored)
+                bytes_written += _total_size([path_stored])
+                for label in labels:
+                    video_save_path, audio_save_path = clip_paths(
+                        data_dir, audio_id, label, start_time, end_time_save, kind
+                    )
+                    save_path = video_save_path if kind == "video" else audio_save_path
+                    _worker_dirs.makedirs(os.path.dirname(save_path))
+                    used = link_output(path_stored, save_path, options.link_mode, options.link_fallback)
+                    if used == "copy":
+                        bytes_written += _total_size([save_path])
+                    if verbose:
+                        print(f"Successfully stored {kind} at: {save_path} ({used})")
+    finally:
+        # make sure that the temp files are removed
+        for path in [video_path_tmp] + audio_paths_tmp:
+            if path != kept_wav and os.path.isfile(path):
+                os.remove(path)
+    return {
+        "bytes_written": bytes_written,
+        "wav": kept_wav,
+        "outputs": {kind: path_stored for kind, (_, path_stored) in outputs.items()},
+        "features": clip_features,
+        "clamped": end_time - start_time if end_time < end_time_save else None,
+        "timings": timings,
+    }
+
+class SharedFetches:
+    """
+    Downloads shared by the cuts of one video.
+
+    Cuts are grouped by YTID and window, as group_jobs made them. The first
+    cut of a group to reach the fetch stage downloads the window; the other
+    cuts of the group wait for that download and reuse it. Every cut of the
+    group is released once it was handled, fetched or not, and the download is
+    removed when the last of its group_size cuts is released, so no cut loses
+    its source while another one is still being processed. Groups of the same
+    video may share a full download, so the files of a video are only removed
+    once none of its groups is left.
+    """
+
+    def __init__(self, mode, index=None):
+        self.mode = mode
+        self.index = index
+        self._groups = {}
+        # YTID -> [groups in use, files to remove once there are none]
+        self._videos = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(job):
+        return job["ytid"], tuple(job.get("window", (job["start"], job["end"])))
+
+    def _group(self, job):
+        # Called with self._lock held
+        group = self._groups.get(self._key(job))
+        if group is None:
+            group = {"lock": threading.Lock(), "fetched": None, "left": job.get("group_size", 1)}
+            self._groups[self._key(job)] = group
+            self._videos.setdefault(job["ytid"], [0, set()])[0] += 1
+        return group
+
+    def fetch(self, job, fetch_fn):
+        """
+        Return (fetched, fresh): the download of the job's video, made by
+        fetch_fn() unless another cut already made it, and whether it was.
+        """
+        with self._lock:
+            group = self._group(job)
+        with group["lock"]:
+            fetched = group["fetched"]
+            if fetched is not None and all(os.path.isfile(path) for path in _source_paths(fetched, self.mode)):
+                return fetched, False
+            group["fetched"] = fetch_fn()
+            return group["fetched"], True
+
+    def release(self, job):
+        with self._lock:
+            group = self._group(job)
+            group["left"] -= 1
+            if group["left"] > 0:
+                return
+            del self._groups[self._key(job)]
+            video = self._videos[job["ytid"]]
+            video[0] -= 1
+            video[1].update(_source_paths(group["fetched"], self.mode) if group["fetched"] else [])
+            if video[0] > 0:
+                return
+            del self._videos[job["ytid"]]
+        for path in video[1]:
+            if os.path.isfile(path):
+                os.remove(path)
+            if self.index is not None:
+                self.index.discard_temp(os.path.basename(path))
+
+def _split_of(splits, job):
+    # Jobs from an older coordinator carry no split; they belong to the only one
+    return splits[job["split"]] if "split" in job else next(iter(splits.values()))
+
+def _fetch_job(job, args, splits, index, controller, fetcher, metadata, policy, budget, quota,
+               shared, scratch_dir):
+    split = _split_of(splits, job)
+    # Outputs rejected by verify are still on disk until the repair overwrites them
+    if not job.get("repair") and split.index.outputs_exist(
+        job["index"], job["labels"], job["start"], job["end"], args.mode
+    ):
+        if args.verbose:
+            logger.info(f"[{job['index']}] Files already exist for {job['url']}, skipping...")
+        return None
+
+    # Runs in a pipeline thread: job is the dict that comes back with the result
+    job["timings"] = {}
+    job["data_dir"] = split.data_dir
+    # The window covers every cut of the group, so one download serves them all
+    window_start, window_end = job.get("window", (job["start"], job["end"]))
+
+    def fetch():
+        budget.wait()
+        split.store.fetching(job["ytid"], job["start"])
+        return fetch_clip(
+            job["index"],
+            job["url"],
+            scratch_dir,
+            window_start,
+            window_end,
+            args.mode,
+            args.fetch_mode == "segment",
+            args.verbose,
+            index,
+            job["timings"],
+            fetcher,
+            metadata,
+            policy,
+        )
+
+    # Hold new downloads back while the scratch space is over its quota
+    quota.wait()
+    fetched, fresh = shared.fetch(job, lambda: call_with_retry(fetch, args.max_retries, controller))
+    # Only the cut that made the download counts its bytes
+    job["bytes_fetched"] = _total_size(_source_paths(fetched, args.mode)) if fresh else 0
+    budget.consume(job["bytes_fetched"])
+    job["fetched_at"] = time.time()
+    job["fetched"] = fetched
+    entry = metadata.entry(job["ytid"])
+    job["duration"] = entry and entry["duration"]
+    split.store.fetched(job["ytid"], job["start"], job["bytes_fetched"])
+    return fetched
+
+def _picklable_error(error, stderr_lines=20):
+    """
+    This function returns error if it survives the trip back from a worker
+    process, and a RuntimeError with its message otherwise. Errors such as
+    ffmpy.FFRuntimeError cannot be unpickled and would break the process
+    pool; their message keeps the command line and the tail of stderr.
+    """
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        pass
+    message = str(error)
+    stderr = getattr(error, "stderr", None)
+    if stderr:
+        if isinstance(stderr, bytes):
+            stderr = stderr.decode("utf-8", errors="replace")
+        tail = "\n".join(stderr.strip().splitlines()[-stderr_lines:])
+        message = f"{message.splitlines()[0]}\n{tail}"
+    return RuntimeError(f"{type(error).__name__}: {message}")
+
+def _process_job(job, fetched, options):
+    queue_wait = time.time() - job["fetched_at"]
+    video_path, audio_path, offset = fetched
+    try:
+        result = process_clip(
+            job["data_dir"],
+            job["index"],
+            job["labels"],
+            video_path,
+            audio_path,
+            job["start"],
+            job["end"],
+            options,
+            offset,
+            source_duration=job.get("duration"),
+            store_key=job["ytid"],
+        )
+    except Exception as e:
+        # Runs in a worker process; the error has to be sent back to the parent
+        raise _picklable_error(e) from None
+    result["timings"]["queue_wait"] = queue_wait
+    return result
+
+def _index_outputs(index, job, mode, sink):
+    for label in job["labels"]:
+        if mode in ["video", "only_video", "both_separate"]:
+            index.add_output(job["index"], job["start"], job["end"], label, "video")
+        if mode in ["only_audio", "both_separate"] and sink == "files":
+            index.add_output(job["index"], job["start"], job["end"], label, "audio")
+
+def format_policy(args):
+    return FormatPolicy(args.max_height, args.max_fps, args.video_codecs, args.max_abr)
+
+def plan_download(data, args, fetcher=None, sample=200, seed=0):
+    """
+    Estimate the bytes and time needed to download the selected clips with the
+    current format policy, without downloading any media.
+
+    The metadata of up to sample randomly chosen clips is looked up (and
+    cached for the download), their selected formats are resolved and the
+    bytes of the fetched range are extrapolated to the whole selection.
+    Returns a dict with the estimates.
+    """
+    fetcher = fetcher or YoutubeDLFetcher(proxy=args.proxy, verbose=False)
+    policy = format_policy(args)
+    requests = policy.requests(args.mode)
+    tmp_dir = state_dir(args)
+    os.makedirs(tmp_dir, exist_ok=True)
+    metadata = MetadataCache(os.path.join(tmp_dir, "metadata.sqlite"), ttl=args.metadata_ttl * 3600)
+    n_clips = len(data.index)
+    rows = np.random.default_rng(seed).permutation(n_clips)[:sample]
+
+    def estimate(job):
+        info = metadata.lookup(fetcher, job["ytid"], job["url"])
+        duration = info.get("duration")
+        if duration and job["start"] >= duration:
+            raise Exception(f"Start time ({job['start']}s) exceeds video duration ({duration}s)")
+        end = min(job["end"], duration) if duration else job["end"]
+        if args.fetch_mode == "segment":
+            seconds = end + SEGMENT_MARGIN - max(0.0, job["start"] - SEGMENT_MARGIN)
+        else:
+            seconds = duration or end
+        total = 0
+        for fmt, _, _ in requests:
+            for selected in fetcher.select_formats(info, fmt):
+                total += format_bytes(selected, seconds, duration) or 0
+        return total
+
+    sizes = []
+    jobs = list(manifest_jobs(data, rows))
+    with ThreadPoolExecutor(max_workers=args.fetch_workers) as pool:
+        futures = [pool.submit(estimate, job) for job in jobs]
+        for future in tqdm(futures, desc="Planning"):
+            try:
+                sizes.append(future.result())
+            except Exception as e:
+                logger.debug(f"Could not plan a clip: {e}")
+    metadata.close()
+
+    available = len(sizes) / len(jobs) if jobs else 0.0
+    mean_bytes = float(np.mean(sizes)) if sizes else 0.0
+    total_bytes = mean_bytes * available * n_clips
+    plan = {
+        "clips": n_clips,
+        "sampled": len(jobs),
+        "unavailable_fraction": 1.0 - available if jobs else 0.0,
+        "mean_clip_mb": mean_bytes / 1e6,
+        "total_gb": total_bytes / 1e9,
+        "formats": [fmt for fmt, _, _ in requests],
+    }
+    if args.max_rate:
+        plan["hours_at_max_rate"] = total_bytes / (args.max_rate * 1e6) / 3600
+    if args.max_gb:
+        plan["clips_within_budget"] = min(n_clips, int(args.max_gb * 1e9 / mean_bytes)) if mean_bytes else n_clips
+    return plan
+
+def _pending_rows(split):
+    """
+    Return the positions of the rows of a split that are not done or unavailable.
+    """
+    ytids, starts = split.store.key_arrays(DONE, UNAVAILABLE)
+    data = split.data
+    completed = isin_keys(np.asarray(data.ytids, dtype=str), np.asarray(data.start), ytids, starts)
+    return np.flatnonzero(~completed)
+
+def serve_download_queue(splits, args):
+    """
+    Coordinator mode: load the manifests into a lease queue and serve them to
+    workers started with --coordinator.
+    """
+    tmp_dir = state_dir(args)
+    os.makedirs(tmp_dir, exist_ok=True)
+    setup_logging(tmp_dir)
+    queue_db = args.queue_db or os.path.join(tmp_dir, "queue.sqlite")
+    queue = LeaseQueue(queue_db, lease_seconds=args.lease_seconds)
+    added = 0
+    for split in splits:
+        rows = range(len(split.data.index))
+        if args.class_quota:
+            # Workers do not report back to a scheduler, so queue the clips the
+            # quotas need if all of them succeed
+            store = ProgressStore(split.store_path)
+            rows = build_quota(
+                split.data, args.class_quota, args.classes, store.keys(DONE), store.keys(DONE, UNAVAILABLE)
+            ).plan()
+            store.close()
+        added += queue.load(dict(job, split=split.name) for job in manifest_jobs(split.data, rows))
+    logger.info(f"Added {added} clips to the queue at {queue_db}: {queue.counts()}")
+    host, port = args.serve_queue.rsplit(":", 1)
+    server = serve_queue(queue, host, int(port))
+    logger.info(f"Serving download queue on {args.serve_queue}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        queue.close()
+
+def parallel_download(splits, args, fetcher=None):
+    """
+    Download and process the clips of splits, a list of Split (see
+    utils.splits). Their pending rows are merged and grouped by YTID, so a
+    video shared by several cuts or manifests is fetched once, and each cut
+    is written to the directory of its own split.
+    """
+    faulty_files = []
+    tmp_dir = state_dir(args)
+    os.makedirs(tmp_dir, exist_ok=True)
+    setup_logging(tmp_dir)
+    splits = {split.name: split for split in splits}
+    for split in splits.values():
+        os.makedirs(split.state_dir, exist_ok=True)
+        split.store = ProgressStore(split.store_path)
+    quota_scheduler = None
+
+    logger.info("Starting parallel download process")
+    if args.coordinator or args.repair:
+        # Worker mode: the clips come from the coordinator's lease queue, or
+        # from the repair queue filled by verify
+        if args.coordinator:
+            queue = RemoteLeaseQueue(args.coordinator)
+        else:
+            queue = LeaseQueue(os.path.join(tmp_dir, "repair.sqlite"), lease_seconds=args.lease_seconds)
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        heartbeat = LeaseHeartbeat(queue, worker_id, args.lease_seconds / 3)
+        jobs = leased_jobs(queue, worker_id, heartbeat, args.queue_size)
+        total = None
+        logger.info(f"Worker {worker_id} taking clips from {args.coordinator or 'the repair queue'}")
+    elif args.class_quota:
+        # Quota mode: a scheduler picks the clips that fill the most classes
+        # still under their quota, as the outcomes come in
+        queue = heartbeat = None
+        (split,) = splits.values()
+        quota_scheduler = build_quota(
+            split.data, args.class_quota, args.classes,
+            split.store.keys(DONE), split.store.keys(DONE, UNAVAILABLE),
+        )
+        logger.info(f"Scheduling downloads for class quotas: {quota_scheduler.summary()}")
+        jobs = quota_scheduler.jobs()
+        total = None
+    else:
+        queue = heartbeat = None
+        pending = {}
+        for name, split in splits.items():
+            pending[name] = _pending_rows(split)
+            logger.info(
+                f"{name}: {len(split.data.index)} clips, {len(split.data.index) - len(pending[name])} "
+                f"completed or unavailable, {len(pending[name])} remaining"
+            )
+        jobs = group_jobs(splits.values(), pending)
+        total = sum(len(rows) for rows in pending.values())
+
+    with ExitStack() as stack:
+        # Private scratch space of this run, swept by a later run if this one crashes
+        scratch = stack.enter_context(ScratchDir(args.scratch_dir or os.path.join(tmp_dir, "scratch")))
+        trim_scratch = stack.enter_context(ScratchDir(args.trim_dir)) if args.trim_dir else None
+        process_dir = (trim_scratch or scratch).path
+        if scratch.swept:
+            logger.info(f"Removed {scratch.swept} scratch directories left by crashed runs")
+        # The quota covers the whole scratch roots, so concurrent runs share it
+        quota = TempQuota(
+            [scratch.root, (trim_scratch or scratch).root],
+            args.temp_quota_gb * 1e9 if args.temp_quota_gb else None,
+        )
+        stack.callback(quota.close)
+        index = FileIndex.scan(None, scratch.path)
+        shared = SharedFetches(args.mode, index)
+        for split in splits.values():
+            split.index = FileIndex.scan(split.data_dir)
+            os.makedirs(split.data_dir, exist_ok=True)
+            split.label_index = LabelIndex(os.path.join(split.data_dir, "index.sqlite"))
+            print(f"Found {len(split.index)} files in {split.data_dir}")
+        # Fetch concurrency backs off on throttling and recovers on success
+        controller = AIMDController(args.fetch_workers)
+        fetcher = fetcher or YoutubeDLFetcher(proxy=args.proxy, verbose=args.verbose)
+        metadata = MetadataCache(os.path.join(tmp_dir, "metadata.sqlite"), ttl=args.metadata_ttl * 3600)
+
+        def prefetch_metadata(job):
+            # Warm the metadata cache for clips that still need downloading
+            split = _split_of(splits, job)
+            if not job.get("repair") and split.index.outputs_exist(
+                job["index"], job["labels"], job["start"], job["end"], args.mode
+            ):
+                return
+            window_start = job.get("window", (job["start"],))[0]
+            if _find_fetched(job["ytid"], window_start, args.mode, scratch.path, index) is not None:
+                return
+            call_with_retry(
+                partial(metadata.lookup, fetcher, job["ytid"], job["url"]), 0, controller
+            )
+
+        policy = format_policy(args)
+        budget = BandwidthBudget(
+            args.max_rate * 1e6 if args.max_rate else None,
+            args.max_gb * 1e9 if args.max_gb else None,
+        )
+        jobs = budget.limit(prefetch(jobs, prefetch_metadata, args.fetch_workers, args.prefetch))
+        metrics = Metrics(
+            args.trace_file or os.path.join(tmp_dir, f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+        )
+        metrics_server = None
+        if args.metrics_port:
+            metrics_server = metrics.serve(port=args.metrics_port)
+            logger.info(f"Serving metrics on http://127.0.0.1:{args.metrics_port}/metrics")
+
+        with_features = args.features and args.mode in ["only_audio", "both_separate"]
+        options = ProcessOptions(
+            args.mode,
+            process_dir,
+            audio_variants=args.sample_rate,
+            video_codec=args.video_codec,
+            audio_sink=args.sink,
+            # SharedFetches removes the sources after the last cut of the video
+            keep_sources=True,
+            link_mode=args.link_mode,
+            link_fallback=args.link_fallback,
+            features={"n_fft": args.n_fft, "hop": args.hop_length, "n_mels": args.n_mels} if with_features else None,
+            verbose=args.verbose,
+        )
+        results = run_pipeline(
+            jobs,
+            partial(
+                _fetch_job,
+                args=args,
+                splits=splits,
+                index=index,
+                controller=controller,
+                fetcher=fetcher,
+                metadata=metadata,
+                policy=policy,
+                budget=budget,
+                quota=quota,
+                shared=shared,
+                scratch_dir=scratch.path,
+            ),
+            partial(_process_job, options=options),
+            fetch_workers=args.fetch_workers,
+            process_workers=args.process_workers,
+            queue_size=args.queue_size,
+        )
+
+        if heartbeat is not None:
+            stack.enter_context(heartbeat)
+        if with_features:
+            for split in splits.values():
+                split.feature_writer = stack.enter_context(FeatureWriter(
+                    split.data_dir, split.data, args.sample_rate[0][0], args.n_fft, args.hop_length, args.n_mels,
+                ))
+                logger.info(f"Writing log-mel features to {split.feature_writer.path}")
+        if args.sink == "shards" and args.mode in ["only_audio", "both_separate"]:
+            for split in splits.values():
+                split.shard_writer = stack.enter_context(ShardWriter(
+                    os.path.join(split.data_dir, "shards"),
+                    args.sample_rate[0][0],
+                    split.data.label_bits.shape[1],
+                    channels=args.sample_rate[0][1],
+                ))
+        for job, result, error in tqdm(results, total=total, desc="Downloading"):
+            split = _split_of(splits, job)
+            bytes_written = None
+            timings = dict(job.get("timings", {}))
+            if error is None and result is not None:
+                bytes_written = result["bytes_written"]
+                timings.update(result["timings"])
+                if result["wav"] is not None:
+                    with timed(timings, "pack"):
+                        samples, _ = sf.read(result["wav"], dtype="int16")
+                        split.shard_writer.add(
+                            job["ytid"], job["start"], job["end"],
+                            split.data.class_mask(job["labels"]), samples,
+                        )
+                        os.remove(result["wav"])
+            # The download is removed once every cut of the video was handled
+            shared.release(job)
+            category = None if error is None else classify_error(error)
+            metrics.record(
+                job, error is None, timings, job.get("bytes_fetched", 0), bytes_written or 0, category
+            )
+            if error is None:
+                split.store.done(
+                    job["ytid"], job["start"], bytes_written, result and result["clamped"]
+                )
+                if queue is None:
+                    split.data.download_status[job["row"]] = True
+                _index_outputs(split.index, job, args.mode, args.sink)
+                if result is not None and result["outputs"]:
+                    split.label_index.add(
+                        job["ytid"], job["start"], job["end"], job["labels"], result["outputs"]
+                    )
+                if result is not None and result["features"] is not None and split.feature_writer is not None:
+                    split.feature_writer.add(job["row"], result["features"])
+            else:
+                logger.error(f"[{job['index']}] {category} failure: {error}")
+                split.store.failed(job["ytid"], job["start"], error, permanent=category == PERMANENT)
+                faulty_files.append(
+                    f"{job['index']} {job['start']} {job['end']} {job['labels']} {job['url']} {category}"
+                )
+                faulty_files.append(error)
+            if queue is not None:
+                queue.complete(
+                    worker_id, job["ytid"], job["start"],
+                    result=bytes_written, error=None if error is None else str(error),
+                )
+                heartbeat.release(job["ytid"], job["start"])
+            if quota_scheduler is not None:
+                quota_scheduler.finish(job, error is None)
+    if isinstance(queue, LeaseQueue):
+        queue.close()
+    for split in splits.values():
+        split.store.close()
+        split.label_index.close()
+    metrics.close()
+    metadata.close()
+    logger.info(f"Metadata: {metadata.requests} requests, {metadata.hits} cache hits")
+    if quota_scheduler is not None:
+        logger.info(f"Clips per class (done, quota): {quota_scheduler.summary()}")
+    if budget.exhausted:
+        logger.info(f"Stopped after fetching {budget.spent / 1e9:.2f} GB, the --max_gb budget")
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    logger.info(f"Finished: {dict(metrics.clips)}, seconds per stage: {dict(metrics.stage_seconds)}")
+
+    if faulty_files:
+        # Next to the log file in the state directory, not in the working directory
+        error_filename = os.path.join(tmp_dir, f"download_errors_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
+        np.savetxt(error_filename, faulty_files, fmt="%s")
+        logger.info(f"Saved error log to {error_filename}")
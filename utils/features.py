@@ -0,0 +1,157 @@
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# Directory of the feature arrays inside a data directory
+FEATURES_DIR = "features"
+# Added to the mel energies before the log, about -140 dB
+LOG_OFFSET = 1e-7
+
+
+def index_dtype():
+    """
+    This function returns the record type of a feature index: the manifest
+    row of the clip, its YTID and start, and the number of valid frames (0
+    while the clip has no features yet).
+    """
+    return np.dtype([
+        ("row", "<i8"),
+        ("ytid", "S11"),
+        ("start", "<f8"),
+        ("frames", "<i4"),
+    ])
+
+
+def mel_filterbank(rate, n_fft, n_mels, fmin=0.0, fmax=None):
+    """
+    This function returns an (n_fft // 2 + 1, n_mels) matrix of triangular
+    filters spaced evenly on the HTK mel scale between fmin and fmax.
+    """
+    fmax = fmax or rate / 2
+
+    def to_mel(hz):
+        return 2595.0 * np.log10(1.0 + np.asarray(hz) / 700.0)
+
+    def to_hz(mel):
+        return 700.0 * (10.0 ** (np.asarray(mel) / 2595.0) - 1.0)
+
+    edges = to_hz(np.linspace(to_mel(fmin), to_mel(fmax), n_mels + 2))
+    bins = np.linspace(0.0, rate / 2, n_fft // 2 + 1)
+    lower = (bins[:, None] - edges[None, :-2]) / (edges[1:-1] - edges[:-2])[None, :]
+    upper = (edges[None, 2:] - bins[:, None]) / (edges[2:] - edges[1:-1])[None, :]
+    return np.maximum(0.0, np.minimum(lower, upper)).astype(np.float32)
+
+
+def n_frames(n_samples, n_fft, hop):
+    return 0 if n_samples < n_fft else 1 + (n_samples - n_fft) // hop
+
+
+def log_mel(samples, rate, n_fft=512, hop=160, n_mels=64):
+    """
+    This function computes log-mel spectrograms of float samples, one clip
+    as (n_samples,) or a batch of equally long clips as (n_clips, n_samples),
+    with a Hann window and no padding. All frames of the batch go through one
+    rfft and one matrix product. Returns float32 (..., frames, n_mels).
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if samples.shape[-1] < n_fft:
+        return np.zeros(samples.shape[:-1] + (0, n_mels), dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, n_fft, axis=-1)[..., ::hop, :]
+    spectrum = np.fft.rfft(frames * np.hanning(n_fft).astype(np.float32), axis=-1)
+    power = spectrum.real ** 2 + spectrum.imag ** 2
+    mel = power.astype(np.float32) @ mel_filterbank(rate, n_fft, n_mels)
+    return np.log(mel + LOG_OFFSET)
+
+
+class FeatureWriter:
+    """
+    Log-mel features of the clips of a manifest in preallocated memory-mapped
+    arrays.
+
+    features.npy is (clips, max frames, n_mels) float16 and index.npy holds
+    one index_dtype record per clip, both aligned with the rows of the Data
+    the writer was made for: clip i of data is at position i. The arrays live
+    in data_dir/features/logmel_<hash>, keyed by the manifest rows and the
+    feature parameters, so a run with the same selection and parameters fills
+    in the same arrays and any other run gets its own. add() buffers features
+    and writes them batch_size clips at a time.
+    """
+
+    def __init__(self, data_dir, data, rate, n_fft=512, hop=160, n_mels=64, batch_size=64):
+        self.rate = rate
+        self.n_fft = n_fft
+        self.hop = hop
+        self.n_mels = n_mels
+        self.batch_size = batch_size
+        self._pending = []
+
+        max_seconds = float(np.max(np.asarray(data.end) - np.asarray(data.start))) if len(data.row) else 0.0
+        self.max_frames = n_frames(int(math.ceil(max_seconds * rate)), n_fft, hop)
+        meta = {
+            "csv_path": os.path.abspath(data.csv_path),
+            "clips": len(data.row),
+            "sample_rate": rate,
+            "n_fft": n_fft,
+            "hop": hop,
+            "n_mels": n_mels,
+            "max_frames": self.max_frames,
+            "dtype": "float16",
+        }
+        digest = hashlib.blake2b(np.ascontiguousarray(data.row).tobytes(), digest_size=8)
+        digest.update(json.dumps(meta, sort_keys=True).encode("utf-8"))
+        self.path = os.path.join(data_dir, FEATURES_DIR, f"logmel_{digest.hexdigest()}")
+        features_path = os.path.join(self.path, "features.npy")
+        index_path = os.path.join(self.path, "index.npy")
+        if os.path.exists(index_path):
+            self.features = open_memmap(features_path, mode="r+")
+            self.index = open_memmap(index_path, mode="r+")
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=1)
+        self.features = open_memmap(
+            features_path, mode="w+", dtype=np.float16, shape=(len(data.row), self.max_frames, n_mels)
+        )
+        index = np.zeros(len(data.row), dtype=index_dtype())
+        index["row"] = data.row
+        index["ytid"] = np.char.encode(np.asarray(data.ytids, dtype=str), "ascii")
+        index["start"] = data.start
+        np.save(index_path, index)
+        self.index = open_memmap(index_path, mode="r+")
+
+    def add(self, position, features):
+        self._pending.append((position, features))
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        self._pending.sort(key=lambda item: item[0])
+        frames = {}
+        for position, features in self._pending:
+            frames[position] = min(len(features), self.max_frames)
+            self.features[position, :frames[position]] = features[:frames[position]]
+            self.features[position, frames[position]:] = 0
+        self._pending = []
+        # A clip only counts once its features are on disk
+        self.features.flush()
+        for position, count in frames.items():
+            self.index["frames"][position] = count
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        self.features = self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
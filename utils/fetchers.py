@@ -0,0 +1,211 @@
+import copy
+import os
+import random
+import shutil
+import subprocess as sp
+import threading
+import time
+
+
+
+class Fetcher:
+    """
+    Interface between fetch_clip and the site the media comes from.
+
+    extract_info(url) returns the info dict of a video and raises on failure.
+    download(info, fmt, path, extract_audio, section) writes the stream
+    picked by the yt-dlp format selector fmt to path, limited to the
+    (start, end) section in seconds when one is given, and raises on failure.
+    select_formats(info, fmt) returns the format dicts fmt resolves to without
+    downloading anything, for estimating transfer sizes.
+    """
+
+    def extract_info(self, url):
+        raise NotImplementedError
+
+    def select_formats(self, info, fmt):
+        raise NotImplementedError
+
+    def download(self, info, fmt, path, extract_audio=False, section=None):
+        raise NotImplementedError
+
+
+class YoutubeDLFetcher(Fetcher):
+    """
+    Fetches from YouTube with yt-dlp. Without a proxy yt-dlp uses the
+    HTTP(S)_PROXY environment variables.
+    """
+
+    def __init__(self, proxy=None, verbose=True):
+        self.proxy = proxy
+        self.verbose = verbose
+
+    def _opts(self, fmt=None, outtmpl=None, extract_audio=False):
+        opts = {
+            'quiet': not self.verbose,
+            'no_warnings': not self.verbose,
+            'proxy': self.proxy,
+            'outtmpl': outtmpl,
+            'skip_unavailable_fragments': True,
+            # Let yt-dlp errors propagate, their messages are used to classify failures
+            'ignoreerrors': False,
+            'age_limit': None,
+            'format': fmt,
+            # 'cookiefile': './need_cookies.txt',
+        }
+        if extract_audio:
+            opts['postprocessors'] = [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'm4a',
+            }]
+        return opts
+
+    def extract_info(self, url):
+        from yt_dlp import YoutubeDL
+
+        with YoutubeDL(self._opts()) as ydl:
+            info = ydl.extract_info(url, download=False, process=False)
+        if info is None:
+            raise Exception(f"Failed to download file for {url}")
+        return info
+
+    def select_formats(self, info, fmt):
+        from yt_dlp import YoutubeDL
+
+        opts = self._opts(fmt)
+        opts['simulate'] = True
+        with YoutubeDL(opts) as ydl:
+            result = ydl.process_ie_result(copy.deepcopy(info), download=False)
+        return result.get('requested_formats') or [result]
+
+    def download(self, info, fmt, path, extract_audio=False, section=None):
+        """
+        Run format selection and download on an already extracted info dict,
+        so the page and format list are only requested once per clip.
+        """
+        from yt_dlp import YoutubeDL
+        from yt_dlp.utils import download_range_func
+
+        opts = self._opts(fmt, os.path.splitext(path)[0] + '.%(ext)s', extract_audio)
+        if section is not None:
+            opts['download_ranges'] = download_range_func(None, [section])
+        with YoutubeDL(opts) as ydl:
+            result = ydl.process_ie_result(copy.deepcopy(info), download=True)
+        if result is None:
+            raise Exception(f"Failed to download file to {path}")
+        if not os.path.exists(path):
+            raise Exception(f"Downloaded file not found at {path}")
+        return path
+
+
+class LocalFetcher(Fetcher):
+    """
+    Offline stand-in for YouTube that serves synthetic media made with
+    ffmpeg lavfi (a test pattern and a sine tone), for benchmarks and tests.
+
+    Every video is video_length seconds long. Each request waits latency
+    seconds plus the file size divided by bandwidth (bytes/s, None for
+    unlimited), and fails with probability error_rate with one of the error
+    messages yt-dlp gives for unavailable, throttled or flaky videos. Sections
+    are cut with a stream copy, like a range fetch.
+    """
+
+    ERRORS = [
+        "ERROR: [youtube] Private video. Sign in if you've been granted access to this video",
+        "ERROR: unable to download video data: HTTP Error 429: Too Many Requests",
+        "ERROR: unable to download video data: HTTP Error 503: Service Unavailable",
+        "ERROR: Read timed out.",
+    ]
+
+    def __init__(self, media_dir, latency=0.0, bandwidth=None, error_rate=0.0,
+                 video_length=60.0, seed=0):
+        self.media_dir = media_dir
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.video_length = video_length
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sources = None
+        os.makedirs(media_dir, exist_ok=True)
+
+    def _ensure_sources(self):
+        # All videos share the same synthetic source, it is only made once
+        with self._lock:
+            if self._sources is not None:
+                return self._sources
+            base = os.path.join(self.media_dir, f"source_{self.video_length:g}s")
+            sources = {
+                "best": f"{base}.mp4",
+                "video": f"{base}_video.mp4",
+                "audio": f"{base}_audio.m4a",
+            }
+            if not all(os.path.exists(path) for path in sources.values()):
+                import ffmpy
+
+                duration = self.video_length
+                ffmpy.FFmpeg(
+                    inputs={
+                        f"testsrc2=size=640x360:rate=25:duration={duration}": "-f lavfi",
+                        f"sine=frequency=440:sample_rate=44100:duration={duration}": "-f lavfi",
+                    },
+                    outputs={
+                        sources["best"]: "-c:v libx264 -preset ultrafast -g 50 -c:a aac -shortest -y",
+                    },
+                    global_options={"-loglevel error"},
+                ).run(stderr=sp.PIPE)
+                ffmpy.FFmpeg(
+                    inputs={sources["best"]: None},
+                    outputs={
+                        sources["video"]: "-map 0:v -c copy -y",
+                        sources["audio"]: "-map 0:a -c copy -y",
+                    },
+                    global_options={"-loglevel error"},
+                ).run(stderr=sp.PIPE)
+            self._sources = sources
+            return sources
+
+    def _maybe_fail(self):
+        time.sleep(self.latency)
+        with self._lock:
+            failed = self._rng.random() < self.error_rate
+            error = self._rng.choice(self.ERRORS)
+        if failed:
+            raise Exception(error)
+
+    def extract_info(self, url):
+        video_id = url.split("=")[-1]
+        self._maybe_fail()
+        return {"id": video_id, "duration": self.video_length, "webpage_url": url}
+
+    def _source(self, fmt, extract_audio=False):
+        sources = self._ensure_sources()
+        if extract_audio or fmt.startswith("bestaudio"):
+            return sources["audio"]
+        if fmt.startswith("bestvideo"):
+            return sources["video"]
+        return sources["best"]
+
+    def select_formats(self, info, fmt):
+        size = os.path.getsize(self._source(fmt))
+        return [{"format_id": fmt, "filesize": size, "tbr": size * 8 / 1000 / self.video_length}]
+
+    def download(self, info, fmt, path, extract_audio=False, section=None):
+        self._maybe_fail()
+        source = self._source(fmt, extract_audio)
+        if section is None:
+            shutil.copy(source, path)
+        else:
+            import ffmpy
+
+            start, end = section
+            ffmpy.FFmpeg(
+                inputs={source: f"-ss {start}"},
+                outputs={path: f"-t {end - start} -c copy -y"},
+                global_options={"-loglevel error"},
+            ).run(stderr=sp.PIPE)
+        if self.bandwidth:
+            time.sleep(os.path.getsize(path) / self.bandwidth)
+        return path
+
+
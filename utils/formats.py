@@ -0,0 +1,72 @@
+VIDEO_MODES = ["video", "only_video", "both_separate"]
+AUDIO_MODES = ["only_audio", "both_separate"]
+
+
+class FormatPolicy:
+    """
+    Builds the yt-dlp format selectors used for each mode.
+
+    max_height and max_fps cap the video stream, video_codecs lists codec
+    prefixes in order of preference (e.g. "avc1", "vp09") and max_abr caps the
+    audio bitrate in kbps. Each selector falls back to dropping the codec
+    preference and then to the uncapped stream, so a video without a matching
+    format is still downloaded. The default policy selects the same formats as
+    before any caps existed.
+    """
+
+    def __init__(self, max_height=None, max_fps=None, video_codecs=(), max_abr=None):
+        self.max_height = max_height
+        self.max_fps = max_fps
+        self.video_codecs = list(video_codecs or [])
+        self.max_abr = max_abr
+
+    def _caps(self):
+        caps = ""
+        if self.max_height:
+            caps += f"[height<=?{self.max_height}]"
+        if self.max_fps:
+            caps += f"[fps<=?{self.max_fps}]"
+        return caps
+
+    def video(self, base="bestvideo"):
+        base = f"{base}[ext=mp4]"
+        caps = self._caps()
+        choices = [f"{base}[vcodec^={codec}]{caps}" for codec in self.video_codecs]
+        if caps:
+            choices.append(f"{base}{caps}")
+        choices.append(base)
+        return "/".join(choices)
+
+    def audio(self):
+        choices = []
+        if self.max_abr:
+            choices.append(f"bestaudio[abr<=?{self.max_abr}]")
+        choices.append("bestaudio/best")
+        return "/".join(choices)
+
+    def requests(self, mode):
+        """
+        Return the (format selector, extract audio, extension) downloads of a mode.
+        """
+        requests = []
+        if mode in ["video"]:
+            requests.append((self.video("best"), False, "mp4"))
+        if mode in ["only_video", "both_separate"]:
+            requests.append((self.video(), False, "mp4"))
+        if mode in AUDIO_MODES:
+            requests.append((self.audio(), True, "m4a"))
+        return requests
+
+
+def format_bytes(fmt, seconds, duration=None):
+    """
+    Estimate the bytes of seconds of a resolved yt-dlp format dict, from its
+    total bitrate, or from its file size spread over the video duration.
+    Returns None when the format has neither.
+    """
+    if fmt.get("tbr"):
+        return fmt["tbr"] * 1000 / 8 * seconds
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size and duration:
+        return size * min(1.0, seconds / duration)
+    return size
@@ -0,0 +1,91 @@
+import os
+import re
+import threading
+
+_OUTPUT_NAME = re.compile(r"^(video|audio)_(.+)_start_(-?\d+)_end_(-?\d+)\.(mp4|wav)$")
+
+
+class FileIndex:
+    """
+    In-memory index of the output and temp trees.
+
+    The trees are scanned once at startup. Outputs are keyed by
+    (clip id, start, end, label, kind) with kind "video" or "audio", and temp
+    files by name, so the per-clip checks are set lookups instead of stat calls
+    or directory listings. Callers update the index as files are written or
+    removed; it is safe to share between threads.
+    """
+
+    def __init__(self):
+        self._outputs = set()
+        self._temp = set()
+        self._dirs = set()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def scan(cls, data_dir, tmp_dir=None):
+        index = cls()
+        for kind in ["video", "audio"] if data_dir is not None else []:
+            kind_dir = os.path.join(data_dir, kind)
+            if not os.path.isdir(kind_dir):
+                continue
+            for label_entry in os.scandir(kind_dir):
+                if not label_entry.is_dir():
+                    continue
+                index._dirs.add(label_entry.path)
+                for entry in os.scandir(label_entry.path):
+                    match = _OUTPUT_NAME.match(entry.name)
+                    if match and match.group(1) == kind:
+                        index._outputs.add(
+                            (match.group(2), int(match.group(3)), int(match.group(4)),
+                             label_entry.name, kind)
+                        )
+        if tmp_dir is not None and os.path.isdir(tmp_dir):
+            index._temp = {entry.name for entry in os.scandir(tmp_dir) if entry.is_file()}
+        return index
+
+    def __len__(self):
+        return len(self._outputs)
+
+    def add_output(self, clip_id, start_time, end_time, label, kind):
+        with self._lock:
+            self._outputs.add((str(clip_id), int(start_time), int(end_time), label, kind))
+
+    def has_output(self, clip_id, start_time, end_time, label, kind):
+        return (str(clip_id), int(start_time), int(end_time), label, kind) in self._outputs
+
+    def outputs_exist(self, clip_id, labels, start_time, end_time, mode):
+        """
+        This function checks whether every output of a clip is in the index.
+        """
+        kinds = []
+        if mode in ["video", "only_video", "both_separate"]:
+            kinds.append("video")
+        if mode in ["only_audio", "both_separate"]:
+            kinds.append("audio")
+        return all(
+            self.has_output(clip_id, start_time, end_time, label, kind)
+            for label in labels
+            for kind in kinds
+        )
+
+    def add_temp(self, name):
+        with self._lock:
+            self._temp.add(name)
+
+    def discard_temp(self, name):
+        with self._lock:
+            self._temp.discard(name)
+
+    def has_temp(self, name):
+        return name in self._temp
+
+    def makedirs(self, path):
+        """
+        Create a directory unless the index has already seen it.
+        """
+        if path in self._dirs:
+            return
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self._dirs.add(path)
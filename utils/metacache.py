@@ -0,0 +1,120 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+from utils.retry import PERMANENT, classify_error
+
+# YouTube stream URLs are signed for about six hours, so a cached format list
+# is only reused for downloads within this many seconds.
+FORMAT_URL_TTL = 5 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    ytid TEXT PRIMARY KEY,
+    available INTEGER NOT NULL,
+    duration REAL,
+    reason TEXT,
+    info BLOB,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class MetadataCache:
+    """
+    Persistent cache of yt-dlp info dicts keyed by YTID, kept in SQLite in WAL
+    mode next to the progress store.
+
+    Availability and duration are trusted for ttl seconds. The info dict
+    itself, with the format list, is stored zlib-compressed and reused for
+    downloads for FORMAT_URL_TTL seconds, after which it is requested again.
+    Videos that failed with a permanent error are cached as unavailable.
+    """
+
+    def __init__(self, path, ttl=30 * 24 * 3600, timeout=30.0):
+        self.path = str(path)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._conn = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self.requests = 0
+        self.hits = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _row(self, ytid):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT available, duration, reason, info, updated FROM videos WHERE ytid = ?",
+                (ytid,),
+            ).fetchone()
+
+    def _store(self, ytid, available, duration=None, reason=None, info=None):
+        blob = None
+        if info is not None:
+            blob = zlib.compress(json.dumps(info, default=str).encode("utf-8"))
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?, ?, ?)",
+                    (ytid, int(available), duration, reason, blob, time.time()),
+                )
+
+    def entry(self, ytid):
+        """
+        Return {"available", "duration", "reason"} of a video, or None if it is
+        not cached or older than the TTL.
+        """
+        row = self._row(ytid)
+        if row is None or time.time() - row[4] > self.ttl:
+            return None
+        available, duration, reason, _, _ = row
+        return {"available": bool(available), "duration": duration, "reason": reason}
+
+    def lookup(self, fetcher, ytid, url):
+        """
+        Return the info dict of a video, from the cache when it is fresh and
+        with fetcher.extract_info otherwise. Raises with the cached reason for
+        videos known to be unavailable. Concurrent lookups of the same YTID
+        share a single request.
+        """
+        with self._lock:
+            inflight = self._inflight.setdefault(ytid, [threading.Lock(), 0])
+            inflight[1] += 1
+        try:
+            with inflight[0]:
+                return self._lookup(fetcher, ytid, url)
+        finally:
+            with self._lock:
+                inflight[1] -= 1
+                if inflight[1] == 0:
+                    del self._inflight[ytid]
+
+    def _lookup(self, fetcher, ytid, url):
+        row = self._row(ytid)
+        if row is not None:
+            available, _, reason, blob, updated = row
+            age = time.time() - updated
+            if not available and age <= self.ttl:
+                self.hits += 1
+                raise Exception(reason)
+            if blob is not None and age <= min(self.ttl, FORMAT_URL_TTL):
+                self.hits += 1
+                return json.loads(zlib.decompress(blob))
+        self.requests += 1
+        try:
+            info = fetcher.extract_info(url)
+        except Exception as e:
+            if classify_error(e) == PERMANENT:
+                self._store(ytid, False, reason=str(e))
+            raise
+        self._store(ytid, True, info.get("duration"), info=info)
+        return info
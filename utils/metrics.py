@@ -0,0 +1,157 @@
+import collections
+import json
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@contextmanager
+def timed(timings, stage):
+    """
+    Add the wall time spent in the block to timings[stage], in seconds.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    Collects one trace per finished clip.
+
+    Each trace is appended to trace_path as a JSON line with the per-stage
+    timings and byte counts. Totals per stage and per class, and rolling
+    clips/min, MB/s and failure rate over the last window seconds, are kept
+    for the Prometheus endpoint started with serve().
+    """
+
+    def __init__(self, trace_path=None, window=60.0):
+        self.window = window
+        self._trace = open(trace_path, "a", encoding="utf-8") if trace_path else None
+        self._lock = threading.Lock()
+        self._recent = collections.deque()
+        self.stage_seconds = collections.Counter()
+        self.stage_count = collections.Counter()
+        self.clips = collections.Counter()
+        self.class_clips = collections.Counter()
+        self.bytes_fetched = 0
+        self.bytes_written = 0
+
+    def record(self, job, ok, timings, bytes_fetched=0, bytes_written=0, category=None):
+        now = time.time()
+        status = "done" if ok else "failed"
+        trace = {
+            "time": now,
+            "ytid": job["ytid"],
+            "start": job["start"],
+            "status": status,
+            "category": category,
+            "labels": job["labels"],
+            "timings": timings,
+            "bytes_fetched": bytes_fetched,
+            "bytes_written": bytes_written,
+        }
+        with self._lock:
+            if self._trace is not None:
+                self._trace.write(json.dumps(trace) + "\n")
+                self._trace.flush()
+            for stage, seconds in timings.items():
+                self.stage_seconds[stage] += seconds
+                self.stage_count[stage] += 1
+            self.clips[status] += 1
+            for label in job["labels"]:
+                self.class_clips[(label, status)] += 1
+            self.bytes_fetched += bytes_fetched or 0
+            self.bytes_written += bytes_written or 0
+            self._recent.append((now, ok, bytes_fetched or 0))
+            self._expire(now)
+
+    def _expire(self, now):
+        while self._recent and self._recent[0][0] < now - self.window:
+            self._recent.popleft()
+
+    def rates(self):
+        """
+        Return clips/min, fetched MB/s and the failure rate over the window.
+        """
+        with self._lock:
+            self._expire(time.time())
+            n = len(self._recent)
+            failed = sum(1 for _, ok, _ in self._recent if not ok)
+            fetched = sum(size for _, _, size in self._recent)
+        return {
+            "clips_per_minute": n * 60.0 / self.window,
+            "fetched_mb_per_second": fetched / 1e6 / self.window,
+            "failure_rate": failed / n if n else 0.0,
+        }
+
+    def prometheus(self):
+        """
+        Render the counters in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP audioset_{name} {help_text}")
+            lines.append(f"# TYPE audioset_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                if label_text:
+                    label_text = "{" + label_text + "}"
+                lines.append(f"audioset_{name}{label_text} {value}")
+
+        rates = self.rates()
+        with self._lock:
+            metric("clips_total", "counter", "Finished clips by status.",
+                   [({"status": status}, n) for status, n in self.clips.items()])
+            metric("class_clips_total", "counter", "Finished clips by class and status.",
+                   [({"class": label, "status": status}, n)
+                    for (label, status), n in self.class_clips.items()])
+            metric("stage_seconds_total", "counter", "Wall time spent per stage.",
+                   [({"stage": stage}, s) for stage, s in self.stage_seconds.items()])
+            metric("stage_runs_total", "counter", "Number of clips timed per stage.",
+                   [({"stage": stage}, n) for stage, n in self.stage_count.items()])
+            metric("bytes_fetched_total", "counter", "Bytes downloaded.", [({}, self.bytes_fetched)])
+            metric("bytes_written_total", "counter", "Bytes written to outputs.", [({}, self.bytes_written)])
+        for name, value in rates.items():
+            metric(name, "gauge", f"Rolling {name.replace('_', ' ')} over the last {self.window:g} s.",
+                   [({}, value)])
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host="127.0.0.1", port=9100):
+        """
+        Serve /metrics on a background thread and return the server.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def close(self):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
@@ -0,0 +1,179 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+_DONE = object()
+# Marks a results item carrying an error of the job source
+_SOURCE_ERROR = object()
+
+
+def _put(q, item, stop):
+    # Block on a full queue, but give up once the pipeline is being torn down.
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def prefetch(jobs, fn, workers=4, lookahead=64):
+    """
+    Yield jobs in their original order while fn(job) runs on a pool of threads
+    for up to lookahead jobs ahead of the consumer. fn is only run for its side
+    effects, such as filling a cache; its errors are ignored and left for the
+    consumer to hit again. jobs is read on a thread of its own, so jobs read
+    ahead are still yielded while the source blocks, e.g. a scheduler waiting
+    for the outcome of the clips in flight.
+    """
+    if lookahead <= 0:
+        yield from jobs
+        return
+    ahead = queue.Queue(maxsize=lookahead)
+    stop = threading.Event()
+    error = []
+
+    def read(pool):
+        try:
+            for job in jobs:
+                pool.submit(fn, job)
+                if not _put(ahead, job, stop):
+                    return
+        except Exception as e:
+            error.append(e)
+        finally:
+            _put(ahead, _DONE, stop)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        reader = threading.Thread(target=read, args=(pool,), daemon=True)
+        reader.start()
+        try:
+            while True:
+                job = ahead.get()
+                if job is _DONE:
+                    break
+                yield job
+        finally:
+            # The reader may be blocked in jobs; it is a daemon and sees stop
+            stop.set()
+    if error:
+        raise error[0]
+
+
+def run_pipeline(
+    jobs,
+    fetch_fn,
+    process_fn,
+    fetch_workers=4,
+    process_workers=None,
+    queue_size=8,
+):
+    """
+    Stream jobs through a two stage pipeline and yield (job, result, error) as
+    soon as each job is finished. error is None when the job succeeded.
+
+    The fetch stage runs fetch_fn(job) on a pool of threads, since it is bound by
+    the network. The process stage runs process_fn(job, fetched) on a process pool
+    sized to the core count. The stages are joined by bounded queues, so fetching
+    pauses when processing falls behind instead of filling the temp directory.
+    If fetch_fn returns None the job is treated as done and never reaches the
+    process stage. An error raised by jobs itself is raised here once the jobs
+    already read have been yielded. A process pool broken by a dead worker or
+    a result that cannot be unpickled fails the jobs it held and is replaced.
+    """
+    process_workers = process_workers or os.cpu_count() or 1
+    fetch_q = queue.Queue(maxsize=queue_size)
+    process_q = queue.Queue(maxsize=queue_size)
+    results = queue.Queue()
+    stop = threading.Event()
+
+    def feed():
+        try:
+            for job in jobs:
+                if not _put(fetch_q, job, stop):
+                    return
+        except Exception as e:
+            results.put((_SOURCE_ERROR, e))
+        finally:
+            for _ in range(fetch_workers):
+                _put(fetch_q, _DONE, stop)
+
+    def fetch():
+        while not stop.is_set():
+            job = fetch_q.get()
+            if job is _DONE:
+                break
+            try:
+                fetched = fetch_fn(job)
+            except Exception as e:
+                results.put((job, None, e))
+                continue
+            if fetched is None:
+                results.put((job, None, None))
+            else:
+                _put(process_q, (job, fetched), stop)
+        _put(process_q, _DONE, stop)
+
+    def dispatch():
+        in_flight = threading.Semaphore(process_workers)
+        finished_fetchers = 0
+        pools = [ProcessPoolExecutor(max_workers=process_workers)]
+
+        def on_done(future, job):
+            in_flight.release()
+            error = future.exception()
+            results.put((job, None if error else future.result(), error))
+
+        def submit(job, fetched):
+            try:
+                return pools[-1].submit(process_fn, job, fetched)
+            except BrokenProcessPool:
+                # The jobs the broken pool held fail on their own; the rest go
+                # to a fresh pool
+                pools.append(ProcessPoolExecutor(max_workers=process_workers))
+                return pools[-1].submit(process_fn, job, fetched)
+
+        try:
+            while finished_fetchers < fetch_workers and not stop.is_set():
+                item = process_q.get()
+                if item is _DONE:
+                    finished_fetchers += 1
+                    continue
+                job, fetched = item
+                in_flight.acquire()
+                try:
+                    future = submit(job, fetched)
+                except Exception as e:
+                    in_flight.release()
+                    results.put((job, None, e))
+                    continue
+                future.add_done_callback(lambda f, job=job: on_done(f, job))
+        finally:
+            # Waits for the jobs in flight, so their results come before _DONE
+            for pool in pools:
+                pool.shutdown(wait=True)
+            results.put(_DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    threads += [threading.Thread(target=fetch, daemon=True) for _ in range(fetch_workers)]
+    threads += [threading.Thread(target=dispatch, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    source_error = None
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            if item[0] is _SOURCE_ERROR:
+                source_error = item[1]
+                continue
+            yield item
+    finally:
+        stop.set()
+    if source_error is not None:
+        raise source_error
@@ -0,0 +1,223 @@
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+PENDING = "pending"
+FETCHING = "fetching"
+DONE = "done"
+FAILED = "failed"
+# Failed for good (private, removed, geo-blocked), skipped on later runs
+UNAVAILABLE = "unavailable"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    ytid TEXT NOT NULL,
+    start REAL NOT NULL,
+    state TEXT NOT NULL,
+    reason TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    bytes_fetched INTEGER NOT NULL DEFAULT 0,
+    bytes_written INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    verified REAL,
+    clamped REAL,
+    PRIMARY KEY (ytid, start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS clips_state ON clips (state);
+"""
+
+
+def _hash_keys(ytids, starts, n_chars):
+    """
+    This function hashes (ytid, start) keys to uint64 with FNV-1a over the
+    code points of the YTID, zero padded to n_chars, and the bits of the start.
+    """
+    chars = np.ascontiguousarray(ytids).view(np.uint32).reshape(len(ytids), -1)
+    prime = np.uint64(0x100000001B3)
+    hashes = np.full(len(ytids), 0xCBF29CE484222325, dtype=np.uint64)
+    for i in range(n_chars):
+        hashes = (hashes ^ (chars[:, i] if i < chars.shape[1] else np.uint64(0))) * prime
+    # Adding 0.0 turns -0.0 into 0.0, so equal starts have equal bits
+    hashes = (hashes ^ (np.asarray(starts, dtype="<f8") + 0.0).view(np.uint64)) * prime
+    return hashes ^ (hashes >> np.uint64(29))
+
+
+def isin_keys(ytids, starts, key_ytids, key_starts):
+    """
+    This function returns a boolean mask of the (ytids[i], starts[i]) pairs
+    that are among the (key_ytids, key_starts) pairs, with array operations
+    only: both sides are hashed, sorted and matched with searchsorted, and
+    equal hashes are confirmed on the keys themselves.
+    """
+    ytids, key_ytids = np.asarray(ytids, dtype=str), np.asarray(key_ytids, dtype=str)
+    starts, key_starts = np.asarray(starts, dtype=np.float64), np.asarray(key_starts, dtype=np.float64)
+    mask = np.zeros(len(ytids), dtype=bool)
+    if len(ytids) == 0 or len(key_ytids) == 0:
+        return mask
+    n_chars = max(ytids.dtype.itemsize, key_ytids.dtype.itemsize) // 4
+    hashes, key_hashes = _hash_keys(ytids, starts, n_chars), _hash_keys(key_ytids, key_starts, n_chars)
+    key_order = np.argsort(key_hashes)
+    key_hashes = key_hashes[key_order]
+    # Looking the rows up in hash order keeps the searches cache friendly
+    order = np.argsort(hashes)
+    positions = np.minimum(np.searchsorted(key_hashes, hashes[order]), len(key_hashes) - 1)
+    found = key_hashes[positions] == hashes[order]
+    rows, keys = order[found], key_order[positions[found]]
+    # A hash collision can at worst report a row as missing, never as present
+    mask[rows[(key_ytids[keys] == ytids[rows]) & (key_starts[keys] == starts[rows])]] = True
+    return mask
+
+
+class ProgressStore:
+    """
+    Durable per-clip download state, kept in SQLite in WAL mode.
+
+    Clips are keyed by (YTID, start), so the state survives changes to the class
+    filter or the manifest order. Every update is a single committed
+    transaction, so a crash loses at most the update in flight, and several
+    threads or processes can share one store.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(clips)")]
+        # Stores written before verification or clamped lengths existed
+        for column in ["verified", "clamped"]:
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE clips ADD COLUMN {column} REAL")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            with self._conn:
+                return self._conn.execute(sql, params)
+
+    def _set(self, ytid, start, state, reason=None, attempt=0, bytes_fetched=None, bytes_written=None,
+             clamped=None):
+        self._execute(
+            """
+            INSERT INTO clips (ytid, start, state, reason, attempts, bytes_fetched, bytes_written, updated, clamped)
+            VALUES (?, ?, ?, ?, ?, COALESCE(?, 0), COALESCE(?, 0), ?, ?)
+            ON CONFLICT (ytid, start) DO UPDATE SET
+                state = excluded.state,
+                reason = excluded.reason,
+                attempts = attempts + excluded.attempts,
+                bytes_fetched = COALESCE(?, bytes_fetched),
+                bytes_written = COALESCE(?, bytes_written),
+                updated = excluded.updated,
+                verified = NULL,
+                clamped = COALESCE(excluded.clamped, clamped)
+            """,
+            (ytid, float(start), state, reason, attempt, bytes_fetched, bytes_written,
+             time.time(), clamped, bytes_fetched, bytes_written),
+        )
+
+    def fetching(self, ytid, start):
+        """
+        Record that a new download attempt of a clip has started.
+        """
+        self._set(ytid, start, FETCHING, attempt=1)
+
+    def fetched(self, ytid, start, bytes_fetched):
+        self._set(ytid, start, FETCHING, bytes_fetched=bytes_fetched)
+
+    def done(self, ytid, start, bytes_written=None, clamped=None):
+        """
+        Record that a clip was written. clamped is the length of its outputs
+        when the video ended before the segment did.
+        """
+        self._set(ytid, start, DONE, bytes_written=bytes_written, clamped=clamped)
+
+    def failed(self, ytid, start, reason, permanent=False):
+        self._set(ytid, start, UNAVAILABLE if permanent else FAILED, reason=str(reason))
+
+    def verified(self, keys, notes=None):
+        """
+        Record that the outputs of the given (ytid, start) done clips passed
+        verification, with an optional note per key such as a clamped length.
+        """
+        notes = notes or {}
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE clips SET verified = ?, reason = ? WHERE ytid = ? AND start = ? AND state = ?",
+                    [(now, notes.get(key), key[0], float(key[1]), DONE) for key in keys],
+                )
+
+    def get(self, ytid, start):
+        """
+        Return the stored row of a clip as a dict, or None.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM clips WHERE ytid = ? AND start = ?", (ytid, float(start))
+            )
+            row = cursor.fetchone()
+            names = [column[0] for column in cursor.description]
+        return dict(zip(names, row)) if row else None
+
+    def keys(self, *states, unverified=False):
+        """
+        Return the set of (ytid, start) keys of clips in any of the given
+        states, only those never verified with unverified.
+        """
+        return set(self._keys(states, unverified))
+
+    def _keys(self, states, unverified=False):
+        placeholders = ", ".join("?" for _ in states)
+        condition = " AND verified IS NULL" if unverified else ""
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT ytid, start FROM clips WHERE state IN ({placeholders}){condition}", states
+            ).fetchall()
+
+    def key_arrays(self, *states):
+        """
+        Return the YTIDs and starts of the clips in any of the given states as
+        two arrays, to match against manifest columns with isin_keys.
+        """
+        rows = self._keys(states)
+        ytids = np.array([ytid for ytid, _ in rows], dtype=str)
+        starts = np.array([start for _, start in rows], dtype=np.float64)
+        return ytids, starts
+
+    def clamped(self):
+        """
+        Return the clamped output length of the clips that have one, keyed by
+        (ytid, start).
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ytid, start, clamped FROM clips WHERE clamped IS NOT NULL"
+            ).fetchall()
+        return {(ytid, start): clamped for ytid, start, clamped in rows}
+
+    def states(self):
+        """
+        Return the state of every stored clip, keyed by (ytid, start).
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT ytid, start, state FROM clips").fetchall()
+        return {(ytid, start): state for ytid, start, state in rows}
+
+    def counts(self):
+        """
+        Return the number of clips in each state.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM clips GROUP BY state"
+            ).fetchall()
+        return dict(rows)
@@ -0,0 +1,201 @@
+import heapq
+import threading
+
+import numpy as np
+
+from utils.utils import CHUNK_SIZE, manifest_jobs
+
+
+def parse_quota(text):
+    """
+    This function parses a --class_quota item: N for every selected class or
+    CLASS=N for one class. Returns (class name or None, N).
+    """
+    name, _, count = text.rpartition("=")
+    count = int(count)
+    if count < 0:
+        raise ValueError(f"Invalid class quota {text}, the count must not be negative")
+    return name or None, count
+
+
+def class_targets(data, quotas, allowed_classes=None):
+    """
+    This function turns parsed quotas into ({class name: target}, uncapped
+    class names). A bare N applies to every allowed class (every class when
+    none were given) without a quota of its own; without one, allowed classes
+    that have no quota are uncapped.
+    """
+    classes = allowed_classes or data.classes_name
+    default = None
+    targets = {}
+    for name, count in quotas:
+        if name is None:
+            default = count
+        elif name not in data.name_to_idx:
+            raise ValueError(f"Unknown class: {name}")
+        else:
+            targets[name] = count
+    uncapped = []
+    for name in classes:
+        if name in targets:
+            continue
+        if default is None:
+            uncapped.append(name)
+        else:
+            targets[name] = default
+    return targets, uncapped
+
+
+def _class_columns(data, rows, names):
+    """
+    This function returns a bool matrix of rows x names telling which of
+    the given classes each manifest row is labelled with.
+    """
+    columns = np.array([data.name_to_idx[name] for name in names], dtype=np.int64)
+    out = np.zeros((len(rows), len(columns)), dtype=bool)
+    for lo in range(0, len(rows), CHUNK_SIZE):
+        hi = lo + CHUNK_SIZE
+        bits = np.unpackbits(
+            np.asarray(data.label_bits[rows[lo:hi]]), axis=1, count=len(data.classes_name)
+        )
+        out[lo:hi] = bits[:, columns].astype(bool)
+    return out
+
+
+class ClassQuota:
+    """
+    Greedy scheduler for per-class clip targets.
+
+    jobs() hands out the candidate rows of data so each clip fills as many
+    under-quota classes as possible, rare classes first on ties. A class is
+    under quota while its done and in-flight clips stay below its target. The
+    outcome of every handed out clip must be reported with finish(): done
+    clips count towards their classes, failed clips give their places back,
+    so other clips of those classes are handed out again. Clips with an
+    uncapped class are always handed out, first. Clips whose classes are all
+    satisfied are never handed out; jobs() ends once nothing is in flight and
+    no clip would fill a class.
+
+    Gains only drop while clips are in flight, so stale heap entries are
+    rescored lazily when they are popped.
+    """
+
+    def __init__(self, data, targets, rows, uncapped=(), done_rows=()):
+        self.data = data
+        self.names = list(targets)
+        self.target = np.array([targets[name] for name in self.names], dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.labels = _class_columns(data, self.rows, self.names)
+        self.done = _class_columns(data, np.asarray(done_rows, dtype=np.int64), self.names).sum(
+            axis=0, dtype=np.int64
+        )
+        self.in_flight = np.zeros(len(self.names), dtype=np.int64)
+        self.outstanding = 0
+
+        supply = np.maximum(self.labels.sum(axis=0), 1)
+        self._rarity = (self.labels / supply).sum(axis=1)
+        if uncapped:
+            free = _class_columns(data, self.rows, list(uncapped)).any(axis=1)
+        else:
+            free = np.zeros(len(self.rows), dtype=bool)
+        self._free = list(np.flatnonzero(free)[::-1])
+        gains = (self.labels & (self.need() > 0)).sum(axis=1)
+        self._heap = [
+            (-int(gains[pos]), -float(self._rarity[pos]), int(pos))
+            for pos in np.flatnonzero(~free & (gains > 0))
+        ]
+        heapq.heapify(self._heap)
+        self._parked = set(np.flatnonzero(~free & (gains == 0)).tolist())
+        self._positions = {}
+        self._cond = threading.Condition()
+
+    def need(self):
+        return self.target - self.done - self.in_flight
+
+    def _gain(self, pos):
+        return int(np.count_nonzero(self.labels[pos] & (self.need() > 0)))
+
+    def _next(self):
+        if self._free:
+            return int(self._free.pop())
+        while self._heap:
+            gain, rarity, pos = heapq.heappop(self._heap)
+            current = self._gain(pos)
+            if current == 0:
+                self._parked.add(pos)
+            elif current == -gain:
+                return pos
+            else:
+                heapq.heappush(self._heap, (-current, rarity, pos))
+        return None
+
+    def jobs(self):
+        """
+        Yield the job dicts of the scheduled clips, blocking while the only
+        clips left are waiting on in-flight ones that may still fail.
+        """
+        while True:
+            with self._cond:
+                pos = self._next()
+                while pos is None and self.outstanding:
+                    self._cond.wait()
+                    pos = self._next()
+                if pos is None:
+                    return
+                row = int(self.rows[pos])
+                self.in_flight += self.labels[pos]
+                self.outstanding += 1
+                self._positions[(str(self.data.ytids[row]), float(self.data.start[row]))] = pos
+            yield next(manifest_jobs(self.data, [row]))
+
+    def finish(self, job, ok):
+        """
+        Record the outcome of a clip handed out by jobs().
+        """
+        with self._cond:
+            pos = self._positions.pop((job["ytid"], float(job["start"])), None)
+            if pos is None:
+                return
+            self.outstanding -= 1
+            self.in_flight -= self.labels[pos]
+            if ok:
+                self.done += self.labels[pos]
+            elif self._parked:
+                # Clips parked because their classes looked full may be needed again
+                reopened = self.labels[pos] & (self.need() > 0)
+                if reopened.any():
+                    for parked in [p for p in self._parked if (self.labels[p] & reopened).any()]:
+                        self._parked.discard(parked)
+                        heapq.heappush(self._heap, (-self._gain(parked), -float(self._rarity[parked]), parked))
+            self._cond.notify_all()
+
+    def plan(self):
+        """
+        Return the rows jobs() would hand out if every clip succeeded. This
+        consumes the scheduler.
+        """
+        rows = []
+        for job in self.jobs():
+            rows.append(job["row"])
+            self.finish(job, True)
+        return rows
+
+    def summary(self):
+        """
+        Return {class name: (done clips, target)}.
+        """
+        return {name: (int(done), int(target)) for name, done, target in zip(self.names, self.done, self.target)}
+
+
+def build_quota(data, quotas, allowed_classes=None, done_keys=(), skip_keys=()):
+    """
+    This function builds the ClassQuota of the selected clips of data: clips
+    in done_keys count towards their classes and clips in skip_keys, such as
+    the done and unavailable ones, are not scheduled.
+    """
+    targets, uncapped = class_targets(data, quotas, allowed_classes)
+    done_keys, skip_keys = set(done_keys), set(skip_keys)
+    keys = [(str(ytid), float(start)) for ytid, start in zip(data.ytids, data.start)]
+    rows = [i for i, key in enumerate(keys) if key not in skip_keys]
+    done_rows = [i for i, key in enumerate(keys) if key in done_keys]
+    return ClassQuota(data, targets, rows, uncapped, done_rows)
@@ -0,0 +1,88 @@
+import collections
+import os
+
+import numpy as np
+
+from utils.progress import DONE, PENDING, UNAVAILABLE, ProgressStore
+from utils.quota import build_quota
+from utils.utils import CHUNK_SIZE
+
+
+def selection_summary(data):
+    """
+    This function summarises the selected clips: their number, distinct
+    videos, total hours and the number of clips of each class.
+    """
+    n_classes = len(data.classes_name)
+    per_class = np.zeros(n_classes, dtype=np.int64)
+    for lo in range(0, len(data.row), CHUNK_SIZE):
+        bits = np.unpackbits(np.asarray(data.label_bits[lo:lo + CHUNK_SIZE]), axis=1, count=n_classes)
+        per_class += bits.sum(axis=0, dtype=np.int64)
+    classes = {
+        data.classes_name[i]: int(per_class[i])
+        for i in np.argsort(-per_class, kind="stable")
+        if per_class[i]
+    }
+    return {
+        "clips": len(data.row),
+        "videos": len(np.unique(data.ytids)),
+        "hours": float(np.sum(np.asarray(data.end) - np.asarray(data.start))) / 3600,
+        "classes": classes,
+    }
+
+
+def progress_summary(data, store_path):
+    """
+    This function counts the selected clips in each download state of the
+    progress store at store_path, without creating the store if it is missing.
+    """
+    states = {}
+    if os.path.exists(store_path):
+        store = ProgressStore(store_path)
+        states = store.states()
+        store.close()
+    counts = collections.Counter(
+        states.get((str(ytid), float(start)), PENDING)
+        for ytid, start in zip(data.ytids, data.start)
+    )
+    return dict(counts)
+
+
+def quota_summary(data, quotas, allowed_classes, store_path):
+    """
+    This function returns how many more clips the class quotas need if every
+    download succeeds, and by how much each class would fall short of its
+    quota with the clips available.
+    """
+    done = skip = set()
+    if os.path.exists(store_path):
+        store = ProgressStore(store_path)
+        done, skip = store.keys(DONE), store.keys(DONE, UNAVAILABLE)
+        store.close()
+    scheduler = build_quota(data, quotas, allowed_classes, done, skip)
+    rows = scheduler.plan()
+    short = {
+        name: target - count
+        for name, (count, target) in scheduler.summary().items()
+        if count < target
+    }
+    return {"clips_for_quota": len(rows), "short_of_quota": short}
+
+
+def group_summary(splits):
+    """
+    This function counts the clips of several splits and the distinct videos
+    they come from, which is the number of downloads once they are grouped by
+    YTID.
+    """
+    owners = collections.defaultdict(set)
+    clips = 0
+    for split in splits:
+        clips += len(split.data.row)
+        for ytid in np.unique(split.data.ytids):
+            owners[str(ytid)].add(split.name)
+    return {
+        "clips": clips,
+        "videos": len(owners),
+        "videos_in_several_splits": sum(1 for names in owners.values() if len(names) > 1),
+    }
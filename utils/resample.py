@@ -0,0 +1,78 @@
+import numpy as np
+
+try:
+    import soxr
+except ImportError:
+    soxr = None
+
+
+def parse_variant(text):
+    """
+    This function parses an audio variant given as "RATE" or "RATE:CHANNELS"
+    into (rate, channels). Channels default to mono.
+    """
+    rate, _, channels = str(text).partition(":")
+    rate, channels = int(rate), int(channels or 1)
+    if rate <= 0 or channels not in [1, 2]:
+        raise ValueError(f"Invalid audio variant {text}, expected RATE or RATE:1 / RATE:2")
+    return rate, channels
+
+
+def variant_dir(rate, channels, primary=False):
+    """
+    This function names the output directory of an audio variant. The first
+    variant keeps the plain "audio" directory.
+    """
+    if primary:
+        return "audio"
+    return f"audio_{rate}hz" + ("_stereo" if channels == 2 else "")
+
+
+def resample(samples, rate_in, rate_out):
+    """
+    Resample a float (frames, channels) buffer from rate_in to rate_out, all
+    channels at once. Uses soxr when it is installed and an FFT resampler
+    otherwise, which is fine for short segments held in memory.
+    """
+    if rate_in == rate_out:
+        return samples
+    if soxr is not None:
+        return soxr.resample(samples, rate_in, rate_out).astype(np.float32, copy=False)
+    n_in = samples.shape[0]
+    n_out = int(round(n_in * rate_out / rate_in))
+    spectrum = np.fft.rfft(samples, axis=0)
+    n_bins = min(spectrum.shape[0], n_out // 2 + 1)
+    resized = np.zeros((n_out // 2 + 1,) + samples.shape[1:], dtype=spectrum.dtype)
+    resized[:n_bins] = spectrum[:n_bins]
+    if rate_out < rate_in and n_out % 2 == 0:
+        # The new Nyquist bin has to be real
+        resized[-1] = resized[-1].real
+    return (np.fft.irfft(resized, n_out, axis=0) * (n_out / n_in)).astype(np.float32)
+
+
+def remix(samples, channels):
+    """
+    Convert a (frames, channels) buffer to mono (channel mean) or stereo.
+    """
+    if samples.shape[1] == channels:
+        return samples
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True)
+    return np.repeat(samples[:, :1], channels, axis=1)
+
+
+def write_variants(samples, rate, variants, paths):
+    """
+    Write one wav per (rate, channels) variant from a single decoded float
+    buffer. Buffers of the same rate are resampled only once. Returns the
+    resampled buffers by rate.
+    """
+    import soundfile as sf
+
+    resampled = {}
+    for (out_rate, channels), path in zip(variants, paths):
+        if out_rate not in resampled:
+            resampled[out_rate] = resample(samples, rate, out_rate)
+        out = np.clip(remix(resampled[out_rate], channels), -1.0, 1.0)
+        sf.write(path, out, out_rate, subtype="PCM_16")
+    return resampled
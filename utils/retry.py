@@ -0,0 +1,149 @@
+import random
+import re
+import threading
+from time import sleep
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+THROTTLED = "throttled"
+
+# Checked in order, the first match wins. Anything unmatched is transient.
+_PATTERNS = [
+    (THROTTLED, re.compile(
+        r"HTTP Error 429|Too Many Requests|confirm you.re not a bot|rate.?limit",
+        re.IGNORECASE,
+    )),
+    (PERMANENT, re.compile(
+        r"Private video|Video unavailable|has been removed|account .* terminated|"
+        r"available in your country|geo.?restrict|blocked it in your country|"
+        r"members.only|confirm your age|copyright|HTTP Error 404|HTTP Error 410|"
+        r"Requested format is not available|exceeds video duration|"
+        r"must be greater than start time",
+        re.IGNORECASE,
+    )),
+    (TRANSIENT, re.compile(
+        r"timed? ?out|HTTP Error 5\d\d|Connection (reset|refused|aborted)|"
+        r"Temporary failure|IncompleteRead|Remote end closed",
+        re.IGNORECASE,
+    )),
+]
+# Errors of a section download that say the source cannot be fetched by range
+_RANGE_UNSUPPORTED = re.compile(
+    r"HTTP Error 416|Range Not Satisfiable|download_ranges|"
+    r"(does not|doesn.t|cannot) support .*(range|section)|ffmpeg (is )?not (installed|found)",
+    re.IGNORECASE,
+)
+
+
+class DownloadFailure(Exception):
+    """
+    Raised when a clip failed for good, carrying the failure category.
+    """
+
+    def __init__(self, category, error):
+        super().__init__(f"[{category}] {error}")
+        self.category = category
+        self.error = error
+
+
+def classify_error(error):
+    """
+    This function sorts a yt-dlp or ffmpeg error into PERMANENT (private,
+    removed, geo-blocked, ...), THROTTLED (429, bot check) or TRANSIENT.
+    """
+    if isinstance(error, DownloadFailure):
+        return error.category
+    message = str(error)
+    for category, pattern in _PATTERNS:
+        if pattern.search(message):
+            return category
+    return TRANSIENT
+
+
+def range_unsupported(error):
+    """
+    This function tells whether a failed section download means the video
+    cannot be fetched by range at all, so only a full download can work.
+    """
+    return classify_error(error) == TRANSIENT and bool(_RANGE_UNSUPPORTED.search(str(error)))
+
+
+def backoff_delay(attempt, base=2.0, cap=300.0):
+    """
+    Exponential backoff with full jitter: a random delay in
+    [0, min(cap, base * 2 ** attempt)] seconds.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class AIMDController:
+    """
+    Limits the number of concurrent fetches with additive increase,
+    multiplicative decrease. Each success raises the limit by 1 / limit, so it
+    grows by about one per round of successful fetches. A throttling signal
+    multiplies it by decrease, at most once per limit successful fetches, so a
+    burst of 429s from fetches already in flight only counts once.
+
+    Use it as a context manager around each fetch.
+    """
+
+    def __init__(self, max_limit, min_limit=1, decrease=0.5):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.decrease = decrease
+        self.limit = float(self.max_limit)
+        self._active = 0
+        self._since_decrease = self.max_limit
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self._active >= int(self.limit):
+                self._cond.wait()
+            self._active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+        return False
+
+    def success(self):
+        with self._cond:
+            self._since_decrease += 1
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def throttled(self):
+        with self._cond:
+            if self._since_decrease < int(self.limit):
+                return
+            self._since_decrease = 0
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+
+
+def call_with_retry(fn, max_retries=3, controller=None):
+    """
+    Call fn() until it succeeds. Transient and throttled failures are retried
+    up to max_retries times after a jittered exponential backoff; permanent
+    ones are not retried. Throttling is reported to the controller, which also
+    gates the calls. Raises DownloadFailure when giving up.
+    """
+    attempt = 0
+    while True:
+        try:
+            if controller is None:
+                return fn()
+            with controller:
+                result = fn()
+            controller.success()
+            return result
+        except Exception as e:
+            category = classify_error(e)
+            if category == THROTTLED and controller is not None:
+                controller.throttled()
+            if category == PERMANENT or attempt >= max_retries:
+                raise DownloadFailure(category, e) from e
+            sleep(backoff_delay(attempt))
+            attempt += 1
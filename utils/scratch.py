@@ -0,0 +1,182 @@
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+_PREFIX = "scratch-"
+_LOCK_NAME = ".owner"
+# A directory younger than this may still be waiting for its lock file
+_GRACE_SECONDS = 60.0
+
+
+def _dir_size(path):
+    total = 0
+    for entry in os.scandir(path):
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += _dir_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            # Removed while walking
+            pass
+    return total
+
+
+def _owner_alive(path):
+    """
+    This function checks whether the process owning a scratch directory still
+    runs. The owner holds its lock file open for its whole lifetime, so the
+    lock can only be taken (POSIX) or the file removed (Windows) once the owner
+    exited or crashed.
+    """
+    lock_path = os.path.join(path, _LOCK_NAME)
+    if not os.path.exists(lock_path):
+        return time.time() - os.path.getmtime(path) < _GRACE_SECONDS
+    if fcntl is None:
+        try:
+            os.remove(lock_path)
+        except PermissionError:
+            return True
+        except FileNotFoundError:
+            pass
+        return False
+    with open(lock_path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+    return False
+
+
+def scratch_usage(root):
+    """
+    This function returns the bytes held by the scratch directories of all
+    runs under root, ignoring any other files there.
+    """
+    if not os.path.isdir(root):
+        return 0
+    total = 0
+    for entry in os.scandir(root):
+        try:
+            if entry.name.startswith(_PREFIX) and entry.is_dir(follow_symlinks=False):
+                total += _dir_size(entry.path)
+        except OSError:
+            # Removed while walking
+            pass
+    return total
+
+
+def sweep_scratch(root):
+    """
+    Remove the scratch directories under root left behind by crashed runs.
+    Returns the number of directories removed.
+    """
+    if not os.path.isdir(root):
+        return 0
+    removed = 0
+    for entry in os.scandir(root):
+        if not entry.name.startswith(_PREFIX) or not entry.is_dir():
+            continue
+        try:
+            if _owner_alive(entry.path):
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(entry.path, ignore_errors=True)
+        removed += 1
+    return removed
+
+
+class ScratchDir:
+    """
+    Private scratch directory of one run under a shared root.
+
+    The name is unique per host, process and run, so workers sharing the root
+    never see each other's files. close() removes the directory; if the owner
+    crashes instead, the next ScratchDir created under the same root sweeps it
+    (see sweep_scratch).
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.swept = sweep_scratch(self.root)
+        name = f"{_PREFIX}{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.path = os.path.join(self.root, name)
+        os.makedirs(self.path)
+        self._lock_file = open(os.path.join(self.path, _LOCK_NAME), "w")
+        if fcntl is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def close(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class TempQuota:
+    """
+    Backpressure on temp space: wait() blocks new fetches while the scratch
+    directories under the given roots hold more than high_water * limit bytes,
+    until usage drops below low_water * limit again. The directories of every
+    run under a root count, so concurrent runs sharing a disk stay within one
+    limit together. Usage is measured on a background thread every interval
+    seconds, so partial downloads count as well. With limit None wait() never
+    blocks.
+    """
+
+    def __init__(self, roots, limit=None, high_water=0.9, low_water=0.7, interval=1.0):
+        self.roots = list(dict.fromkeys(str(root) for root in roots))
+        self.limit = limit
+        self.high_water = high_water
+        self.low_water = low_water
+        self.interval = interval
+        self.usage = 0
+        self.paused = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        if limit:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            usage = sum(scratch_usage(root) for root in self.roots)
+            with self._cond:
+                self.usage = usage
+                if usage >= self.high_water * self.limit:
+                    self.paused = True
+                elif usage < self.low_water * self.limit:
+                    self.paused = False
+                    self._cond.notify_all()
+            self._stop.wait(self.interval)
+
+    def wait(self):
+        with self._cond:
+            while self.paused and not self._stop.is_set():
+                self._cond.wait(self.interval)
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self.paused = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,166 @@
+import glob
+import json
+import os
+
+import numpy as np
+
+
+def index_dtype(n_label_bytes):
+    """
+    This function returns the record type of a shard index: the YTID, the
+    segment bounds, where the samples are in the shard and the label bitset.
+    """
+    return np.dtype([
+        ("ytid", "S11"),
+        ("start", "<f8"),
+        ("end", "<f8"),
+        ("offset", "<i8"),
+        ("length", "<i8"),
+        ("labels", "u1", (n_label_bytes,)),
+    ])
+
+
+def _shard_paths(root, shard):
+    base = os.path.join(root, f"shard_{shard:05d}")
+    return f"{base}.i16", f"{base}.idx"
+
+
+class ShardWriter:
+    """
+    Output sink that appends clips to large sharded containers instead of
+    writing one wav per clip per label.
+
+    Each shard is a raw little-endian int16 sample file plus an index file of
+    fixed size records (see index_dtype). Samples are appended before their
+    index record, so a crash can only leave samples without a record, never a
+    record without samples. A new shard is started once a shard holds
+    max_samples samples, and every writer session starts a new shard.
+    """
+
+    def __init__(self, root, sample_rate, n_label_bytes, channels=1, max_samples=1 << 28):
+        self.root = root
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dtype = index_dtype(n_label_bytes)
+        self.max_samples = max_samples
+        os.makedirs(root, exist_ok=True)
+
+        meta_path = os.path.join(root, "meta.json")
+        meta = {
+            "sample_rate": sample_rate,
+            "channels": channels,
+            "n_label_bytes": n_label_bytes,
+            "sample_dtype": "<i2",
+        }
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                existing = json.load(f)
+            if existing != meta:
+                raise ValueError(f"Shards in {root} were written with {existing}, not {meta}")
+        else:
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+
+        self.shard = len(glob.glob(os.path.join(root, "shard_*.idx")))
+        self._samples = None
+        self._index = None
+        self._offset = 0
+
+    def _open_next(self):
+        self.close()
+        samples_path, index_path = _shard_paths(self.root, self.shard)
+        self._samples = open(samples_path, "ab")
+        self._index = open(index_path, "ab")
+        self._offset = 0
+        self.shard += 1
+
+    def add(self, ytid, start_time, end_time, label_bits, samples):
+        """
+        Append the int16 samples of one clip with its index record.
+        Multi-channel samples are stored interleaved.
+        """
+        samples = np.ascontiguousarray(samples, dtype="<i2").reshape(-1)
+        if self._samples is None or self._offset + len(samples) > self.max_samples:
+            self._open_next()
+        record = np.zeros(1, dtype=self.dtype)
+        record["ytid"] = ytid
+        record["start"] = start_time
+        record["end"] = end_time
+        record["offset"] = self._offset
+        record["length"] = len(samples)
+        record["labels"] = label_bits
+        self._samples.write(samples.tobytes())
+        self._samples.flush()
+        self._index.write(record.tobytes())
+        self._index.flush()
+        self._offset += len(samples)
+
+    def close(self):
+        for f in [self._samples, self._index]:
+            if f is not None:
+                f.close()
+        self._samples = self._index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class ShardReader:
+    """
+    Read clips back from a ShardWriter directory.
+
+    The sample files are memory-mapped, so reader[i] returns a NumPy view into
+    the shard without copying. index holds the records of all shards, with
+    the position of each clip's shard in the "shard" field.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, "meta.json")) as f:
+            meta = json.load(f)
+        self.sample_rate = meta["sample_rate"]
+        self.channels = meta.get("channels", 1)
+        record_dtype = index_dtype(meta["n_label_bytes"])
+
+        self._samples = []
+        indices = []
+        for index_path in sorted(glob.glob(os.path.join(root, "shard_*.idx"))):
+            shard = int(os.path.basename(index_path)[6:11])
+            samples_path, _ = _shard_paths(root, shard)
+            # Ignore a torn record at the end of a shard written during a crash
+            n_records = os.path.getsize(index_path) // record_dtype.itemsize
+            records = np.fromfile(index_path, dtype=record_dtype, count=n_records)
+            n_samples = os.path.getsize(samples_path) // 2
+            if n_samples == 0:
+                continue
+            self._samples.append(
+                np.memmap(samples_path, dtype=meta["sample_dtype"], mode="r", shape=(n_samples,))
+            )
+            index = np.zeros(n_records, dtype=record_dtype.descr + [("shard", "<i4")])
+            for name in record_dtype.names:
+                index[name] = records[name]
+            index["shard"] = len(self._samples) - 1
+            indices.append(index)
+        if indices:
+            self.index = np.concatenate(indices)
+        else:
+            self.index = np.zeros(0, dtype=record_dtype.descr + [("shard", "<i4")])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        record = self.index[i]
+        offset = int(record["offset"])
+        samples = self._samples[record["shard"]][offset:offset + int(record["length"])]
+        return samples if self.channels == 1 else samples.reshape(-1, self.channels)
+
+    def with_label(self, class_idx):
+        """
+        Return the positions of the clips that have the given class index set.
+        """
+        return np.flatnonzero(self.index["labels"][:, class_idx // 8] & (128 >> (class_idx % 8)))
@@ -0,0 +1,125 @@
+import os
+
+import numpy as np
+
+from utils.config import state_dir
+from utils.utils import Data, manifest_jobs
+
+# Cuts of a video at most this many seconds apart are fetched in one download
+WINDOW_GAP = 10.0
+
+
+class Split:
+    """
+    One manifest of a run, such as balanced_train_segments, with the
+    directory its outputs go to and the directory of its progress store.
+
+    store, index, label_index, shard_writer and feature_writer are set while
+    a download run uses the split.
+    """
+
+    def __init__(self, name, data, data_dir, state_dir):
+        self.name = name
+        self.data = data
+        self.data_dir = str(data_dir)
+        self.state_dir = str(state_dir)
+        self.store = None
+        self.index = None
+        self.label_index = None
+        self.shard_writer = None
+        self.feature_writer = None
+
+    @property
+    def store_path(self):
+        return os.path.join(self.state_dir, "progress.sqlite")
+
+
+def split_name(csv_path):
+    """
+    This function names a split after its manifest file, without extension.
+    """
+    return os.path.splitext(os.path.basename(csv_path))[0]
+
+
+def single_split(data, args):
+    """
+    This function returns the split of a run over one manifest, which writes
+    to the destination directory and keeps its progress in the state directory.
+    """
+    return Split(split_name(data.csv_path), data, args.destination_dir, state_dir(args))
+
+
+def load_splits(args):
+    """
+    This function loads the manifests in args.csv_dataset. A single manifest
+    writes straight into the destination directory; with several, each one
+    writes into destination_dir/<split> and keeps its progress in
+    <state dir>/<split>, while metadata, scratch space and logs are shared.
+    """
+    paths = args.csv_dataset
+    splits = []
+    for path in paths:
+        data = Data(path, args.label_file, args.classes, args.blacklist, shard=args.shard)
+        if len(paths) == 1:
+            splits.append(single_split(data, args))
+            continue
+        name = split_name(path)
+        splits.append(Split(
+            name, data, os.path.join(args.destination_dir, name), os.path.join(state_dir(args), name)
+        ))
+    names = [split.name for split in splits]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Manifests must have distinct file names, got {names}")
+    return splits
+
+
+def group_jobs(splits, pending, max_gap=WINDOW_GAP):
+    """
+    This function merges the pending rows of several splits, given as
+    {split name: row positions}, and yields their job dicts grouped by YTID,
+    in the order each video first appears. Cuts of a video whose windows
+    overlap or are at most max_gap seconds apart form a group fetched once:
+    every job gets its split, its group's window, which covers only that run
+    of cuts, and the number of cuts in the group. Cuts far apart stay in
+    groups of their own, so a video is never fetched over a long stretch no
+    cut needs.
+    """
+    by_name = {split.name: split for split in splits}
+    names = [name for name in pending if len(pending[name])]
+    if not names:
+        return
+    rows = [np.asarray(pending[name], dtype=np.int64) for name in names]
+    owner = np.concatenate([np.full(len(r), i, dtype=np.int64) for i, r in enumerate(rows)])
+    rows = np.concatenate(rows)
+    ytids = np.concatenate([np.asarray(by_name[name].data.ytids[pending[name]]) for name in names])
+    starts = np.concatenate([np.asarray(by_name[name].data.start[pending[name]]) for name in names])
+    ends = np.concatenate([np.asarray(by_name[name].data.end[pending[name]]) for name in names])
+
+    _, first, video = np.unique(ytids, return_index=True, return_inverse=True)
+    video = video.reshape(-1)
+    # Sweep the cuts of each video by start; a cut starting more than max_gap
+    # after the furthest end so far opens a new group. Shifting every video
+    # above the previous one lets a single running maximum cover all of them.
+    order = np.lexsort((starts, video))
+    low = float(ends.min())
+    shift = video[order] * (float(ends.max()) - low + max_gap + 1.0)
+    reach = np.maximum.accumulate(ends[order] - low + shift) - shift + low
+    opens = np.ones(len(order), dtype=bool)
+    opens[1:] = (video[order][1:] != video[order][:-1]) | (starts[order][1:] > reach[:-1] + max_gap)
+    group = np.empty(len(order), dtype=np.int64)
+    group[order] = np.cumsum(opens) - 1
+    window_start = np.full(group.max() + 1, np.inf)
+    window_end = np.full(group.max() + 1, -np.inf)
+    np.minimum.at(window_start, group, starts)
+    np.maximum.at(window_end, group, ends)
+    size = np.bincount(group)
+    for i in np.argsort(first[video], kind="stable"):
+        split = by_name[names[owner[i]]]
+        job = next(manifest_jobs(split.data, [rows[i]]))
+        g = group[i]
+        job.update(
+            split=split.name,
+            window=(float(window_start[g]), float(window_end[g])),
+            group_size=int(size[g]),
+        )
+        yield job
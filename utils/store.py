@@ -0,0 +1,190 @@
+import errno
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Ways to put a stored output into a label directory
+LINK_MODES = ["hardlink", "symlink", "reflink", "copy"]
+# Directory of the content store inside a data directory
+STORE_DIR = "store"
+# Link modes tried in turn when a link cannot be made and fallback is set
+_FALLBACKS = {"hardlink": ["symlink", "copy"], "symlink": ["copy"], "reflink": ["copy"], "copy": []}
+# Linux FICLONE ioctl, which shares the extents of a file on btrfs, XFS and similar
+_FICLONE = 0x40049409
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    ytid TEXT NOT NULL,
+    start REAL NOT NULL,
+    end REAL NOT NULL,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (ytid, start, kind)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS labels (
+    label TEXT NOT NULL,
+    ytid TEXT NOT NULL,
+    start REAL NOT NULL,
+    PRIMARY KEY (label, ytid, start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS labels_clip ON labels (ytid, start);
+"""
+
+
+def stored_path(data_dir, kind, ytid, start_time, end_time, ext):
+    """
+    This function returns where the single stored copy of an output lives:
+    data_dir/store/<kind>/<ytid>_start_<start>_end_<end>.<ext>, where kind is
+    the output directory name such as video, audio or audio_44100hz.
+    """
+    return os.path.join(
+        data_dir, STORE_DIR, kind, f"{ytid}_start_{int(start_time)}_end_{int(end_time)}.{ext}"
+    )
+
+
+def clip_paths(data_dir, audio_id, label, start_time, end_time, audio_dir="audio"):
+    """
+    This function returns the final video and audio paths of a clip for one label.
+    """
+    video_path = os.path.join(
+        data_dir,
+        "video",
+        label,
+        f"video_{audio_id}_start_{int(start_time)}_end_{int(end_time)}.mp4"
+    )
+    audio_path = os.path.join(
+        data_dir,
+        audio_dir,
+        label,
+        f"audio_{audio_id}_start_{int(start_time)}_end_{int(end_time)}.wav"
+    )
+    return video_path, audio_path
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(src, "rb") as f_src, open(dst, "wb") as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), _FICLONE, f_src.fileno())
+        except OSError:
+            f_dst.close()
+            os.remove(dst)
+            raise
+
+
+def link_output(src, dst, mode="hardlink", fallback=True):
+    """
+    This function puts the stored file src at dst with the given link mode,
+    replacing what is at dst. A relative symlink is used, so the data
+    directory can be moved. If the link cannot be made, e.g. across
+    filesystems or without reflink support, a failed hardlink falls back to a
+    symlink and then to a copy, and the other modes to a copy, when fallback
+    is set. Otherwise the error is raised. Returns the mode used.
+    """
+    if mode not in _FALLBACKS:
+        raise ValueError(f"Unknown link mode: {mode}")
+    if os.path.lexists(dst):
+        os.remove(dst)
+    modes = [mode] + (_FALLBACKS[mode] if fallback else [])
+    for i, mode in enumerate(modes):
+        try:
+            if mode == "hardlink":
+                os.link(src, dst)
+            elif mode == "symlink":
+                os.symlink(os.path.relpath(src, os.path.dirname(dst)), dst)
+            elif mode == "reflink":
+                _reflink(src, dst)
+            else:
+                shutil.copyfile(src, dst)
+            return mode
+        except OSError:
+            if i == len(modes) - 1:
+                raise
+
+
+class LabelIndex:
+    """
+    Index of the outputs in a data directory by clip and label, kept in SQLite
+    in WAL mode as data_dir/index.sqlite.
+
+    Every output of a clip is recorded once, by its path in the content store
+    relative to the data directory, and every label of the clip points at the
+    clip, so downstream tools can list the clips of a label without walking
+    the label directories.
+    """
+
+    def __init__(self, path, timeout=30.0):
+        self.path = str(path)
+        self.root = os.path.dirname(os.path.abspath(self.path))
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def add(self, ytid, start, end, labels, outputs):
+        """
+        Record a clip with its labels and its stored outputs, given as
+        {kind: path}, replacing what was recorded for it before.
+        """
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._remove(ytid, start)
+                self._conn.executemany(
+                    "INSERT INTO outputs (ytid, start, end, kind, path, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(ytid, float(start), float(end), kind, os.path.relpath(path, self.root), now)
+                     for kind, path in outputs.items()],
+                )
+                self._conn.executemany(
+                    "INSERT INTO labels (label, ytid, start) VALUES (?, ?, ?)",
+                    [(label, ytid, float(start)) for label in labels],
+                )
+
+    def _remove(self, ytid, start):
+        self._conn.execute("DELETE FROM outputs WHERE ytid = ? AND start = ?", (ytid, float(start)))
+        self._conn.execute("DELETE FROM labels WHERE ytid = ? AND start = ?", (ytid, float(start)))
+
+    def remove(self, ytid, start):
+        with self._lock:
+            with self._conn:
+                self._remove(ytid, start)
+
+    def clips(self, label, kind=None):
+        """
+        Return (ytid, start, end, kind, absolute path) of the outputs of the
+        clips with a label, only those of one kind when kind is given.
+        """
+        sql = (
+            "SELECT o.ytid, o.start, o.end, o.kind, o.path FROM labels l "
+            "JOIN outputs o ON o.ytid = l.ytid AND o.start = l.start WHERE l.label = ?"
+        )
+        params = [label]
+        if kind is not None:
+            sql += " AND o.kind = ?"
+            params.append(kind)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY o.ytid, o.start", params).fetchall()
+        return [(ytid, start, end, kind, os.path.join(self.root, path)) for ytid, start, end, kind, path in rows]
+
+    def labels(self):
+        """
+        Return the number of clips of each label.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT label, COUNT(*) FROM labels GROUP BY label").fetchall()
+        return dict(rows)
@@ -0,0 +1,156 @@
+import json
+import subprocess as sp
+
+import ffmpy
+import numpy as np
+
+# A stream copy is only used when a keyframe lies this close (in seconds) to the cut
+KEYFRAME_TOLERANCE = 0.05
+
+
+def probe_duration(path):
+    """
+    This function reads the duration of a media file from the container
+    metadata, without decoding any frames.
+    """
+    ff = ffmpy.FFprobe(
+        inputs={path: "-v error -show_entries format=duration -of json"},
+    )
+    stdout, _ = ff.run(stdout=sp.PIPE, stderr=sp.PIPE)
+    duration = json.loads(stdout)["format"].get("duration")
+    if duration is None:
+        raise Exception(f"Could not read duration of {path}")
+    return float(duration)
+
+
+def probe_streams(path):
+    """
+    This function reads the container duration and the codec type of every
+    stream ("video", "audio", ...) from the headers.
+    """
+    ff = ffmpy.FFprobe(
+        inputs={path: "-v error -show_entries format=duration:stream=codec_type -of json"},
+    )
+    stdout, _ = ff.run(stdout=sp.PIPE, stderr=sp.PIPE)
+    probe = json.loads(stdout)
+    duration = probe.get("format", {}).get("duration")
+    streams = [stream.get("codec_type") for stream in probe.get("streams", [])]
+    return (float(duration) if duration is not None else None), streams
+
+
+def probe_audio_rate(path):
+    """
+    This function reads the sample rate of the first audio stream from the
+    stream headers.
+    """
+    ff = ffmpy.FFprobe(
+        inputs={path: "-v error -select_streams a:0 -show_entries stream=sample_rate -of json"},
+    )
+    stdout, _ = ff.run(stdout=sp.PIPE, stderr=sp.PIPE)
+    streams = json.loads(stdout).get("streams", [])
+    if not streams or "sample_rate" not in streams[0]:
+        raise Exception(f"No audio stream in {path}")
+    return int(streams[0]["sample_rate"])
+
+
+def keyframe_before(path, time, search=10.0):
+    """
+    This function returns the time of the last video keyframe at or before
+    time, or None when there is none in the search window. Only packet headers
+    around time are read.
+    """
+    ff = ffmpy.FFprobe(
+        inputs={
+            path: f"-v error -select_streams v:0 -skip_frame nokey "
+                  f"-read_intervals {max(0.0, time - search)}%{time + KEYFRAME_TOLERANCE} "
+                  f"-show_entries frame=pts_time -of json"
+        },
+    )
+    stdout, _ = ff.run(stdout=sp.PIPE, stderr=sp.PIPE)
+    times = [
+        float(frame["pts_time"])
+        for frame in json.loads(stdout).get("frames", [])
+        if "pts_time" in frame
+    ]
+    times = [t for t in times if t <= time + KEYFRAME_TOLERANCE]
+    return max(times) if times else None
+
+
+def trim_segment(
+    video_path,
+    audio_path,
+    start_time,
+    end_time,
+    video_out=None,
+    audio_channels=None,
+    video_codec="auto",
+):
+    """
+    Cut start_time..end_time out of the source files with a single ffmpeg
+    process. The trimmed mp4 is written to video_out, and when audio_channels
+    is set the audio is decoded once, at its source rate, into a float32
+    (frames, audio_channels) buffer read back from ffmpeg's stdout.
+    audio_path may be None when the audio is muxed into video_path.
+
+    video_codec is "copy", "libx264" or "auto". "auto" copies the video stream
+    when a keyframe lies on the cut, and re-encodes otherwise. "copy" always
+    copies and starts the cut on the previous keyframe.
+    Returns the start time that was actually used for the video, the decoded
+    audio (or None) and its sample rate.
+    """
+    inputs = {}
+    outputs = {}
+    duration = end_time - start_time
+    video_start = start_time
+
+    if video_out is not None:
+        codec = video_codec
+        if codec in ["auto", "copy"]:
+            keyframe = keyframe_before(video_path, start_time)
+            if keyframe is not None and (
+                codec == "copy" or start_time - keyframe <= KEYFRAME_TOLERANCE
+            ):
+                codec = "copy"
+                video_start = keyframe
+            else:
+                codec = "libx264"
+        inputs[video_path] = f"-ss {video_start}"
+        maps = "-map 0:v:0" if audio_path else "-map 0:v:0 -map 0:a:0?"
+        outputs[video_out] = (
+            f"{maps} -t {end_time - video_start} -c:v {codec} -c:a aac "
+            f"-movflags +faststart -y"
+        )
+
+    audio_rate = None
+    if audio_channels is not None:
+        audio_rate = probe_audio_rate(audio_path or video_path)
+        if audio_path:
+            inputs[audio_path] = f"-ss {start_time}"
+            audio_input = len(inputs) - 1
+            skip = ""
+        else:
+            # The audio is muxed into the video input, which may have been
+            # opened at an earlier keyframe; drop the difference after decoding.
+            if video_path not in inputs:
+                inputs[video_path] = f"-ss {start_time}"
+                video_start = start_time
+            audio_input = list(inputs).index(video_path)
+            skip = f"-ss {start_time - video_start} " if video_start < start_time else ""
+        outputs["pipe:1"] = (
+            f"-map {audio_input}:a:0 {skip}-t {duration} "
+            f"-f f32le -acodec pcm_f32le -ac {audio_channels}"
+        )
+
+    if not outputs:
+        return video_start, None, None
+
+    ff = ffmpy.FFmpeg(
+        inputs=inputs,
+        outputs=outputs,
+        global_options={"-loglevel error"},
+    )
+    stdout, _ = ff.run(stdout=sp.PIPE, stderr=sp.PIPE)
+    audio = None
+    if audio_channels is not None:
+        audio = np.frombuffer(stdout, dtype="<f4").reshape(-1, audio_channels)
+    return video_start, audio, audio_rate
@@ -1,124 +1,437 @@
-import csv
-
-class Data:
-    def __init__(
-        self, csv_path, label_path, allowed_classes=None, exclude_classes=None
-    ):
-        self.csv_path = csv_path
-        self.label_path = label_path
-        self.allowed_classes = allowed_classes
-        self.exclude_classes = exclude_classes
-
-        self.index = []
-        self.url = []
-        self.slink = "https://www.youtube.com/watch?v="
-        self.start = []
-        self.end = []
-        self.lables = []
-        self.id_lables = []
-        self.classes_name = []
-        self.classes_code = []
-
-        self.process()
-        self.label_process()
-        self.convert_labels()
-        self.subset_selection()
-
-        self.download_status = [False for _ in range(len(self.index))]
-
-    def process(self):
-        """
-        This function read the content of data csv file and store their information.
-        """
-        csv_content = read_csv(self.csv_path)
-        # Start form 3rd column because the priors are title
-        for idx, row in enumerate(csv_content[3:]):
-            self.index.append(idx)
-            self.url.append(self.slink + row[0])
-            self.start.append(float(row[1]))
-            self.end.append(float(row[2]))
-            self.lables.extend([row[3:]])   
-
-    def label_process(self):
-        """
-        This function read lable and corresponding codes from csv file.
-        """
-        labels = read_csv(self.label_path)
-        self.classes_name = [label[2] for label in labels[1:]]
-        self.classes_code = [label[1] for label in labels[1:]]
-        self.all_id = [label[0] for label in labels[1:]]
-
-    def convert_labels(self):
-        """
-        This function converts codes to the actual class names.
-        """
-        for i, row in enumerate(self.lables):
-            for j, label in enumerate(row):
-                idx = self.classes_code.index(label.replace('"', "").replace(" ", ""))
-                self.lables[i][j] = self.classes_name[idx]
-
-    def id_convert_labels(self):
-        labels = read_csv(self.label_path)
-        for i, (_, _, label) in enumerate(labels[1:]):
-            self.id_lables.append(label)
-
-    def subset_selection(self):
-        """
-        Modified function supports OR logic in a single string
-        """
-        selected_idx = []
-        # Use | to connect all category names
-        allowed_str = [
-            "Aircraft",
-            "Ambulance (siren)",
-            "Bicycle",
-            "Bird",
-            "Boom",
-            "Bus",
-            "Camera",
-            "Car",
-            "Cash register",
-            "Cat",
-            "Cattle, bovinae",
-            "Church bell",
-            "Clock",
-            "Dog",
-            "Mechanical fan",
-            "Fireworks",
-            "Goat",
-            "Gunshot, gunfire",
-            "Hammer",
-            "Horse",
-            "Motorcycle",
-            "Ocean",
-            "Pant",
-            "Pig",
-            "Printer",
-            "Rain",
-            "Sawing",
-            "Sewing machine",
-            "Skateboard",
-            "Stream",
-            "Thunderstorm",
-            "Train",
-            "Truck"
-        ]
-        self.allowed_classes = allowed_str
-        
-        for idx, label in enumerate(self.lables):
-            for i in self.allowed_classes:
-                if i in label:
-                    selected_idx.append(idx)
-        
-        self.index = [self.index[idx] for idx in selected_idx]
-        self.start = [self.start[idx] for idx in selected_idx]
-        self.end = [self.end[idx] for idx in selected_idx]
-        self.url = [self.url[idx] for idx in selected_idx]
-        self.lables = [self.lables[idx] for idx in selected_idx]
-        print("downloading data length: ", len(self.lables))
-
-def read_csv(path):
-    file = open(path)
-    content = list(csv.reader(file))
-    file.close()
-    return content
+import csv
+import hashlib
+import json
+import os
+import shutil
+import zlib
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# Classes downloaded when no --classes are given on the command line
+DEFAULT_CLASSES = [
+    "Aircraft",
+    "Ambulance (siren)",
+    "Bicycle",
+    "Bird",
+    "Boom",
+    "Bus",
+    "Camera",
+    "Car",
+    "Cash register",
+    "Cat",
+    "Cattle, bovinae",
+    "Church bell",
+    "Clock",
+    "Dog",
+    "Mechanical fan",
+    "Fireworks",
+    "Goat",
+    "Gunshot, gunfire",
+    "Hammer",
+    "Horse",
+    "Motorcycle",
+    "Ocean",
+    "Pant",
+    "Pig",
+    "Printer",
+    "Rain",
+    "Sawing",
+    "Sewing machine",
+    "Skateboard",
+    "Stream",
+    "Thunderstorm",
+    "Train",
+    "Truck",
+]
+
+_CACHE_COLUMNS = ["row", "ytids", "ytid_hash", "start", "end", "label_bits"]
+
+# Rows handled at a time while building and filtering the manifest
+CHUNK_SIZE = 1 << 16
+
+
+class _Column:
+    """
+    Read-only sequence that builds its items on access, so per-row values such
+    as urls and label names are never materialised for the whole manifest.
+    """
+
+    def __init__(self, getter, length):
+        self._getter = getter
+        self._length = length
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, idx):
+        return self._getter(idx)
+
+    def __iter__(self):
+        for idx in range(self._length):
+            yield self._getter(idx)
+
+
+class _Rows:
+    """
+    The selected rows of a memory-mapped cache column. Indexing reads only
+    the rows asked for, so a selection never copies the column into memory.
+    """
+
+    def __init__(self, column, rows):
+        self._column = column
+        self._rows = rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def shape(self):
+        return (len(self._rows),) + self._column.shape[1:]
+
+    @property
+    def dtype(self):
+        return self._column.dtype
+
+    def __getitem__(self, idx):
+        return self._column[self._rows[idx]]
+
+    def __iter__(self):
+        for lo in range(0, len(self._rows), CHUNK_SIZE):
+            yield from np.asarray(self._column[self._rows[lo:lo + CHUNK_SIZE]])
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self._column[self._rows], dtype=dtype)
+
+
+class Data:
+    """
+    Columnar view of an AudioSet segments csv.
+
+    Segment times are NumPy arrays, YTIDs are a fixed width string array and
+    the labels are a rows x ceil(n_classes / 8) bitset. The parsed columns are
+    cached as .npy files in cache_dir, keyed by a hash of the csv and label
+    files, and memory-mapped on later runs. shard=(i, N) keeps the i-th of N
+    disjoint slices, split by a stable hash of the YTID.
+
+    The class and shard selection only keeps the positions of the selected
+    rows in row; ytids, start, end and label_bits read those rows from the
+    memory-mapped columns when indexed.
+    """
+
+    def __init__(
+        self,
+        csv_path,
+        label_path,
+        allowed_classes=None,
+        exclude_classes=None,
+        cache_dir=None,
+        shard=None,
+    ):
+        self.csv_path = csv_path
+        self.label_path = label_path
+        self.allowed_classes = allowed_classes
+        self.exclude_classes = exclude_classes
+        self.shard = shard
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(csv_path) or ".", ".cache")
+
+        self.slink = "https://www.youtube.com/watch?v="
+        self.classes_name = []
+        self.classes_code = []
+        self.code_to_idx = {}
+        self.name_to_idx = {}
+
+        self.label_process()
+        self.process()
+        self.subset_selection()
+
+        self.download_status = np.zeros(len(self.index), dtype=bool)
+
+    def label_process(self):
+        """
+        This function read lable and corresponding codes from csv file.
+        """
+        labels = read_csv(self.label_path)
+        self.classes_name = [label[2] for label in labels[1:]]
+        self.classes_code = [label[1] for label in labels[1:]]
+        self.all_id = [label[0] for label in labels[1:]]
+        self.code_to_idx = {code: i for i, code in enumerate(self.classes_code)}
+        self.name_to_idx = {name: i for i, name in enumerate(self.classes_name)}
+
+    def process(self):
+        """
+        This function loads the manifest columns, from the cache when the csv
+        has not changed and by streaming the csv into a new cache otherwise.
+        """
+        cache_path = os.path.join(self.cache_dir, self.cache_key())
+        columns = load_columns(cache_path)
+        if columns is None:
+            build_columns(
+                cache_path,
+                iter_segments(self.csv_path),
+                count_segments(self.csv_path),
+                self.code_to_idx,
+                (len(self.classes_code) + 7) // 8,
+            )
+            columns = load_columns(cache_path)
+        self._columns = columns
+        # The cached row column holds each row's own position
+        self.row = columns["row"]
+
+    def cache_key(self):
+        """
+        This function hashes the csv and label files. The hash is remembered
+        by path, size and modification time in cache_dir/stamps.json, so an
+        unchanged manifest is not read again.
+        """
+        paths = [self.csv_path, self.label_path]
+        stamp = "|".join(
+            f"{os.path.abspath(path)}:{os.stat(path).st_size}:{os.stat(path).st_mtime_ns}"
+            for path in paths
+        )
+        stamps_path = os.path.join(self.cache_dir, "stamps.json")
+        try:
+            with open(stamps_path) as f:
+                stamps = json.load(f)
+        except (OSError, ValueError):
+            stamps = {}
+        if stamp in stamps:
+            return stamps[stamp]
+
+        digest = hashlib.blake2b(digest_size=16)
+        for path in paths:
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+        stamps[stamp] = digest.hexdigest()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{stamps_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(stamps, f)
+        os.replace(tmp_path, stamps_path)
+        return stamps[stamp]
+
+    def class_mask(self, names):
+        """
+        This function returns the packed bitset that has the given classes set.
+        """
+        labels = np.zeros(self.label_bits.shape[1] * 8, dtype=bool)
+        for name in names:
+            if name not in self.name_to_idx:
+                raise ValueError(f"Unknown class: {name}")
+            labels[self.name_to_idx[name]] = True
+        return np.packbits(labels)
+
+    @property
+    def ytids(self):
+        return _Rows(self._columns["ytids"], self.row)
+
+    @property
+    def ytid_hash(self):
+        return _Rows(self._columns["ytid_hash"], self.row)
+
+    @property
+    def start(self):
+        return _Rows(self._columns["start"], self.row)
+
+    @property
+    def end(self):
+        return _Rows(self._columns["end"], self.row)
+
+    @property
+    def label_bits(self):
+        return _Rows(self._columns["label_bits"], self.row)
+
+    def rows_with_any(self, names):
+        return (np.asarray(self.label_bits) & self.class_mask(names)).any(axis=1)
+
+    def subset_selection(self):
+        """
+        Keep the rows that have at least one allowed class, no excluded class
+        and belong to the selected shard. Each row is kept once, however many of
+        its classes match. The masks are computed in chunks so memory stays
+        bounded for the memory-mapped full manifest.
+        """
+        allowed = self.class_mask(self.allowed_classes) if self.allowed_classes else None
+        excluded = self.class_mask(self.exclude_classes) if self.exclude_classes else None
+        columns = self._columns
+        selected = np.ones(len(self.row), dtype=bool)
+        for lo in range(0, len(self.row), CHUNK_SIZE):
+            hi = lo + CHUNK_SIZE
+            label_bits = columns["label_bits"][lo:hi]
+            if allowed is not None:
+                selected[lo:hi] &= (label_bits & allowed).any(axis=1)
+            if excluded is not None:
+                selected[lo:hi] &= ~(label_bits & excluded).any(axis=1)
+            if self.shard is not None:
+                shard, num_shards = self.shard
+                selected[lo:hi] &= columns["ytid_hash"][lo:hi] % num_shards == shard
+
+        self.take(selected)
+        print("downloading data length: ", len(self.row))
+
+    def take(self, selected):
+        """
+        Keep only the selected rows, given as a boolean mask or row positions.
+        Only the row positions are copied, the columns stay memory-mapped.
+        """
+        self.row = np.asarray(self.row[selected])
+        if hasattr(self, "download_status"):
+            self.download_status = self.download_status[selected]
+
+    @property
+    def index(self):
+        return self.row
+
+    @property
+    def url(self):
+        return _Column(lambda idx: self.slink + str(self.ytids[idx]), len(self.row))
+
+    @property
+    def lables(self):
+        return _Column(self.labels_of, len(self.row))
+
+    def labels_of(self, idx):
+        """
+        This function returns the class names of one row.
+        """
+        labels = np.unpackbits(self.label_bits[idx], count=len(self.classes_name))
+        return [self.classes_name[i] for i in np.flatnonzero(labels)]
+
+
+def stable_hash(ytid):
+    """
+    This function hashes a YTID to the same value on every machine and run.
+    """
+    return zlib.crc32(ytid.encode("utf-8"))
+
+
+def parse_shard(text):
+    """
+    This function parses a "i/N" shard argument into (i, N).
+    """
+    shard, num_shards = (int(part) for part in text.split("/"))
+    if num_shards < 1 or not 0 <= shard < num_shards:
+        raise ValueError(f"Invalid shard {text}, expected i/N with 0 <= i < N")
+    return shard, num_shards
+
+
+def iter_segments(csv_path):
+    """
+    This function streams (ytid, start, end, label codes) from a segments csv
+    without reading the whole file. Every row is streamed, so the cache holds
+    the whole manifest; Data selects its shard on the cached columns.
+    """
+    with open(csv_path, newline="") as f:
+        for row in csv.reader(f, skipinitialspace=True):
+            # Skip the comment header
+            if not row or row[0].startswith("#"):
+                continue
+            codes = [code.replace('"', "").strip() for code in ",".join(row[3:]).split(",")]
+            yield row[0], float(row[1]), float(row[2]), codes
+
+
+def count_segments(csv_path):
+    with open(csv_path, "rb") as f:
+        return sum(1 for line in f if line.strip() and not line.startswith(b"#"))
+
+
+def load_columns(path):
+    if not os.path.isdir(path):
+        return None
+    try:
+        return {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in _CACHE_COLUMNS
+        }
+    except (OSError, ValueError):
+        return None
+
+
+def build_columns(path, segments, n_rows, code_to_idx, n_bytes):
+    """
+    This function streams segments into preallocated memory-mapped .npy
+    files, flushing every CHUNK_SIZE rows, so memory stays bounded for any
+    manifest size. The files are written into a fresh directory that is renamed
+    into place, so a crash never leaves a half written cache behind.
+    """
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    shapes = {
+        "row": (np.int64, (n_rows,)),
+        "ytids": ("U11", (n_rows,)),
+        "ytid_hash": (np.uint32, (n_rows,)),
+        "start": (np.float64, (n_rows,)),
+        "end": (np.float64, (n_rows,)),
+        "label_bits": (np.uint8, (n_rows, n_bytes)),
+    }
+    columns = {
+        name: open_memmap(os.path.join(tmp_path, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+        for name, (dtype, shape) in shapes.items()
+    }
+
+    def flush(lo, chunk, label_rows, label_cols):
+        hi = lo + len(chunk["ytids"])
+        columns["row"][lo:hi] = np.arange(lo, hi)
+        for name in ["ytids", "ytid_hash", "start", "end"]:
+            columns[name][lo:hi] = chunk[name]
+            chunk[name].clear()
+        label_bits = np.zeros((hi - lo, n_bytes), dtype=np.uint8)
+        label_cols = np.array(label_cols, dtype=np.int64)
+        np.bitwise_or.at(
+            label_bits,
+            (np.array(label_rows, dtype=np.int64), label_cols // 8),
+            (128 >> (label_cols % 8)).astype(np.uint8),
+        )
+        columns["label_bits"][lo:hi] = label_bits
+        return hi
+
+    lo = 0
+    chunk = {name: [] for name in ["ytids", "ytid_hash", "start", "end"]}
+    label_rows, label_cols = [], []
+    for ytid, start, end, codes in segments:
+        for code in codes:
+            label_rows.append(len(chunk["ytids"]))
+            label_cols.append(code_to_idx[code])
+        chunk["ytids"].append(ytid)
+        chunk["ytid_hash"].append(stable_hash(ytid))
+        chunk["start"].append(start)
+        chunk["end"].append(end)
+        if len(chunk["ytids"]) == CHUNK_SIZE:
+            lo = flush(lo, chunk, label_rows, label_cols)
+            label_rows, label_cols = [], []
+    lo = flush(lo, chunk, label_rows, label_cols)
+    if lo != n_rows:
+        raise ValueError(f"Expected {n_rows} segments in manifest, read {lo}")
+
+    for column in columns.values():
+        column.flush()
+    del columns
+    try:
+        os.replace(tmp_path, path)
+    except OSError:
+        # Another process cached the same manifest first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def manifest_jobs(data, indices):
+    """
+    This function yields the job dicts of the given manifest rows.
+    """
+    for idx in indices:
+        yield {
+            "row": int(idx),
+            "index": int(data.index[idx]),
+            "ytid": str(data.ytids[idx]),
+            "url": data.url[idx],
+            "labels": data.lables[idx],
+            "start": float(data.start[idx]),
+            "end": float(data.end[idx]),
+        }
+
+
+def read_csv(path):
+    file = open(path)
+    content = list(csv.reader(file))
+    file.close()
+    return content
@@ -0,0 +1,274 @@
+import math
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
+
+from utils.fsindex import FileIndex
+from utils.metacache import MetadataCache
+from utils.progress import DONE, ProgressStore
+from utils.resample import variant_dir
+from utils.shards import ShardReader
+from utils.store import LabelIndex, clip_paths
+from utils.utils import manifest_jobs
+from utils.workqueue import LeaseQueue
+
+# Allowed difference in seconds between an output and its segment
+AUDIO_TOLERANCE = 0.1
+VIDEO_TOLERANCE = 0.5
+# Audio quieter than this (dBFS) counts as silent
+SILENCE_DB = -70.0
+
+# ShardReader per shard directory, opened once per worker process
+_readers = {}
+
+
+def wav_data_chunk(path):
+    """
+    This function returns the offset and byte size of the data chunk of a
+    RIFF/WAVE file, reading only the chunk headers.
+    """
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:] != b"WAVE":
+            raise ValueError("not a RIFF/WAVE file")
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise ValueError("no data chunk")
+            name, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if name == b"data":
+                return f.tell(), size
+            f.seek(size + (size & 1), 1)
+
+
+def rms_db(samples):
+    """
+    This function returns the RMS level of int16 samples in dBFS.
+    """
+    if samples.size == 0:
+        return -math.inf
+    x = np.asarray(samples, dtype=np.float32) / 32768.0
+    return 20 * math.log10(math.sqrt(float(np.mean(x * x))) + 1e-12)
+
+
+def check_duration(seconds, expected, clamped, tolerance):
+    """
+    This function compares the length of an output with its segment and, when
+    the video is known to be shorter, with the segment clamped to the video.
+    Returns (error, note).
+    """
+    if abs(seconds - expected) <= tolerance:
+        return None, None
+    if clamped is not None and abs(seconds - clamped) <= tolerance:
+        return None, f"clamped to {clamped:.2f}s"
+    return f"duration {seconds:.2f}s, expected {expected:.2f}s", None
+
+
+def check_wav(path, sample_rate, channels, silence_db=SILENCE_DB):
+    """
+    This function checks a 16-bit wav from its header and a memory-mapped
+    view of its samples. Returns (error, seconds).
+    """
+    import soundfile as sf
+
+    try:
+        info = sf.info(path)
+        offset, size = wav_data_chunk(path)
+    except (RuntimeError, ValueError) as e:
+        return f"unreadable {path}: {e}", None
+    if info.samplerate != sample_rate or info.channels != channels:
+        return f"{path} is {info.samplerate} Hz x {info.channels}, expected {sample_rate} Hz x {channels}", None
+    if info.subtype != "PCM_16":
+        return f"{path} is {info.subtype}, expected PCM_16", None
+    available = os.path.getsize(path) - offset
+    if available < size:
+        return f"truncated {path}: {available} of {size} data bytes", None
+    n_samples = size // 2 - (size // 2) % channels
+    seconds = n_samples / channels / sample_rate
+    if n_samples:
+        samples = np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(n_samples,))
+        level = rms_db(samples)
+        del samples
+    else:
+        level = -math.inf
+    if level < silence_db:
+        return f"silent {path} ({level:.1f} dBFS)", seconds
+    return None, seconds
+
+
+def check_video(path):
+    """
+    This function checks that a video has a video stream and reads its
+    duration from the container. Returns (error, seconds).
+    """
+    import ffmpy
+
+    from utils.trim import probe_streams
+
+    # A missing ffprobe or an I/O error is not the clip's fault and is raised
+    try:
+        seconds, streams = probe_streams(path)
+    except (ffmpy.FFRuntimeError, ValueError) as e:
+        return f"unreadable {path}: {e}", None
+    if "video" not in streams:
+        return f"no video stream in {path}", None
+    if seconds is None:
+        return f"no duration in {path}", None
+    return None, seconds
+
+
+def check_shard_record(root, position, silence_db=SILENCE_DB):
+    if root not in _readers:
+        _readers[root] = ShardReader(root)
+    reader = _readers[root]
+    samples = reader[position]
+    seconds = len(samples) / reader.sample_rate
+    level = rms_db(samples)
+    if level < silence_db:
+        return f"silent shard record {position} ({level:.1f} dBFS)", seconds
+    return None, seconds
+
+
+def check_clip(task):
+    """
+    This function checks every output of one clip. task holds the expected
+    segment length, the clamped length when the video is known to be shorter,
+    and the audio, video and shard outputs. Returns (key, error, note).
+    """
+    error = note = None
+    checks = [
+        (lambda path=path, rate=rate, channels=channels: check_wav(path, rate, channels, task["silence_db"]),
+         AUDIO_TOLERANCE)
+        for path, rate, channels in task["audio"]
+    ]
+    checks += [(lambda path=path: check_video(path), VIDEO_TOLERANCE) for path in task["video"]]
+    if task["shard"] is not None:
+        checks.append((lambda: check_shard_record(*task["shard"], task["silence_db"]), AUDIO_TOLERANCE))
+    for check, tolerance in checks:
+        error, seconds = check()
+        if error is None:
+            error, clamped = check_duration(seconds, task["expected"], task["clamped"], tolerance)
+            note = note or clamped
+        if error is not None:
+            break
+    return task["key"], error, None if error else note
+
+
+def verify_outputs(split, args, tmp_dir, recheck=False, silence_db=SILENCE_DB):
+    """
+    This function verifies the outputs of the selected clips of a Split (see
+    utils.splits) that its progress store marks as done, on
+    args.process_workers processes.
+
+    Only headers are parsed (soundfile.info, the RIFF chunk list, ffprobe for
+    videos) and the samples are read through memory maps to measure the RMS
+    level. With the shard sink the first audio variant is checked in its
+    shard record and the other variants as files. Each output must decode, have the configured sample rate and
+    channels, last as long as its segment (or the segment clamped to a shorter
+    video, noted in the store) and not be silent. Clips that pass are marked
+    verified; clips that fail are marked failed, dropped from the label index
+    and put on the repair queue in tmp_dir/repair.sqlite, shared by all
+    splits, which `fetch --repair` drains. Their files are left in place for
+    the repair to overwrite. Failed clips written to shards keep their old
+    record, so readers should take the last record of a clip. A missing
+    ffprobe or an I/O error aborts the verification.
+    Without recheck only clips not verified before are checked.
+    """
+    data, data_dir = split.data, split.data_dir
+    if not os.path.exists(split.store_path):
+        return {"checked": 0, "ok": 0, "clamped": 0, "failed": 0}
+    store = ProgressStore(split.store_path)
+    done = store.keys(DONE) if recheck else store.keys(DONE, unverified=True)
+    clamped_lengths = store.clamped()
+    metadata_path = os.path.join(tmp_dir, "metadata.sqlite")
+    metadata = MetadataCache(metadata_path) if os.path.exists(metadata_path) else None
+
+    has_audio = args.mode in ["only_audio", "both_separate"]
+    has_video = args.mode in ["video", "only_video", "both_separate"]
+    shard_root = os.path.join(data_dir, "shards")
+    shard_positions = {}
+    if args.sink == "shards" and has_audio and os.path.isdir(shard_root):
+        records = ShardReader(shard_root).index
+        # The last record of a clip wins, earlier ones were repaired
+        for position, (ytid, start) in enumerate(zip(records["ytid"].astype(str), records["start"])):
+            shard_positions[(ytid, float(start))] = position
+    index = FileIndex.scan(data_dir)
+
+    tasks, failed = [], {}
+    rows = [i for i in range(len(data.row)) if (str(data.ytids[i]), float(data.start[i])) in done]
+    for job in manifest_jobs(data, rows):
+        job["split"] = split.name
+        job["repair"] = True
+        key = (job["ytid"], job["start"])
+        expected = job["end"] - job["start"]
+        clamped = clamped_lengths.get(key)
+        entry = metadata.entry(job["ytid"]) if clamped is None and metadata is not None else None
+        if entry and entry["duration"] and entry["duration"] < job["end"]:
+            # Clips downloaded before the store kept clamped lengths
+            clamped = entry["duration"] - job["start"]
+        task = {
+            "key": key, "expected": expected, "clamped": clamped, "silence_db": silence_db,
+            "audio": [], "video": [], "shard": None,
+        }
+        missing = []
+        for label in job["labels"]:
+            if has_audio:
+                # With shards the first variant is in the shard record, the others are files
+                first = 0 if args.sink == "files" else 1
+                for v, (rate, channels) in enumerate(args.sample_rate[first:], first):
+                    _, path = clip_paths(
+                        data_dir, job["index"], label, job["start"], job["end"],
+                        variant_dir(rate, channels, primary=v == 0),
+                    )
+                    task["audio"].append((path, rate, channels))
+            if has_audio and args.sink == "files":
+                if not index.has_output(job["index"], job["start"], job["end"], label, "audio"):
+                    missing.append(f"audio/{label}")
+            if has_video:
+                path, _ = clip_paths(data_dir, job["index"], label, job["start"], job["end"])
+                task["video"].append(path)
+                if not index.has_output(job["index"], job["start"], job["end"], label, "video"):
+                    missing.append(f"video/{label}")
+        if has_audio and args.sink == "shards":
+            if key in shard_positions:
+                task["shard"] = (shard_root, shard_positions[key])
+            else:
+                missing.append("shard record")
+        if missing:
+            failed[key] = (job, task, f"missing {', '.join(missing)}")
+        else:
+            tasks.append((job, task))
+
+    ok, notes = [], {}
+    with ProcessPoolExecutor(max_workers=args.process_workers) as pool:
+        results = pool.map(check_clip, [task for _, task in tasks], chunksize=64)
+        for (job, task), (key, error, note) in tqdm(zip(tasks, results), total=len(tasks), desc="Verifying"):
+            if error is None:
+                ok.append(key)
+                if note:
+                    notes[key] = note
+            else:
+                failed[key] = (job, task, error)
+
+    store.verified(ok, notes)
+    label_index = LabelIndex(os.path.join(data_dir, "index.sqlite")) if failed else None
+    for key, (job, task, error) in failed.items():
+        label_index.remove(key[0], key[1])
+        store.failed(key[0], key[1], f"verify: {error}")
+    repair = LeaseQueue(os.path.join(tmp_dir, "repair.sqlite"))
+    repair.load([job for job, _, _ in failed.values()], requeue=True)
+    repair.close()
+    if label_index is not None:
+        label_index.close()
+    store.close()
+    if metadata is not None:
+        metadata.close()
+    return {
+        "checked": len(rows),
+        "ok": len(ok),
+        "clamped": len(notes),
+        "failed": len(failed),
+    }
@@ -0,0 +1,325 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils.retry import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    ytid TEXT NOT NULL,
+    start REAL NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (ytid, start)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+"""
+
+
+class LeaseQueue:
+    """
+    Work queue of clips that hands out time-limited leases, kept in SQLite.
+
+    A worker acquires a batch of jobs, extends the leases with heartbeat() while
+    it works on them and reports each one with complete(). Leases that are not
+    renewed expire and the job goes back to pending, unless it has already been
+    leased max_attempts times. Several processes on one host may open the same
+    file; other hosts go through serve_queue() and RemoteLeaseQueue.
+    """
+
+    def __init__(self, path, lease_seconds=300.0, max_attempts=5):
+        self.path = str(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path, timeout=30.0, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, fn):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can
+        # never lease the same job
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def load(self, jobs, requeue=False):
+        """
+        Add jobs (dicts with at least "ytid" and "start"); jobs already in the
+        queue are left as they are, or put back to pending with requeue.
+        Returns the number of new or requeued jobs.
+        """
+        now = time.time()
+        rows = [
+            (job["ytid"], float(job["start"]), json.dumps(job), PENDING, now)
+            for job in jobs
+        ]
+
+        def insert(conn):
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT INTO jobs (ytid, start, payload, state, updated) VALUES (?, ?, ?, ?, ?) "
+                + (
+                    "ON CONFLICT (ytid, start) DO UPDATE SET payload = excluded.payload, "
+                    "state = excluded.state, owner = NULL, attempts = 0, error = NULL, "
+                    "updated = excluded.updated WHERE state != 'leased'"
+                    if requeue else "ON CONFLICT (ytid, start) DO NOTHING"
+                ),
+                rows,
+            )
+            return conn.total_changes - before
+
+        return self._transaction(insert)
+
+    def acquire(self, worker_id, n=1):
+        """
+        Lease up to n pending jobs to worker_id, after re-queueing expired leases.
+        """
+        def lease(conn):
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET state = ?, owner = NULL, error = 'lease expired', updated = ? "
+                "WHERE state = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, now, LEASED, now, self.max_attempts),
+            )
+            conn.execute(
+                "UPDATE jobs SET state = ?, owner = NULL, updated = ? "
+                "WHERE state = ? AND lease_expires < ?",
+                (PENDING, now, LEASED, now),
+            )
+            rows = conn.execute(
+                "SELECT ytid, start, payload FROM jobs WHERE state = ? LIMIT ?",
+                (PENDING, n),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET state = ?, owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated = ? WHERE ytid = ? AND start = ?",
+                [(LEASED, worker_id, now + self.lease_seconds, now, ytid, start)
+                 for ytid, start, _ in rows],
+            )
+            return [json.loads(payload) for _, _, payload in rows]
+
+        return self._transaction(lease)
+
+    def heartbeat(self, worker_id, keys):
+        """
+        Extend the leases that worker_id still holds on the given
+        (ytid, start) keys. Returns the number of leases extended.
+        """
+        def extend(conn):
+            now = time.time()
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE jobs SET lease_expires = ?, updated = ? "
+                "WHERE ytid = ? AND start = ? AND owner = ? AND state = ?",
+                [(now + self.lease_seconds, now, ytid, float(start), worker_id, LEASED)
+                 for ytid, start in keys],
+            )
+            return conn.total_changes - before
+
+        return self._transaction(extend)
+
+    def complete(self, worker_id, ytid, start, result=None, error=None):
+        """
+        Record the outcome of a leased job. A report from a worker whose lease
+        has been taken over by another worker is ignored.
+        """
+        def finish(conn):
+            cursor = conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, error = ?, owner = NULL, updated = ? "
+                "WHERE ytid = ? AND start = ? AND owner = ? AND state = ?",
+                (FAILED if error else DONE, json.dumps(result), error, time.time(),
+                 ytid, float(start), worker_id, LEASED),
+            )
+            return cursor.rowcount > 0
+
+        return self._transaction(finish)
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        return dict(rows)
+
+
+class RemoteLeaseQueue:
+    """
+    Client for a LeaseQueue served by serve_queue() on another host.
+
+    Connection errors and server errors are retried max_retries times after
+    a jittered exponential backoff, so a coordinator restart or a dropped
+    connection does not end the worker while it holds leases.
+    """
+
+    def __init__(self, url, timeout=30.0, max_retries=6):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    def _call(self, method, **params):
+        data = json.dumps(params).encode("utf-8")
+        attempt = 0
+        while True:
+            request = urllib.request.Request(
+                f"{self.url}/{method}", data=data, headers={"Content-Type": "application/json"},
+            )
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                # A client error such as an unknown method will not go away
+                if e.code < 500 or attempt >= self.max_retries:
+                    raise
+                error = e
+            except OSError as e:
+                # URLError, timeouts and refused or reset connections
+                if attempt >= self.max_retries:
+                    raise
+                error = e
+            delay = backoff_delay(attempt)
+            logger.warning(f"Coordinator call {method} failed ({error}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+    def acquire(self, worker_id, n=1):
+        return self._call("acquire", worker_id=worker_id, n=n)
+
+    def heartbeat(self, worker_id, keys):
+        return self._call("heartbeat", worker_id=worker_id, keys=[list(key) for key in keys])
+
+    def complete(self, worker_id, ytid, start, result=None, error=None):
+        return self._call(
+            "complete", worker_id=worker_id, ytid=ytid, start=start, result=result, error=error
+        )
+
+    def counts(self):
+        return self._call("counts")
+
+
+def serve_queue(queue, host="0.0.0.0", port=8765):
+    """
+    Serve a LeaseQueue to RemoteLeaseQueue clients over HTTP (JSON POST bodies).
+    Returns the server; call serve_forever() on it, or shutdown() to stop.
+    """
+    methods = {
+        "acquire": lambda p: queue.acquire(p["worker_id"], p.get("n", 1)),
+        "heartbeat": lambda p: queue.heartbeat(p["worker_id"], [tuple(key) for key in p["keys"]]),
+        "complete": lambda p: queue.complete(
+            p["worker_id"], p["ytid"], p["start"], p.get("result"), p.get("error")
+        ),
+        "counts": lambda p: queue.counts(),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            method = methods.get(self.path.strip("/"))
+            if method is None:
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            params = json.loads(self.rfile.read(length) or b"{}")
+            body = json.dumps(method(params)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def leased_jobs(queue, worker_id, heartbeat, batch_size=8, poll_interval=5.0):
+    """
+    Yield jobs leased from queue until it has nothing pending or leased left.
+    Each job is held by heartbeat until the caller releases it after
+    reporting the job with complete().
+    """
+    while True:
+        jobs = queue.acquire(worker_id, batch_size)
+        if not jobs:
+            counts = queue.counts()
+            if not counts.get(PENDING) and not counts.get(LEASED):
+                return
+            # Other workers still hold leases that may expire and come back
+            time.sleep(poll_interval)
+            continue
+        for job in jobs:
+            heartbeat.hold(job["ytid"], job["start"])
+            yield job
+
+
+class LeaseHeartbeat:
+    """
+    Background thread that renews the leases of the jobs a worker holds.
+    """
+
+    def __init__(self, queue, worker_id, interval):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.interval = interval
+        self.held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def hold(self, ytid, start):
+        with self._lock:
+            self.held.add((ytid, float(start)))
+
+    def release(self, ytid, start):
+        with self._lock:
+            self.held.discard((ytid, float(start)))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                keys = list(self.held)
+            if keys:
+                try:
+                    self.queue.heartbeat(self.worker_id, keys)
+                except Exception as e:
+                    # The next beat retries; the leases outlive several beats
+                    logger.warning(f"Lease heartbeat of {len(keys)} jobs failed: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False